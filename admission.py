@@ -0,0 +1,243 @@
+"""
+推論請求的准入控制
+
+同時處理的請求數有上限，超過時最多再排隊 max_waiting 個、每個最多等 max_wait 秒；
+排隊已滿或等待逾時的請求立即以 Overloaded 拒絕，由呼叫端回應 503 與 Retry-After。
+線程以 enter() 排隊，事件迴圈中的協程以 enter_async() 排隊，兩者共用同一組空位與排隊上限。
+寧可讓大部分請求快速完成，也不要所有請求一起變慢。RateLimiter 另外以令牌桶限制單一用戶端的請求速率。
+"""
+import asyncio
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Dict, Hashable
+
+
+class Overloaded(Exception):
+    def __init__(self, reason: str, retry_after: float):
+        """
+        Args:
+            reason: queue_full（排隊已滿）、timeout（等待逾時）或 rate_limited（超過用戶端速率限制）
+            retry_after: 建議用戶端幾秒後重試
+        """
+        super().__init__(reason)
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class AdmissionController:
+    def __init__(self, max_active: int, max_waiting: int, max_wait: float, retry_after: float = 1.0):
+        """
+        Args:
+            max_active: 同時處理的請求數上限
+            max_waiting: 等待空位的請求數上限，超過時立即拒絕
+            max_wait: 每個請求最多等待空位的時間（秒）
+            retry_after: 拒絕時建議用戶端重試的秒數
+        """
+        self.max_active = max_active
+        self.max_waiting = max_waiting
+        self.max_wait = max_wait
+        self.retry_after = retry_after
+        self._cond = threading.Condition()
+        self._active = 0
+        self._waiting = 0
+        self._async_waiters = []  # (事件迴圈, Future)，空位釋放時依序喚醒
+
+        # 統計資料
+        self.admitted = 0
+        self.shed: Dict[str, int] = {'queue_full': 0, 'timeout': 0}
+
+    @property
+    def active(self) -> int:
+        return self._active
+
+    @property
+    def waiting(self) -> int:
+        return self._waiting
+
+    def enter(self) -> float:
+        """
+        取得一個處理空位，必要時排隊等待
+
+        Returns:
+            float: 等待的秒數
+
+        Raises:
+            Overloaded: 排隊已滿或等待逾時
+        """
+        with self._cond:
+            if self._take():
+                return 0.0
+            if self._waiting >= self.max_waiting:
+                self.shed['queue_full'] += 1
+                raise Overloaded('queue_full', self.retry_after)
+            self._waiting += 1
+            start = time.monotonic()
+            deadline = start + self.max_wait
+            try:
+                while not self._take():
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self.shed['timeout'] += 1
+                        raise Overloaded('timeout', self.retry_after)
+                    self._cond.wait(remaining)
+            finally:
+                self._waiting -= 1
+            return time.monotonic() - start
+
+    def try_enter(self) -> bool:
+        """有空位時立即取得並回傳 True，不排隊"""
+        with self._cond:
+            return self._take()
+
+    async def enter_async(self) -> float:
+        """
+        enter() 的 asyncio 版本：在事件迴圈中等待空位，不佔用任何線程
+
+        Returns:
+            float: 等待的秒數
+
+        Raises:
+            Overloaded: 排隊已滿或等待逾時
+        """
+        if self.try_enter():
+            return 0.0
+        loop = asyncio.get_running_loop()
+        with self._cond:
+            if self._waiting >= self.max_waiting:
+                self.shed['queue_full'] += 1
+                raise Overloaded('queue_full', self.retry_after)
+            self._waiting += 1
+        start = time.monotonic()
+        deadline = start + self.max_wait
+        try:
+            while True:
+                waiter = (loop, loop.create_future())
+                with self._cond:
+                    if self._take():
+                        return time.monotonic() - start
+                    self._async_waiters.append(waiter)
+                try:
+                    await asyncio.wait_for(waiter[1], deadline - time.monotonic())
+                except asyncio.TimeoutError:
+                    self._abandon(waiter)
+                    with self._cond:
+                        self.shed['timeout'] += 1
+                    raise Overloaded('timeout', self.retry_after)
+                except asyncio.CancelledError:
+                    self._abandon(waiter)
+                    raise
+        finally:
+            with self._cond:
+                self._waiting -= 1
+
+    def leave(self) -> None:
+        """釋放 enter()、try_enter() 或 enter_async() 取得的空位"""
+        with self._cond:
+            self._active -= 1
+            self._notify()
+
+    def _take(self) -> bool:
+        # 呼叫端需持有 self._cond
+        if self._active >= self.max_active:
+            return False
+        self._active += 1
+        self.admitted += 1
+        return True
+
+    def _abandon(self, waiter) -> None:
+        """等待者逾時或被取消；若已被喚醒，把喚醒轉給下一個等待者，避免空位閒置"""
+        with self._cond:
+            if waiter in self._async_waiters:
+                self._async_waiters.remove(waiter)
+            else:
+                self._notify()
+
+    def _notify(self) -> None:
+        # 呼叫端需持有 self._cond；線程與協程各喚醒一個，沒搶到空位的會繼續等待
+        self._cond.notify()
+        while self._async_waiters:
+            loop, future = self._async_waiters.pop(0)
+            try:
+                loop.call_soon_threadsafe(_wake, future)
+                return
+            except RuntimeError:  # 事件迴圈已關閉
+                continue
+
+    @contextmanager
+    def slot(self):
+        self.enter()
+        try:
+            yield
+        finally:
+            self.leave()
+
+    def stats(self) -> dict:
+        return {
+            'active': self._active,
+            'waiting': self._waiting,
+            'max_active': self.max_active,
+            'max_waiting': self.max_waiting,
+            'admitted': self.admitted,
+            'shed': dict(self.shed),
+        }
+
+
+class RateLimiter:
+    def __init__(self, rate: float, burst: float, max_clients: int = 10000):
+        """
+        每個用戶端一個令牌桶
+
+        Args:
+            rate: 每秒補充的令牌數（長期平均的請求速率）
+            burst: 令牌桶容量（允許的瞬間突發請求數）
+            max_clients: 最多追蹤的用戶端數，超過時淘汰最久沒有請求的用戶端
+        """
+        self.rate = rate
+        self.burst = burst
+        self.max_clients = max_clients
+        self._buckets: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+
+        # 統計資料
+        self.limited = 0
+
+    def check(self, client: Hashable) -> float:
+        """
+        消耗一個令牌
+
+        Returns:
+            float: 0 表示允許；否則為還要等幾秒才有令牌
+        """
+        now = time.monotonic()
+        with self._lock:
+            tokens, last = self._buckets.pop(client, (self.burst, now))
+            tokens = min(self.burst, tokens + (now - last) * self.rate)
+            if tokens >= 1:
+                tokens -= 1
+                wait = 0.0
+            else:
+                wait = (1 - tokens) / self.rate
+                self.limited += 1
+            self._buckets[client] = (tokens, now)
+            while len(self._buckets) > self.max_clients:
+                self._buckets.popitem(last=False)
+        return wait
+
+    def acquire(self, client: Hashable) -> None:
+        """
+        Raises:
+            Overloaded: 超過速率限制（reason 為 rate_limited）
+        """
+        wait = self.check(client)
+        if wait > 0:
+            raise Overloaded('rate_limited', wait)
+
+    def __len__(self) -> int:
+        return len(self._buckets)
+
+
+def _wake(future) -> None:
+    if not future.done():
+        future.set_result(None)
@@ -1,13 +1,63 @@
-from flask import Flask, render_template, request, redirect, url_for, flash
-from werkzeug.utils import secure_filename
+from flask import (Flask, render_template, request, redirect, url_for, flash, jsonify, Response, stream_with_context, g,
+                   abort, send_from_directory)
 import os
+import time
+import math
+import atexit
 import logging
-import json
-from model_utils import FashionModel, get_recommendation
+import threading
+from collections.abc import Mapping
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from flask.json.provider import DefaultJSONProvider
+from model_utils import FashionModel, get_recommendation, confidence_level, BATCH_SIZE, STYLES, COLOR_COMBINATIONS
+from batch_scheduler import BatchScheduler
+from inference_pool import InferencePool
+from prediction_cache import PredictionCache
+from image_io import ImageValidationError, read_upload, inspect_image
+from admission import AdmissionController, Overloaded, RateLimiter
+from upload_storage import UploadStorage
+from static_assets import StaticFingerprints
+from image_variants import ImageVariants, VARIANT_FOLDER
+from model_loader import ModelLoader, FAILED
+from arduino_controller import ArduinoController
+from hardware_bridge import HardwareBridge, format_sse
+from similarity_index import BASE_DIR, INDEX_PATH, SimilarityIndex, describe
+from color_analysis import ColorAnalyzer
+from fragment_cache import FragmentCache
+import metrics
+from metrics import Counter, Gauge, Histogram, STAGE_SECONDS
+from werkzeug.serving import is_running_from_reloader
+
+class FrozenJSONProvider(DefaultJSONProvider):
+    """搭配建議來自唯讀的 STYLE_TABLE（MappingProxyType），輸出 JSON 時轉成一般 dict"""
+
+    @staticmethod
+    def default(o):
+        if isinstance(o, Mapping):
+            return dict(o)
+        return DefaultJSONProvider.default(o)
+
+def default_inference_workers():
+    """
+    每個網頁行程的推論工作行程數預設值：以 WSGI/ASGI 伺服器的 WEB_CONCURRENCY 平分 CPU 核心，
+    網頁行程數不少於核心數時為 0（直接在網頁行程內推論），整台機器的推論行程總數不超過核心數
+    """
+    cores = os.cpu_count() or 1
+    try:
+        web_workers = max(1, int(os.environ.get('WEB_CONCURRENCY', '1')))
+    except ValueError:
+        web_workers = 1
+    return cores // web_workers
 
 app = Flask(__name__)
+app.json = FrozenJSONProvider(app)
 app.secret_key = 'your-secret-key'
 
+# 靜態檔案網址加上內容指紋，並以長效快取提供
+static_fingerprints = StaticFingerprints(app)
+# 多尺寸 WebP / JPEG 衍生圖片，模板以 srcset 挑選
+image_variants = ImageVariants(app)
+
 # 設定上傳資料夾
 UPLOAD_FOLDER = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'static', 'uploads')
 STYLE_IMAGES_FOLDER = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'static', 'style_images')
@@ -15,6 +65,42 @@ COLOR_IMAGES_FOLDER = os.path.join(os.path.dirname(os.path.abspath(__file__)), '
 
 app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
 ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif'}
+MAX_BATCH_FILES = 64  # 批次 API 單次最多接受的檔案數
+BATCH_WINDOW = 0.005  # 微批次等待時間窗（秒）
+PREDICT_TIMEOUT = 10.0  # 等待批次結果的最長時間（秒）
+PREDICTION_CACHE_SIZE = 4096  # 預測快取最多保留的筆數
+PREDICTION_CACHE_FILE = os.path.join(app.instance_path, 'prediction_cache.json')
+UPLOAD_MAX_AGE = 7 * 24 * 3600  # 上傳圖片保存期限（秒）
+UPLOAD_QUOTA_BYTES = 512 * 1024 * 1024  # 上傳圖片容量上限（包含 static/variants/uploads 下的衍生檔）
+UPLOAD_SWEEP_INTERVAL = 600  # 背景清理間隔（秒）
+# 推論工作行程數（每個網頁行程各自一組），0 表示直接在網頁行程內推論；可用 FASHION_INFERENCE_WORKERS 指定
+INFERENCE_WORKERS = int(os.environ.get('FASHION_INFERENCE_WORKERS', default_inference_workers()))
+MODEL_RETRY_INTERVAL = 30  # 模型載入失敗後重試的間隔（秒）
+MODEL_RETRY_AFTER = 2  # 模型尚未就緒時，建議用戶端幾秒後重試
+MODEL_ENDPOINTS = {'index', 'predict_batch', 'api_predict', 'api_predict_stream'}  # 需要模型才能處理 POST 的端點
+USE_RELOADER = True  # 直接執行 app.py 時是否啟用除錯重新載入器
+ARDUINO_PORT = 'COM3'  # Arduino 串口
+ARDUINO_BAUDRATE = 9600
+ARDUINO_RETRY_INTERVAL = 30  # 找不到 Arduino 時重試連線的間隔（秒）
+ARDUINO_ENABLED = os.environ.get('FASHION_ARDUINO', '1') != '0'  # FASHION_ARDUINO=0 時不連接 Arduino
+# 多個網頁行程共用 Arduino 的本機中繼埠：綁定成功的行程開啟串口，其他行程經由它轉送；0 表示本行程直接開啟串口
+ARDUINO_RELAY_PORT = int(os.environ.get('FASHION_ARDUINO_RELAY_PORT', '47653'))
+HARDWARE_SIGNAL_CAPACITY = 64  # 送往 Arduino 的訊號最多排隊筆數，滿了時丟棄最舊的
+EVENT_KEEPALIVE = 15  # /events 串流沒有事件時送出保持連線註解的間隔（秒）
+MAX_REQUEST_BYTES = 64 * 1024 * 1024  # 單一請求的內容上限（MAX_CONTENT_LENGTH），在讀取內容前就檢查
+MAX_ACTIVE_REQUESTS = 2 * BATCH_SIZE  # 同時處理的辨識請求數上限
+MAX_QUEUED_REQUESTS = 64  # 等待處理空位的請求數上限，超過時立即回應 503
+MAX_QUEUE_WAIT = 2.0  # 等待處理空位的最長時間（秒），逾時回應 503
+OVERLOAD_RETRY_AFTER = 1  # 過載時建議用戶端幾秒後重試
+CLIENT_RATE_LIMIT = None  # 每個用戶端的令牌桶（每秒請求數, 突發量），例如 (2, 10)；None 表示不限制
+SIMILAR_ITEMS = 4  # 結果頁顯示的相似圖片數
+REFERENCE_CANDIDATES = 10  # 挑選風格與配色時參考的相似圖片數
+SIMILAR_IMAGE_MAX_AGE = 24 * 3600  # 相似圖片的瀏覽器快取時間（秒）
+CACHEABLE_ENDPOINTS = {'static', 'similar_image'}  # 不加上 no-store 標頭的端點
+app.config['MAX_CONTENT_LENGTH'] = MAX_REQUEST_BYTES
+API_WORKERS = 4  # JSON API 處理圖片的線程數；模型推論仍由批次排程器合併成批次
+NDJSON_MIMETYPE = 'application/x-ndjson'
+RAW_IMAGE_MIMETYPES = {'image/jpeg', 'image/png', 'image/gif', 'application/octet-stream'}  # 請求內容即圖片本身
 
 # 設定日誌
 logging.basicConfig(level=logging.INFO)
@@ -28,72 +114,625 @@ for folder in [UPLOAD_FOLDER, STYLE_IMAGES_FOLDER, COLOR_IMAGES_FOLDER]:
     except Exception as e:
         logger.error(f"創建目錄時發生錯誤：{str(e)}")
 
-# 初始化模型
-try:
-    model = FashionModel()
+# 上傳圖片分層存放，背景依保存期限與容量上限清理；衍生檔計入容量並與原圖一起清除
+upload_storage = UploadStorage(UPLOAD_FOLDER,
+                               max_age=UPLOAD_MAX_AGE,
+                               max_bytes=UPLOAD_QUOTA_BYTES,
+                               sweep_interval=UPLOAD_SWEEP_INTERVAL,
+                               derived_root=os.path.join(app.static_folder, VARIANT_FOLDER, 'uploads'))
+
+# 模型、推論後端、批次排程器與預測快取在背景載入完成後才會設定
+model = None
+inference = None  # 提供 predict_batch 的推論後端：多行程推論池，或模型本身
+scheduler = None
+prediction_cache = None
+similarity_index = None  # 參考圖片的視覺相似度索引，載入失敗時為 None
+
+# 上傳圖片的主要顏色分析，各配色方案的代表色在這裡先轉好
+color_analyzer = ColorAnalyzer(COLOR_COMBINATIONS)
+
+# 辨識請求的准入控制：限制同時處理數與排隊長度，過載時快速拒絕
+admission = AdmissionController(MAX_ACTIVE_REQUESTS, MAX_QUEUED_REQUESTS, MAX_QUEUE_WAIT,
+                                retry_after=OVERLOAD_RETRY_AFTER)
+rate_limiter = RateLimiter(*CLIENT_RATE_LIMIT) if CLIENT_RATE_LIMIT else None
+
+# JSON API 的圖片處理（解碼、等待模型結果、顏色分析）在這裡執行，不佔用接收請求的線程或事件迴圈
+api_executor = ThreadPoolExecutor(max_workers=API_WORKERS, thread_name_prefix='api')
+
+# 搭配建議區塊的渲染結果；參考圖片的衍生檔產生完成後 srcset 會改變，需要重新渲染
+recommendation_fragments = FragmentCache(version=lambda: image_variants.generation)
+
+def create_inference_backend(loaded_model):
+    """建立多行程推論池，前向傳播不再和請求處理線程搶 GIL；失敗時退回行程內推論"""
+    if not INFERENCE_WORKERS:
+        return loaded_model
+    pool = InferencePool(loaded_model, processes=INFERENCE_WORKERS, max_batch_size=BATCH_SIZE)
+    try:
+        pool.start()
+    except Exception as e:
+        logger.error(f"啟動推論工作行程池失敗，改在網頁行程內推論：{str(e)}")
+        return loaded_model
+    atexit.register(pool.stop)
+    return pool
+
+def on_model_ready(loaded_model):
+    """模型預熱完成後建立推論後端、批次排程器與預測快取（在載入線程中執行）"""
+    global model, inference, scheduler, prediction_cache, similarity_index
+    # 以圖片摘要快取預測結果，重複上傳的圖片不必再跑模型
+    prediction_cache = PredictionCache(max_entries=PREDICTION_CACHE_SIZE,
+                                       persist_path=PREDICTION_CACHE_FILE,
+                                       namespace=loaded_model.version)
+    inference = create_inference_backend(loaded_model)
+    # 同時到達的上傳請求合併成一個批次執行；每個工作行程同時處理一個批次
+    scheduler = BatchScheduler(inference, max_batch_size=BATCH_SIZE, max_wait=BATCH_WINDOW,
+                               workers=getattr(inference, 'processes', 1))
+    scheduler.start()
+    # 索引由 python similarity_index.py 離線建立，啟動時只以 mmap 載入，不掃描圖片目錄
+    try:
+        similarity_index = SimilarityIndex.load(INDEX_PATH)
+        logger.info(f"相似圖片索引已載入：{len(similarity_index)} 張圖片")
+    except FileNotFoundError:
+        logger.warning("尚未建立相似圖片索引（python similarity_index.py），暫不提供相似單品")
+    except Exception as e:
+        logger.error(f"無法載入相似圖片索引，暫不提供相似單品：{str(e)}")
+    model = loaded_model
     logger.info("模型初始化成功")
-except Exception as e:
-    logger.error(f"模型初始化失敗：{str(e)}")
-    model = None
+
+def save_prediction_cache():
+    if prediction_cache is not None:
+        prediction_cache.save()
+
+# 在背景載入並預熱模型，伺服器啟動後立即可以回應，模型就緒前需要模型的請求回應 503
+model_loader = ModelLoader(FashionModel, retry_interval=MODEL_RETRY_INTERVAL)
+model_loader.on_ready(on_model_ready)
+atexit.register(save_prediction_cache)
+
+# 預測結果以不阻塞的方式送往 Arduino；設備的按鈕事件透過 /events 推送給瀏覽器
+hardware_bridge = HardwareBridge(lambda: ArduinoController(ARDUINO_PORT, ARDUINO_BAUDRATE),
+                                 capacity=HARDWARE_SIGNAL_CAPACITY,
+                                 retry_interval=ARDUINO_RETRY_INTERVAL,
+                                 style_names=list(STYLES),
+                                 relay_address=('127.0.0.1', ARDUINO_RELAY_PORT) if ARDUINO_RELAY_PORT else None)
+atexit.register(hardware_bridge.stop)
+
+# Prometheus 指標，由 /metrics 輸出；各處理階段的耗時記錄在 STAGE_SECONDS
+REQUEST_SECONDS = Histogram('fashion_request_seconds', '各端點的請求處理時間（秒）', ('endpoint',))
+CACHE_LOOKUPS = Counter('fashion_prediction_cache_lookups_total', '預測快取查詢次數', ('result',))
+UPLOADS_REJECTED = Counter('fashion_uploads_rejected_total', '被拒絕的上傳', ('reason',))
+MODEL_ERRORS = Counter('fashion_model_errors_total', '模型預測失敗的次數（例外、逾時或無法辨識的圖片）')
+Gauge('fashion_model_ready', '模型是否已載入並預熱完成').set_function(lambda: int(model_loader.ready))
+Gauge('fashion_scheduler_queue_depth', '等待合併成批次的預測請求數').set_function(
+    lambda: scheduler.request_queue.qsize() if scheduler is not None else 0)
+Gauge('arduino_connected', 'Arduino 是否已連接').set_function(lambda: int(hardware_bridge.connected))
+Gauge('arduino_signal_queue_depth', '等待送往 Arduino 的訊號數').set_function(lambda: len(hardware_bridge.signals))
+Counter('arduino_signals_dropped_total', '訊號通道已滿而被丟棄的舊訊號數').set_function(
+    lambda: hardware_bridge.signals.dropped)
+REQUESTS_SHED = Counter('fashion_requests_shed_total', '准入控制拒絕的請求（too_large、rate_limited、queue_full、timeout）',
+                        ('reason',))
+QUEUE_WAIT_SECONDS = STAGE_SECONDS.labels('admission')  # 等待處理空位的時間
+Gauge('fashion_admission_active', '正在處理的辨識請求數').set_function(lambda: admission.active)
+Gauge('fashion_admission_waiting', '等待處理空位的辨識請求數').set_function(lambda: admission.waiting)
+FRAGMENT_LOOKUPS = Counter('fashion_fragment_cache_lookups_total', '搭配建議片段快取查詢次數', ('result',))
+FRAGMENT_LOOKUPS.labels('hit').set_function(lambda: recommendation_fragments.hits)
+FRAGMENT_LOOKUPS.labels('miss').set_function(lambda: recommendation_fragments.misses)
+
+def start_services():
+    """啟動背景服務：參考圖片衍生檔、上傳目錄清理、模型載入與 Arduino 連線"""
+    image_variants.generate_references_async()
+    upload_storage.start()
+    model_loader.start()
+    if ARDUINO_ENABLED:
+        hardware_bridge.start()
+
+# 由 WSGI 伺服器匯入時立即啟動；直接執行時在 __main__ 區塊中決定。
+# 推論工作行程以 spawn 啟動時會把本檔案匯入為 __mp_main__，這時不能再啟動任何服務
+if __name__ not in ('__main__', '__mp_main__'):
+    start_services()
 
 def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
+def cached_predict(digest, image):
+    """
+    先查預測快取，未命中才送入模型
+
+    Args:
+        digest: 圖片內容摘要
+        image: 送入模型的輸入（bytes 或陣列）
+    """
+    cached = prediction_cache.get(digest)
+    if cached is not None:
+        CACHE_LOOKUPS.labels('hit').inc()
+        logger.info(f"預測快取命中：{digest[:12]}")
+        return cached
+    CACHE_LOOKUPS.labels('miss').inc()
+    label, confidence = scheduler.predict(image, timeout=PREDICT_TIMEOUT)
+    if confidence > 0:
+        prediction_cache.put(digest, label, confidence)
+    else:
+        MODEL_ERRORS.inc()
+    return label, confidence
+
+def find_similar(pixels):
+    """
+    以上傳圖片的色彩與紋理描述子檢索參考圖片
+
+    Returns:
+        tuple: (顯示用的相似圖片 [(路徑, 相似度)], 挑選風格與配色用的參考圖片路徑（相對於 static/）)
+    """
+    if similarity_index is None:
+        return [], []
+    descriptor = describe(pixels)
+    similar = similarity_index.search(descriptor, SIMILAR_ITEMS)
+    references = [path[len('static/'):] for path, _ in
+                  similarity_index.search(descriptor, REFERENCE_CANDIDATES, prefix='static/')]
+    return similar, references
+
+def render_recommendation(label, confidence, recommendations):
+    """
+    取得搭配建議區塊的 HTML；相同（標籤, 信心度分級, 風格, 色系）只渲染一次
+
+    Args:
+        recommendations: get_recommendation() 的結果
+    """
+    style = recommendations['style']
+    key = (label, confidence_level(confidence), style['風格'], style['主要色系'])
+    return recommendation_fragments.get(key, lambda: render_template(
+        '_recommendation.html',
+        basic_recommendation=recommendations['basic'],
+        style_recommendation=style))
+
+def classify_image(data, digest):
+    """
+    JSON API 的單張圖片處理：驗證、解碼、預測、顏色分析與搭配建議。
+    不需要請求情境，可以在 api_executor 中執行
+
+    Args:
+        data: 圖片內容
+        digest: 圖片內容摘要
+
+    Returns:
+        dict: label、confidence、colors（主要顏色）與 recommendation（與批次 API 相同的結構）
+    """
+    inspect_image(data)
+    pixels = model.preprocessor.decode(data)
+    label, confidence = cached_predict(digest, pixels)
+    _, references = find_similar(pixels)
+    colors = color_analyzer.analyze(pixels)
+    return {
+        'label': label,
+        'confidence': confidence,
+        'colors': colors['colors'],
+        'recommendation': get_recommendation(label, confidence, references, colors['scheme'])
+    }
+
+def classify_item(index, filename, data, digest):
+    """
+    串流 API 的一筆結果；錯誤也以一筆結果回報，不中斷其他圖片
+
+    Returns:
+        dict: index、filename 加上 classify_image() 的結果，或 error
+    """
+    item = {'index': index, 'filename': filename}
+    try:
+        item.update(classify_image(data, digest))
+    except ImageValidationError as e:
+        UPLOADS_REJECTED.labels('invalid').inc()
+        item['error'] = str(e)
+    except Exception as e:
+        logger.error(f"處理圖片時發生錯誤（{filename}）：{str(e)}")
+        item['error'] = f'處理圖片時發生錯誤：{str(e)}'
+    return item
+
+def ndjson_line(item):
+    return app.json.dumps(item, ensure_ascii=False) + '\n'
+
+def release_when_done(futures):
+    """所有 futures 完成後才釋放准入空位，不論用戶端有沒有讀完回應"""
+    remaining = [len(futures)]
+    lock = threading.Lock()
+
+    def done(_):
+        with lock:
+            remaining[0] -= 1
+            finished = remaining[0] == 0
+        if finished:
+            admission.leave()
+
+    for future in futures:
+        future.add_done_callback(done)
+
+@app.before_request
+def start_timer():
+    g.request_start = time.perf_counter()
+
+@app.after_request
+def record_request_time(response):
+    """記錄請求處理時間；/events 是長時間的串流，不計入"""
+    if request.endpoint != 'device_events' and 'request_start' in g:
+        REQUEST_SECONDS.labels(request.endpoint or 'unknown').observe(time.perf_counter() - g.request_start)
+    return response
+
+def reject(status, message, retry_after=None, **extra):
+    """拒絕請求：主頁以 HTML 顯示錯誤，API 回應 JSON"""
+    if request.endpoint == 'index':
+        response = app.make_response((render_template('index.html', error=message), status))
+    else:
+        response = jsonify({'error': message, **extra})
+        response.status_code = status
+    if retry_after is not None:
+        response.headers['Retry-After'] = str(max(1, math.ceil(retry_after)))
+    return response
+
+@app.before_request
+def require_model():
+    """模型尚未就緒時，需要模型的請求立即回應 503，不在請求中等待載入"""
+    if request.method != 'POST' or request.endpoint not in MODEL_ENDPOINTS or model_loader.ready:
+        return None
+    model_loader.start()
+    message = '模型載入中，請稍後再試' if model_loader.state != FAILED else '模型未正確初始化'
+    logger.warning(f"模型尚未就緒（{model_loader.state}），拒絕請求：{request.path}")
+    UPLOADS_REJECTED.labels('not_ready').inc()
+    return reject(503, message, MODEL_RETRY_AFTER, state=model_loader.state)
+
+@app.before_request
+def admit_request():
+    """
+    辨識請求在讀取上傳內容之前先檢查：內容過大回應 413，超過用戶端速率限制回應 429。
+    處理空位要等上傳內容讀完才在各端點以 acquire_slot() 取得，慢速上傳不會佔住空位
+    """
+    if request.method != 'POST' or request.endpoint not in MODEL_ENDPOINTS:
+        return None
+    if request.content_length is not None and request.content_length > MAX_REQUEST_BYTES:
+        REQUESTS_SHED.labels('too_large').inc()
+        return reject(413, f'上傳內容超過 {MAX_REQUEST_BYTES // (1024 * 1024)} MB 上限')
+    if rate_limiter is not None:
+        try:
+            rate_limiter.acquire(request.remote_addr)
+        except Overloaded as e:
+            REQUESTS_SHED.labels(e.reason).inc()
+            logger.warning(f"請求過多（{e.reason}），拒絕請求：{request.path}")
+            return reject(429, '請求太頻繁，請稍後再試', e.retry_after)
+    return None
+
+def acquire_slot():
+    """
+    上傳內容讀完後、開始解碼與推論前取得處理空位，請求結束時由 release_admission 釋放
+
+    Returns:
+        None 表示已取得；排隊已滿或等待逾時則為 503 回應
+    """
+    try:
+        waited = admission.enter()
+    except Overloaded as e:
+        REQUESTS_SHED.labels(e.reason).inc()
+        logger.warning(f"請求過多（{e.reason}），拒絕請求：{request.path}")
+        return reject(503, '伺服器忙碌中，請稍後再試', e.retry_after)
+    g.admitted = True
+    QUEUE_WAIT_SECONDS.observe(waited)
+    return None
+
+@app.teardown_request
+def release_admission(exc):
+    if g.pop('admitted', False):
+        admission.leave()
+
+@app.errorhandler(413)
+def request_too_large(e):
+    """未附 Content-Length 的上傳在讀取途中超過 MAX_CONTENT_LENGTH"""
+    REQUESTS_SHED.labels('too_large').inc()
+    return reject(413, f'上傳內容超過 {MAX_REQUEST_BYTES // (1024 * 1024)} MB 上限')
+
 @app.route('/', methods=['GET', 'POST'])
 def index():
     if request.method == 'POST':
+        # 從解析 multipart 表單開始計算接收時間
+        receive_start = time.perf_counter()
         if 'file' not in request.files:
             logger.warning("沒有檔案被上傳")
+            UPLOADS_REJECTED.labels('missing').inc()
             return render_template('index.html', error='請選擇一個檔案')
         
         file = request.files['file']
         if file.filename == '':
             logger.warning("檔案名稱為空")
+            UPLOADS_REJECTED.labels('missing').inc()
             return render_template('index.html', error='請選擇一個檔案')
             
         if file and allowed_file(file.filename):
             try:
-                # 安全地保存檔案
-                filename = secure_filename(file.filename)
-                filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-                file.save(filepath)
-                logger.info(f"檔案已保存：{filepath}")
-                
-                # 檢查檔案是否確實被保存
-                if not os.path.exists(filepath):
-                    raise Exception("檔案未能成功保存")
+                # 直接在記憶體中讀取並驗證，不先寫入磁碟
+                data, digest = read_upload(file.stream)
+                STAGE_SECONDS.labels('receive').observe(time.perf_counter() - receive_start)
+                with STAGE_SECONDS.labels('inspect').time():
+                    fmt, (width, height) = inspect_image(data)
+                logger.info(f"收到圖片：{fmt} {width}x{height}，{len(data)} bytes")
+                overloaded = acquire_slot()
+                if overloaded is not None:
+                    return overloaded
                 
                 # 使用模型進行預測
-                if model is not None:
-                    label, confidence = model.predict(filepath)
+                if scheduler is not None:
+                    hardware_bridge.signal_busy()
+                    # 只解碼一次：模型輸入、相似圖片檢索與顏色分析共用同一個像素陣列
+                    pixels = model.preprocessor.decode(data)
+                    with STAGE_SECONDS.labels('predict').time():
+                        label, confidence = cached_predict(digest, pixels)
+                    hardware_bridge.signal_result(confidence)
                     logger.info(f"預測結果：{label}，信心度：{confidence}")
                     
+                    with STAGE_SECONDS.labels('similar').time():
+                        similar_items, references = find_similar(pixels)
+                    with STAGE_SECONDS.labels('color').time():
+                        colors = color_analyzer.analyze(pixels)
+                    
                     # 獲取推薦
-                    recommendations = get_recommendation(label, confidence)
+                    with STAGE_SECONDS.labels('recommend').time():
+                        recommendations = get_recommendation(label, confidence, references, colors['scheme'])
+                    
+                    # 結果頁需要顯示上傳的圖片，這時才寫入磁碟；相同內容只寫一次
+                    with STAGE_SECONDS.labels('save').time():
+                        filename = upload_storage.store(data, digest, fmt)
+                        upload_storage.add_derived(image_variants.generate_for(f'uploads/{filename}', data))
+                    logger.info(f"檔案已保存：{filename}")
                     
-                    return render_template('index.html', 
-                                        label=label,
-                                        confidence=f"{confidence:.2%}",
-                                        basic_recommendation=recommendations['basic'],
-                                        style_recommendation=recommendations['style'],
-                                        image=filename)
+                    with STAGE_SECONDS.labels('render').time():
+                        return render_template('index.html', 
+                                            label=label,
+                                            confidence=f"{confidence:.2%}",
+                                            recommendation_html=render_recommendation(
+                                                label, confidence, recommendations),
+                                            similar_items=similar_items,
+                                            dominant_colors=colors['colors'],
+                                            image=filename)
                 else:
                     raise Exception("模型未正確初始化")
                     
+            except ImageValidationError as e:
+                logger.warning(f"拒絕上傳的檔案：{str(e)}")
+                UPLOADS_REJECTED.labels('invalid').inc()
+                return render_template('index.html', error=str(e))
             except Exception as e:
+                hardware_bridge.signal_ready()
+                MODEL_ERRORS.inc()
                 logger.error(f"處理上傳檔案時發生錯誤：{str(e)}")
                 return render_template('index.html', error=f'處理圖片時發生錯誤：{str(e)}')
         else:
             logger.warning(f"不支援的檔案類型：{file.filename}")
+            UPLOADS_REJECTED.labels('type').inc()
             return render_template('index.html', error='只支援 PNG、JPG、JPEG 和 GIF 格式的圖片')
     
     return render_template('index.html')
 
+@app.route('/api/predict_batch', methods=['POST'])
+def predict_batch():
+    """
+    批次辨識 API：接受多個上傳檔案（欄位名稱 files），以單一批次執行模型，
+    回傳每張圖片的標籤、信心度、主要顏色與搭配建議（與單張 API 相同，參考相似圖片與配色）
+    """
+    files = request.files.getlist('files') or request.files.getlist('file')
+    files = [f for f in files if f.filename]
+    if not files:
+        return jsonify({'error': '請選擇至少一個檔案'}), 400
+    if len(files) > MAX_BATCH_FILES:
+        return jsonify({'error': f'一次最多只能上傳 {MAX_BATCH_FILES} 個檔案'}), 400
+
+    results = [None] * len(files)
+    predictions = {}
+    uploads = {}
+    images = []
+    digests = []
+    indices = []
+    for i, file in enumerate(files):
+        if not allowed_file(file.filename):
+            UPLOADS_REJECTED.labels('type').inc()
+            results[i] = {'filename': file.filename, 'error': '只支援 PNG、JPG、JPEG 和 GIF 格式的圖片'}
+            continue
+        try:
+            data, digest = read_upload(file.stream)
+            inspect_image(data)
+        except ImageValidationError as e:
+            UPLOADS_REJECTED.labels('invalid').inc()
+            results[i] = {'filename': file.filename, 'error': str(e)}
+            continue
+        uploads[i] = data
+        cached = prediction_cache.get(digest)
+        if cached is not None:
+            CACHE_LOOKUPS.labels('hit').inc()
+            predictions[i] = cached
+        else:
+            CACHE_LOOKUPS.labels('miss').inc()
+            images.append(data)
+            digests.append(digest)
+            indices.append(i)
+
+    if images:
+        overloaded = acquire_slot()
+        if overloaded is not None:
+            return overloaded
+        hardware_bridge.signal_busy()
+        try:
+            batch_predictions = inference.predict_batch(images)
+        except Exception as e:
+            MODEL_ERRORS.inc()
+            logger.error(f"批次預測時發生錯誤：{str(e)}")
+            return jsonify({'error': f'模型推論時發生錯誤：{str(e)}'}), 503
+        finally:
+            hardware_bridge.signal_ready()
+    else:
+        batch_predictions = []
+    for i, digest, (label, confidence) in zip(indices, digests, batch_predictions):
+        predictions[i] = (label, confidence)
+        if confidence > 0:
+            prediction_cache.put(digest, label, confidence)
+        else:
+            MODEL_ERRORS.inc()
+
+    for i, (label, confidence) in predictions.items():
+        try:
+            pixels = model.preprocessor.decode(uploads[i])
+            _, references = find_similar(pixels)
+            colors = color_analyzer.analyze(pixels)
+        except Exception as e:
+            logger.error(f"分析圖片時發生錯誤（{files[i].filename}）：{str(e)}")
+            results[i] = {'filename': files[i].filename, 'error': f'處理圖片時發生錯誤：{str(e)}'}
+            continue
+        results[i] = {
+            'filename': files[i].filename,
+            'label': label,
+            'confidence': confidence,
+            'colors': colors['colors'],
+            'recommendation': get_recommendation(label, confidence, references, colors['scheme'])
+        }
+    logger.info(f"批次預測完成：{len(predictions)} 張圖片，其中 {len(predictions) - len(images)} 張命中快取")
+    return jsonify({'results': results})
+
+@app.route('/api/v1/predict', methods=['POST'])
+def api_predict():
+    """
+    JSON 辨識 API：請求內容可以直接是圖片（Content-Type: image/*），或 multipart 表單的 file 欄位。
+    回傳標籤、信心度、主要顏色與搭配建議
+    """
+    try:
+        if request.mimetype in RAW_IMAGE_MIMETYPES:
+            data, digest = read_upload(request.stream)
+        else:
+            file = request.files.get('file')
+            if file is None or file.filename == '':
+                UPLOADS_REJECTED.labels('missing').inc()
+                return jsonify({'error': '請選擇一個檔案'}), 400
+            if not allowed_file(file.filename):
+                UPLOADS_REJECTED.labels('type').inc()
+                return jsonify({'error': '只支援 PNG、JPG、JPEG 和 GIF 格式的圖片'}), 400
+            data, digest = read_upload(file.stream)
+        overloaded = acquire_slot()
+        if overloaded is not None:
+            return overloaded
+        result = classify_image(data, digest)
+    except ImageValidationError as e:
+        UPLOADS_REJECTED.labels('invalid').inc()
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        logger.error(f"處理圖片時發生錯誤：{str(e)}")
+        return jsonify({'error': f'處理圖片時發生錯誤：{str(e)}'}), 500
+    return jsonify(result)
+
+@app.route('/api/v1/predict/stream', methods=['POST'])
+def api_predict_stream():
+    """
+    多張圖片的 NDJSON 串流 API（欄位名稱 files）：每張圖片處理完就送出一行 JSON，
+    依完成先後排列，以 index 對應上傳順序
+    """
+    files = [f for f in request.files.getlist('files') if f.filename]
+    if not files:
+        UPLOADS_REJECTED.labels('missing').inc()
+        return jsonify({'error': '請選擇至少一個檔案'}), 400
+    if len(files) > MAX_BATCH_FILES:
+        return jsonify({'error': f'一次最多只能上傳 {MAX_BATCH_FILES} 個檔案'}), 400
+
+    rejected = []
+    jobs = []
+    for i, file in enumerate(files):
+        if not allowed_file(file.filename):
+            UPLOADS_REJECTED.labels('type').inc()
+            rejected.append({'index': i, 'filename': file.filename, 'error': '只支援 PNG、JPG、JPEG 和 GIF 格式的圖片'})
+            continue
+        try:
+            data, digest = read_upload(file.stream)
+        except ImageValidationError as e:
+            UPLOADS_REJECTED.labels('invalid').inc()
+            rejected.append({'index': i, 'filename': file.filename, 'error': str(e)})
+            continue
+        jobs.append((i, file.filename, data, digest))
+
+    futures = []
+    if jobs:
+        overloaded = acquire_slot()
+        if overloaded is not None:
+            return overloaded
+        # 同時送出，批次排程器會把它們合併成批次
+        futures = [api_executor.submit(classify_item, *job) for job in jobs]
+        # 回應開始串流時 teardown 就會執行，處理空位改由最後一個完成的圖片釋放，
+        # 否則串流中的圖片不計入同時處理數，api_executor 的佇列就沒有上限
+        g.pop('admitted')
+        release_when_done(futures)
+
+    def stream():
+        for item in rejected:
+            yield ndjson_line(item)
+        for future in as_completed(futures):
+            yield ndjson_line(future.result())
+
+    return Response(stream(), mimetype=NDJSON_MIMETYPE)
+
+@app.route('/healthz')
+def healthz():
+    """存活檢查：行程能回應請求即為正常，不管模型是否就緒"""
+    return jsonify({'status': 'ok'})
+
+@app.route('/readyz')
+def readyz():
+    """就緒檢查：模型載入並預熱完成後回應 200，否則 503"""
+    status = model_loader.status()
+    response = jsonify(status)
+    if not status['ready']:
+        response.status_code = 503
+        response.headers['Retry-After'] = str(MODEL_RETRY_AFTER)
+    return response
+
+@app.route('/events')
+def device_events():
+    """以 server-sent events 推送 Arduino 的按鈕事件（style、confirm）與連線狀態（connection）"""
+    channel = hardware_bridge.events.subscribe()
+
+    def stream():
+        try:
+            # 新訂閱者先收到目前的連線狀態
+            yield format_sse((0, 'connection', {'connected': hardware_bridge.connected}))
+            while True:
+                event = channel.get(timeout=EVENT_KEEPALIVE)
+                if event is None:
+                    if channel.closed:
+                        return
+                    yield ': keepalive\n\n'
+                    continue
+                yield format_sse(event)
+        finally:
+            hardware_bridge.events.unsubscribe(channel)
+
+    response = Response(stream_with_context(stream()), mimetype='text/event-stream')
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
+
+@app.route('/api/hardware')
+def hardware_status():
+    """Arduino 連線狀態與訊號通道統計"""
+    return jsonify(hardware_bridge.stats())
+
+@app.route('/metrics')
+def prometheus_metrics():
+    """Prometheus 文字格式的指標"""
+    return Response(metrics.render(), content_type=metrics.CONTENT_TYPE)
+
+@app.route('/similar/<path:filename>')
+def similar_image(filename):
+    """提供相似度索引中的圖片（包含不在 static/ 中的目錄）；索引以外的檔案一律 404"""
+    if similarity_index is None or filename not in similarity_index:
+        abort(404)
+    return send_from_directory(BASE_DIR, filename, max_age=SIMILAR_IMAGE_MAX_AGE)
+
+@app.route('/api/storage')
+def storage_usage():
+    """上傳目錄的使用量統計"""
+    return jsonify(upload_storage.usage())
+
 @app.after_request
 def add_header(response):
     """
-    防止瀏覽器快取靜態文件
+    防止瀏覽器快取動態頁面；靜態文件的快取由 StaticFingerprints 處理
     """
+    if request.endpoint in CACHEABLE_ENDPOINTS:
+        return response
     response.headers['Cache-Control'] = 'no-store, no-cache, must-revalidate, post-check=0, pre-check=0, max-age=0'
     response.headers['Pragma'] = 'no-cache'
     response.headers['Expires'] = '-1'
@@ -111,4 +750,7 @@ if __name__ == '__main__':
     print('按 Ctrl+C 可以停止伺服器')
     print('========================')
     
-    app.run(debug=True)
+    # 除錯重新載入器的父行程只負責監看檔案，背景服務只在實際處理請求的子行程啟動
+    if is_running_from_reloader() or not USE_RELOADER:
+        start_services()
+    app.run(debug=True, use_reloader=USE_RELOADER)
@@ -2,30 +2,67 @@ from serial import Serial, SerialException
 import time
 import threading
 import logging
-from typing import Optional, Callable
-import queue
+from collections import deque
+from typing import Dict, List, Optional, Callable
+
+from serial_protocol import (FRAME_ACK, FRAME_CONFIRM, FRAME_STYLE, HELLO, HELLO_REPLY,
+                             FrameDecoder, encode_command, encode_frame, encode_text)
+from metrics import Histogram
 
 # 配置日誌
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+READ_TIMEOUT = 0.5  # 單次讀取最長的阻塞時間（秒），沒有資料時線程在 select 中休眠
+WRITE_TIMEOUT = 1.0  # 單次寫入最長的阻塞時間（秒）
+MAX_LINE_LENGTH = 256  # 一行資料的長度上限，超過時視為雜訊並丟棄
+HELLO_INTERVAL = 0.25  # 協商封包模式時重送 BIN? 的間隔（秒）
+RTT_SAMPLES = 256  # 每種命令保留的往返時間樣本數
+
+SERIAL_WRITE_SECONDS = Histogram('arduino_serial_write_seconds', '每次串口寫入（含 flush）的耗時（秒）')
+
 class ArduinoController:
-    def __init__(self, port: str = 'COM3', baudrate: int = 9600):
+    def __init__(self, port: str = 'COM3', baudrate: int = 9600, framed: bool = False):
         """
         初始化 Arduino 控制器
-        
+
         Args:
             port: 串口名稱，Windows 通常是 'COM3'，Linux 通常是 '/dev/ttyUSB0'
             baudrate: 串口速率，需要與 Arduino 程式碼匹配
+            framed: 連線時嘗試協商二進位封包協定（序號、CRC、ACK 與重送），設備不支援時使用文字協定
         """
         self.port = port
         self.baudrate = baudrate
+        self.framed = framed
+        self.protocol = 'text'  # 目前連線使用的協定：'text' 或 'binary'
         self.serial: Optional[Serial] = None
         self.is_connected = False
         self.running = False
         self.receive_thread: Optional[threading.Thread] = None
-        self.command_queue = queue.Queue()
-        
+        self.command_thread: Optional[threading.Thread] = None
+        self.monitor_thread: Optional[threading.Thread] = None
+
+        # 合併式命令緩衝區：每種命令只保留最新的值，每個週期一次寫出
+        self._pending: Dict[str, int] = {}
+        self._last_sent: Dict[str, int] = {}
+        self._state: Dict[str, int] = {}  # 每種命令最後要求的值，重新連線後重送
+        self._commands = threading.Condition()
+        self._last_write = 0.0
+
+        # 封包協定：尚未收到 ACK 的封包（序號 → 命令資訊）與往返時間
+        self._inflight: Dict[int, dict] = {}
+        self._seq = 0
+        self._last_rx_seq: Optional[int] = None
+        self._decoder = FrameDecoder()
+        self._rtts: Dict[str, deque] = {}
+
+        # 線程同步：連線建立/中斷時喚醒等待中的線程，取代定時輪詢
+        self._connected = threading.Event()
+        self._disconnected = threading.Event()
+        self._stop_event = threading.Event()
+        self._serial_lock = threading.Lock()
+        self._write_lock = threading.Lock()
+
         # 回調函數
         self.style_callback: Optional[Callable[[int], None]] = None
         self.confirm_callback: Optional[Callable[[], None]] = None
@@ -37,11 +74,25 @@ class ArduinoController:
         self.command_timeout = 2.0  # 命令超時時間
         self.auto_reconnect = True
         self.reconnect_interval = 5.0  # 自動重連間隔
+        self.write_interval = 0.05  # 兩次寫入之間的最短間隔（秒），期間的更新會被合併
+        self.negotiate_timeout = 2.5  # 等待設備回應封包協定的時間（秒），涵蓋開啟串口後 Arduino 重新開機
+        self.ack_timeout = 0.25  # 封包送出後等待 ACK 的時間（秒），逾時只重送該封包
+        self.max_retransmits = 3  # 每個封包最多重送的次數
+
+        # 統計資料
+        self.commands_submitted = 0
+        self.commands_merged = 0  # 尚未送出（或尚未確認）就被同類型新值取代的命令
+        self.commands_unchanged = 0  # 與設備目前顯示相同而略過的命令
+        self.commands_dropped = 0  # 無法送出、或重送次數用完仍未確認而丟棄的命令
+        self.commands_acked = 0
+        self.retransmits = 0
+        self.writes = 0
+        self.bytes_written = 0
 
     def connect(self) -> bool:
         """
         連接到 Arduino 設備
-        
+
         Returns:
             bool: 連接是否成功
         """
@@ -50,119 +101,443 @@ class ArduinoController:
 
         for attempt in range(self.max_retries):
             try:
-                self.serial = Serial(self.port, self.baudrate, timeout=1)
-                self.is_connected = True
-                self.running = True
-                
-                # 啟動接收線程
-                self.receive_thread = threading.Thread(target=self._receive_data)
-                self.receive_thread.daemon = True
-                self.receive_thread.start()
-                
-                # 啟動命令處理線程
-                self.command_thread = threading.Thread(target=self._process_commands)
-                self.command_thread.daemon = True
-                self.command_thread.start()
-                
-                # 啟動監控線程
-                self.monitor_thread = threading.Thread(target=self._monitor_connection)
-                self.monitor_thread.daemon = True
-                self.monitor_thread.start()
-                
+                self._open()
+                self._start_threads()
                 logger.info(f"已連接到 Arduino ({self.port})")
                 if self.connection_callback:
                     self.connection_callback(True)
                 return True
-                
+
             except SerialException as e:
                 logger.error(f"連接嘗試 {attempt + 1} 失敗: {str(e)}")
                 time.sleep(self.retry_delay)
-        
+
         logger.error(f"無法連接到 Arduino，已重試 {self.max_retries} 次")
         if self.connection_callback:
             self.connection_callback(False)
         return False
 
+    def _open(self) -> None:
+        """開啟串口；讀寫都設定逾時，線程不會無限期阻塞"""
+        serial = Serial(self.port, self.baudrate, timeout=READ_TIMEOUT, write_timeout=WRITE_TIMEOUT)
+        try:
+            protocol = self._negotiate(serial) if self.framed else 'text'
+        except (SerialException, OSError) as e:
+            serial.close()
+            raise SerialException(f"協商協定時發生錯誤: {str(e)}")
+        with self._serial_lock:
+            if self.is_connected:
+                # 監控線程已經先一步重新連上
+                serial.close()
+                return
+            self.serial = serial
+            self.protocol = protocol
+            self.is_connected = True
+            self._disconnected.clear()
+            self._connected.set()
+        # 設備可能已重置：清除送出紀錄，並把最後要求的狀態重新排入
+        with self._commands:
+            self._last_sent.clear()
+            self._inflight.clear()
+            self._last_rx_seq = None
+            self._pending = {**self._state, **self._pending}
+            if self._pending:
+                self._commands.notify()
+
+    def _negotiate(self, serial: Serial) -> str:
+        """
+        詢問設備是否支援封包協定；在 negotiate_timeout 內每隔 HELLO_INTERVAL 重送一次，
+        期間收到的文字訊息照常處理
+
+        Returns:
+            str: 'binary' 或 'text'
+        """
+        serial.reset_input_buffer()
+        serial.timeout = HELLO_INTERVAL / 2
+        buffer = bytearray()
+        deadline = time.monotonic() + self.negotiate_timeout
+        next_hello = 0.0
+        try:
+            while time.monotonic() < deadline:
+                if time.monotonic() >= next_hello:
+                    serial.write(HELLO)
+                    serial.flush()
+                    next_hello = time.monotonic() + HELLO_INTERVAL
+                buffer.extend(serial.read(max(1, serial.in_waiting)))
+                while True:
+                    end = buffer.find(b'\n')
+                    if end < 0:
+                        break
+                    line = bytes(buffer[:end])
+                    del buffer[:end + 1]
+                    if line.strip() == HELLO_REPLY:
+                        # 回覆之後的資料已經是封包
+                        self._decoder = FrameDecoder()
+                        self._decoder.buffer.extend(buffer)
+                        logger.info("設備支援封包協定，改用二進位封包")
+                        return 'binary'
+                    self._dispatch_line(line)
+        finally:
+            serial.timeout = READ_TIMEOUT
+        logger.info("設備未回應封包協定，使用文字協定")
+        return 'text'
+
+    def _start_threads(self) -> None:
+        """啟動接收、命令與監控線程；重新連線時沿用既有的線程"""
+        if self.running:
+            return
+        self.running = True
+        self._stop_event.clear()
+
+        # 啟動接收線程
+        self.receive_thread = threading.Thread(target=self._receive_data, name='arduino-receive')
+        self.receive_thread.daemon = True
+        self.receive_thread.start()
+
+        # 啟動命令處理線程
+        self.command_thread = threading.Thread(target=self._process_commands, name='arduino-command')
+        self.command_thread.daemon = True
+        self.command_thread.start()
+
+        # 啟動監控線程
+        self.monitor_thread = threading.Thread(target=self._monitor_connection, name='arduino-monitor')
+        self.monitor_thread.daemon = True
+        self.monitor_thread.start()
+
     def _monitor_connection(self) -> None:
-        """監控連接狀態並自動重連"""
+        """監控連接狀態並自動重連；連線正常時阻塞等待斷線事件"""
         while self.running:
-            if self.auto_reconnect and not self.is_connected:
-                logger.info("嘗試重新連接...")
-                if self.connect():
-                    logger.info("重新連接成功")
-                else:
-                    logger.error("重新連接失敗")
-                    time.sleep(self.reconnect_interval)
-            time.sleep(1.0)
+            self._disconnected.wait()
+            if not self.running:
+                break
+            if not self.auto_reconnect:
+                self._stop_event.wait(self.reconnect_interval)
+                continue
+            logger.info("嘗試重新連接...")
+            try:
+                self._open()
+            except SerialException as e:
+                logger.error(f"重新連接失敗: {str(e)}")
+                self._stop_event.wait(self.reconnect_interval)
+                continue
+            logger.info("重新連接成功")
+            if self.connection_callback:
+                self.connection_callback(True)
 
     def disconnect(self) -> None:
         """安全斷開與 Arduino 的連接"""
         self.running = False
-        if self.serial and self.serial.is_open:
-            try:
-                self.serial.close()
-            except Exception as e:
-                logger.error(f"關閉串口時發生錯誤: {str(e)}")
+        self._stop_event.set()
+        # 喚醒所有等待中的線程，讓它們檢查 running 後結束
+        self._connected.set()
+        self._disconnected.set()
+        with self._commands:
+            self._commands.notify_all()
+        self._close_serial()
+        for thread in (self.receive_thread, self.command_thread, self.monitor_thread):
+            if thread and thread is not threading.current_thread():
+                thread.join(timeout=READ_TIMEOUT + WRITE_TIMEOUT)
+        self._connected.clear()
         self.is_connected = False
         if self.connection_callback:
             self.connection_callback(False)
         logger.info("已斷開 Arduino 連接")
 
+    def _close_serial(self) -> None:
+        with self._serial_lock:
+            serial = self.serial
+        if serial and serial.is_open:
+            try:
+                # 讓阻塞中的 read 立即返回
+                serial.cancel_read()
+            except Exception:
+                pass
+            try:
+                serial.close()
+            except Exception as e:
+                logger.error(f"關閉串口時發生錯誤: {str(e)}")
+
     def _receive_data(self) -> None:
-        """接收來自 Arduino 的數據"""
+        """接收來自 Arduino 的數據：阻塞讀取到有資料或逾時，每收到完整的一行立即分派"""
+        buffer = bytearray()
         while self.running:
-            if not self.serial or not self.serial.is_open:
-                self._handle_disconnection()
-                time.sleep(0.1)
+            serial = self.serial
+            if not self.is_connected or not serial or not serial.is_open:
+                buffer.clear()
+                self._connected.wait()
                 continue
 
             try:
-                if self.serial.in_waiting:
-                    data = self.serial.readline().decode('utf-8').strip()
-                    self._process_data(data)
-            except SerialException as e:
-                logger.error(f"串口錯誤: {str(e)}")
-                self._handle_disconnection()
-            except Exception as e:
-                logger.error(f"讀取數據時發生錯誤: {str(e)}")
-                time.sleep(0.1)
+                # 至少等一個位元組；有更多資料時一次讀完
+                chunk = serial.read(max(1, serial.in_waiting))
+            except (SerialException, OSError, TypeError) as e:
+                # 關閉串口時 pyserial 可能拋出 TypeError / OSError
+                if self.running:
+                    logger.error(f"串口錯誤: {str(e)}")
+                    self._handle_disconnection()
+                continue
+            if not chunk:
+                continue
+
+            if self.protocol == 'binary':
+                for seq, frame_type, payload in self._decoder.feed(chunk):
+                    self._handle_frame(seq, frame_type, payload)
+                continue
+
+            buffer.extend(chunk)
+            while True:
+                end = buffer.find(b'\n')
+                if end < 0:
+                    break
+                line = bytes(buffer[:end])
+                del buffer[:end + 1]
+                self._dispatch_line(line)
+            if len(buffer) > MAX_LINE_LENGTH:
+                logger.warning(f"丟棄過長的資料（{len(buffer)} bytes）")
+                buffer.clear()
+
+    def _dispatch_line(self, line: bytes) -> None:
+        try:
+            data = line.decode('utf-8').strip()
+        except UnicodeDecodeError:
+            logger.warning(f"無法解碼的資料: {line!r}")
+            return
+        if not data:
+            return
+        try:
+            self._process_data(data)
+        except Exception as e:
+            logger.error(f"處理數據時發生錯誤: {str(e)}")
+
+    def _process_data(self, data: str) -> None:
+        """
+        處理 Arduino 傳來的一行訊息
+
+        Args:
+            data: 去除換行的訊息，例如 "STYLE:2"、"CONFIRM"
+        """
+        if data.startswith('STYLE:'):
+            style = int(data[len('STYLE:'):])
+            if self.style_callback:
+                self.style_callback(style)
+        elif data == 'CONFIRM':
+            if self.confirm_callback:
+                self.confirm_callback()
+        else:
+            logger.debug(f"未知的訊息: {data}")
+
+    def _handle_frame(self, seq: int, frame_type: int, payload: bytes) -> None:
+        """處理設備送來的封包：ACK 更新送達狀態，事件封包回覆 ACK 後分派"""
+        if frame_type == FRAME_ACK:
+            if payload:
+                self._handle_ack(payload[0])
+            return
+
+        try:
+            self._write(encode_frame(seq, FRAME_ACK, bytes((seq,))))
+        except Exception:
+            return
+        if seq == self._last_rx_seq:
+            # 設備沒收到上一個 ACK 而重送，不重複分派
+            return
+        self._last_rx_seq = seq
+        try:
+            if frame_type == FRAME_STYLE and payload:
+                if self.style_callback:
+                    self.style_callback(payload[0])
+            elif frame_type == FRAME_CONFIRM:
+                if self.confirm_callback:
+                    self.confirm_callback()
+            else:
+                logger.debug(f"未知的封包類型: {frame_type}")
+        except Exception as e:
+            logger.error(f"處理數據時發生錯誤: {str(e)}")
+
+    def _handle_ack(self, seq: int) -> None:
+        """封包已送達；只以沒有重送過的封包計算往返時間"""
+        now = time.monotonic()
+        with self._commands:
+            entry = self._inflight.pop(seq, None)
+            if entry is None:
+                return
+            self.commands_acked += 1
+            if entry['attempts'] == 1:
+                samples = self._rtts.setdefault(entry['kind'], deque(maxlen=RTT_SAMPLES))
+                samples.append(now - entry['sent'])
 
     def _handle_disconnection(self) -> None:
         """處理設備斷線"""
-        if self.is_connected:
+        with self._serial_lock:
+            if not self.is_connected:
+                return
             self.is_connected = False
-            logger.warning("Arduino 連接已斷開")
-            if self.connection_callback:
-                self.connection_callback(False)
+            self._connected.clear()
+        self._close_serial()
+        logger.warning("Arduino 連接已斷開")
+        if self.connection_callback:
+            self.connection_callback(False)
+        # 喚醒監控線程開始重連
+        self._disconnected.set()
+
+    def _write(self, data: bytes) -> None:
+        """寫入串口；寫入失敗視為斷線"""
+        with self._write_lock:
+            try:
+                with SERIAL_WRITE_SECONDS.time():
+                    self.serial.write(data)
+                    self.serial.flush()
+            except (SerialException, OSError) as e:
+                logger.error(f"串口錯誤: {str(e)}")
+                self._handle_disconnection()
+                raise
+
+    def _submit(self, kind: str, value: int) -> None:
+        """
+        排入命令；同類型尚未送出的舊命令直接被取代
+
+        Args:
+            kind: 命令類型，例如 'CONF'、'STATUS'
+            value: 命令的值
+        """
+        with self._commands:
+            self.commands_submitted += 1
+            if kind in self._pending:
+                self.commands_merged += 1
+            self._pending[kind] = value
+            self._state[kind] = value
+            self._commands.notify()
+
+    def _due_retransmits(self) -> List[int]:
+        """
+        找出等待 ACK 逾時的封包序號；重送次數用完的封包直接放棄（需持有 _commands）
+        """
+        now = time.monotonic()
+        due = []
+        for seq, entry in list(self._inflight.items()):
+            if now - entry['last_sent'] < self.ack_timeout:
+                continue
+            if entry['attempts'] > self.max_retransmits:
+                del self._inflight[seq]
+                self.commands_dropped += 1
+                # 設備可能沒有顯示這個值，下次相同的值仍要送出
+                if self._last_sent.get(entry['kind']) == entry['value']:
+                    del self._last_sent[entry['kind']]
+                logger.warning(f"命令未獲確認，已放棄: {entry['kind']}={entry['value']}")
+                continue
+            due.append(seq)
+        return due
+
+    def _take_pending(self):
+        """
+        等待到有命令（或有封包需要重送）且距離上次寫入超過 write_interval
+
+        Returns:
+            tuple: (待送命令, 需要重送的封包序號)
+        """
+        with self._commands:
+            while self.running and not self._pending and not self._due_retransmits():
+                self._commands.wait(self.ack_timeout if self._inflight else None)
+        # 等待期間到達的更新會合併到同一次寫入
+        delay = self._last_write + self.write_interval - time.monotonic()
+        if delay > 0:
+            self._stop_event.wait(delay)
+        with self._commands:
+            pending, self._pending = self._pending, {}
+            changed = {kind: value for kind, value in pending.items() if self._last_sent.get(kind) != value}
+            self.commands_unchanged += len(pending) - len(changed)
+            return changed, self._due_retransmits()
+
+    def _next_seq(self) -> int:
+        self._seq = (self._seq + 1) & 0xFF
+        return self._seq
+
+    def _encode_commands(self, commands: Dict[str, int], retransmits: List[int]) -> bytes:
+        """把本次要送的命令編成一次寫入的資料；封包模式下同時登記等待 ACK（需持有 _commands）"""
+        if self.protocol != 'binary':
+            return b''.join(encode_text(kind, value) for kind, value in commands.items())
+
+        now = time.monotonic()
+        frames = []
+        for kind, value in commands.items():
+            # 同類型較舊、尚未確認的封包已經過時，不再重送
+            for seq in [seq for seq, entry in self._inflight.items() if entry['kind'] == kind]:
+                del self._inflight[seq]
+                self.commands_merged += 1
+            seq = self._next_seq()
+            frame = encode_command(seq, kind, value)
+            self._inflight[seq] = {'kind': kind, 'value': value, 'frame': frame,
+                                   'sent': now, 'last_sent': now, 'attempts': 1}
+            frames.append(frame)
+        for seq in retransmits:
+            entry = self._inflight.get(seq)
+            if entry is None:
+                continue
+            entry['attempts'] += 1
+            entry['last_sent'] = now
+            self.retransmits += 1
+            frames.append(entry['frame'])
+        return b''.join(frames)
 
     def _process_commands(self) -> None:
-        """處理發送命令的佇列"""
+        """把待送命令（與需要重送的封包）合併成一次寫入送出"""
         while self.running:
-            try:
-                command = self.command_queue.get(timeout=1.0)
-                start_time = time.time()
-                
-                while time.time() - start_time < self.command_timeout:
-                    if self.serial and self.serial.is_open:
-                        self.serial.write(command.encode('utf-8'))
-                        self.serial.flush()
-                        break
-                    time.sleep(0.1)
-                else:
-                    logger.warning(f"命令發送超時: {command.strip()}")
-                    
-            except queue.Empty:
+            commands, retransmits = self._take_pending()
+            if not (commands or retransmits) or not self.running:
+                continue
+            # 設備暫時斷線時等待重連，最多 command_timeout 秒
+            if not self._connected.wait(self.command_timeout) or not self.is_connected:
+                logger.warning(f"命令發送超時: {', '.join(f'{kind}={value}' for kind, value in commands.items())}")
+                with self._commands:
+                    self.commands_dropped += len(commands)
                 continue
+            with self._commands:
+                data = self._encode_commands(commands, retransmits)
+            try:
+                self._write(data)
             except Exception as e:
                 logger.error(f"發送命令時發生錯誤: {str(e)}")
-            finally:
-                if not self.command_queue.empty():
-                    self.command_queue.task_done()
+                with self._commands:
+                    self.commands_dropped += len(commands)
+                continue
+            self._last_write = time.monotonic()
+            with self._commands:
+                self._last_sent.update(commands)
+                self.writes += 1
+                self.bytes_written += len(data)
+
+    def stats(self) -> dict:
+        """命令緩衝區與封包協定的統計資料；往返時間只在封包模式下有值"""
+        with self._commands:
+            rtt = {}
+            for kind, samples in self._rtts.items():
+                ordered = sorted(samples)
+                rtt[kind] = {
+                    'count': len(ordered),
+                    'last_ms': samples[-1] * 1000,
+                    'mean_ms': sum(ordered) / len(ordered) * 1000,
+                    'p95_ms': ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))] * 1000,
+                    'max_ms': ordered[-1] * 1000,
+                }
+            return {
+                'protocol': self.protocol,
+                'submitted': self.commands_submitted,
+                'merged': self.commands_merged,
+                'unchanged': self.commands_unchanged,
+                'dropped': self.commands_dropped,
+                'pending': len(self._pending),
+                'inflight': len(self._inflight),
+                'acked': self.commands_acked,
+                'retransmits': self.retransmits,
+                'corrupt_frames': self._decoder.corrupt_frames,
+                'writes': self.writes,
+                'bytes_written': self.bytes_written,
+                'rtt': rtt,
+            }
 
     def set_confidence(self, confidence: float) -> None:
         """
         設置信心度 LED
-        
+
         Args:
             confidence: 0-100 之間的信心度值
         """
@@ -172,14 +547,14 @@ class ArduinoController:
 
         try:
             confidence = max(0, min(100, float(confidence)))
-            self.command_queue.put(f"CONF:{int(confidence)}\n")
+            self._submit('CONF', int(confidence))
         except Exception as e:
             logger.error(f"設置信心度時發生錯誤: {str(e)}")
 
     def set_status(self, is_busy: bool) -> None:
         """
         設置狀態 LED
-        
+
         Args:
             is_busy: True 表示忙碌，False 表示就緒
         """
@@ -188,18 +563,17 @@ class ArduinoController:
             return
 
         try:
-            status = "BUSY\n" if is_busy else "READY\n"
-            self.command_queue.put(status)
+            self._submit('STATUS', 1 if is_busy else 0)
         except Exception as e:
             logger.error(f"設置狀態時發生錯誤: {str(e)}")
 
-    def register_callbacks(self, 
+    def register_callbacks(self,
                          style_cb: Optional[Callable[[int], None]] = None,
                          confirm_cb: Optional[Callable[[], None]] = None,
                          connection_cb: Optional[Callable[[bool], None]] = None) -> None:
         """
         註冊回調函數
-        
+
         Args:
             style_cb: 風格改變時的回調函數
             confirm_cb: 確認按鈕按下時的回調函數
@@ -0,0 +1,333 @@
+"""
+虛擬 Arduino：在 Linux 虛擬終端（PTY）上模擬設備，不需要實體開發板就能測試 ArduinoController
+
+模擬器支援文字協定與二進位封包協定，可以依設定的速率送出風格/確認按鈕事件，
+並依鮑率加上傳輸延遲。串口路徑是一個固定的符號連結，模擬斷線後重新建立 PTY 時路徑不變。
+
+用法：
+    python arduino_simulator.py --link /tmp/virtual-arduino --events 2
+    （另一個終端）ArduinoController('/tmp/virtual-arduino')
+"""
+import argparse
+import logging
+import os
+import random
+import select
+import threading
+import time
+import tty
+from typing import Callable, Optional
+
+from serial_protocol import (COMMAND_FRAMES, FRAME_ACK, FRAME_CONFIRM, FRAME_STYLE, HELLO, HELLO_REPLY,
+                             FrameDecoder, encode_frame)
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_LINK = '/tmp/virtual-arduino'
+STYLE_COUNT = 5  # 風格按鈕的數量，對應 model_utils.STYLES
+BITS_PER_BYTE = 10  # 8N1：起始位元 + 8 個資料位元 + 停止位元
+FRAME_KINDS = {frame_type: kind for kind, frame_type in COMMAND_FRAMES.items()}
+
+
+class VirtualArduino:
+    def __init__(self, link: str = DEFAULT_LINK, baudrate: int = 9600, framed: bool = True,
+                 event_rate: float = 0.0, ack_loss: float = 0.0,
+                 on_command: Optional[Callable[[str, int, float], None]] = None):
+        """
+        Args:
+            link: 串口路徑（符號連結，指向目前的 PTY）
+            baudrate: 模擬的鮑率，決定每個位元組的傳輸延遲；0 表示不加延遲
+            framed: 是否回應封包協定的協商
+            event_rate: 每秒自動送出的按鈕事件數，0 表示不自動送出
+            ack_loss: 封包模式下故意不回 ACK 的機率，用來測試重送
+            on_command: 收到命令時的回調函數，參數為 (命令類型, 值, 收到的時間 perf_counter)
+        """
+        self.link = link
+        self.baudrate = baudrate
+        self.framed = framed
+        self.event_rate = event_rate
+        self.ack_loss = ack_loss
+        self.on_command = on_command
+        self.running = False
+        self.master: Optional[int] = None
+        self.slave: Optional[int] = None
+        self.protocol = 'text'
+        self.threads = []
+        self._write_lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._online = threading.Event()
+        self._wake_r, self._wake_w = os.pipe()  # PTY 重建時喚醒阻塞在 select 中的讀取線程
+        self._seq = 0
+
+        # 設備狀態
+        self.confidence: Optional[int] = None
+        self.busy: Optional[bool] = None
+
+        # 統計資料
+        self.commands_received = 0
+        self.bytes_received = 0
+        self.events_sent = 0
+        self.event_acks = 0
+        self.acks_dropped = 0
+        self.disconnects = 0
+
+    @property
+    def port(self) -> str:
+        return self.link
+
+    def start(self) -> None:
+        """建立 PTY 並啟動讀取與事件線程"""
+        if self.running:
+            return
+        self.running = True
+        self._stop_event.clear()
+        self._open_pty()
+        for target, name in ((self._serve, 'arduino-sim-serve'), (self._generate_events, 'arduino-sim-events')):
+            thread = threading.Thread(target=target, name=name)
+            thread.daemon = True
+            thread.start()
+            self.threads.append(thread)
+        logger.info(f"虛擬 Arduino 已啟動：{self.link}（鮑率 {self.baudrate}，封包協定 {'開啟' if self.framed else '關閉'}）")
+
+    def stop(self) -> None:
+        self.running = False
+        self._stop_event.set()
+        self._online.set()
+        self._close_pty()
+        for thread in self.threads:
+            thread.join(timeout=1.0)
+        self.threads = []
+        os.close(self._wake_r)
+        os.close(self._wake_w)
+
+    def _open_pty(self) -> None:
+        master, slave = os.openpty()
+        tty.setraw(master)
+        tty.setraw(slave)
+        tmp_link = f'{self.link}.{os.getpid()}.tmp'
+        if os.path.lexists(tmp_link):
+            os.remove(tmp_link)
+        os.symlink(os.ttyname(slave), tmp_link)
+        os.replace(tmp_link, self.link)
+        self.master, self.slave = master, slave
+        # 新開機的設備一律從文字協定開始
+        self.protocol = 'text'
+        self._online.set()
+        os.write(self._wake_w, b'\0')
+
+    def _close_pty(self) -> None:
+        self._online.clear()
+        os.write(self._wake_w, b'\0')
+        master, slave = self.master, self.slave
+        self.master = self.slave = None
+        for fd in (master, slave):
+            if fd is not None:
+                try:
+                    os.close(fd)
+                except OSError:
+                    pass
+        if os.path.lexists(self.link):
+            os.remove(self.link)
+
+    def drop_connection(self, down_time: float = 0.0) -> None:
+        """
+        模擬 USB 線被拔掉：關閉 PTY，down_time 秒後以相同的路徑重新出現
+
+        Args:
+            down_time: 設備離線的時間（秒）
+        """
+        self.disconnects += 1
+        self._close_pty()
+        if self._stop_event.wait(down_time):
+            return
+        self._open_pty()
+
+    def _transmit_delay(self, size: int) -> None:
+        if self.baudrate:
+            time.sleep(size * BITS_PER_BYTE / self.baudrate)
+
+    def _send(self, data: bytes) -> bool:
+        with self._write_lock:
+            master = self.master
+            if master is None:
+                return False
+            self._transmit_delay(len(data))
+            try:
+                os.write(master, data)
+            except OSError:
+                return False
+            return True
+
+    def _next_seq(self) -> int:
+        self._seq = (self._seq + 1) & 0xFF
+        return self._seq
+
+    def inject_style(self, style: int) -> float:
+        """
+        模擬按下風格按鈕
+
+        Returns:
+            float: 送出的時間（perf_counter），用來計算端到端延遲
+        """
+        if self.protocol == 'binary':
+            data = encode_frame(self._next_seq(), FRAME_STYLE, bytes((style & 0xFF,)))
+        else:
+            data = f"STYLE:{style}\n".encode('utf-8')
+        sent_at = time.perf_counter()
+        if self._send(data):
+            self.events_sent += 1
+        return sent_at
+
+    def inject_confirm(self) -> float:
+        """模擬按下確認按鈕"""
+        if self.protocol == 'binary':
+            data = encode_frame(self._next_seq(), FRAME_CONFIRM)
+        else:
+            data = b"CONFIRM\n"
+        sent_at = time.perf_counter()
+        if self._send(data):
+            self.events_sent += 1
+        return sent_at
+
+    def _generate_events(self) -> None:
+        """依 event_rate 隨機送出按鈕事件（間隔為指數分佈）"""
+        while self.running:
+            if not self.event_rate:
+                if self._stop_event.wait(0.5):
+                    return
+                continue
+            if self._stop_event.wait(random.expovariate(self.event_rate)):
+                return
+            if random.random() < 0.8:
+                self.inject_style(random.randrange(STYLE_COUNT))
+            else:
+                self.inject_confirm()
+
+    def _serve(self) -> None:
+        """讀取主機送來的資料並回應"""
+        buffer = bytearray()
+        decoder = FrameDecoder()
+        master = None
+        while self.running:
+            if self.master is None:
+                self._online.wait()
+                continue
+            if master != self.master:
+                # 重新開機：清除未完成的資料
+                master = self.master
+                buffer.clear()
+                decoder = FrameDecoder()
+            try:
+                ready, _, _ = select.select([master, self._wake_r], [], [])
+                if self._wake_r in ready:
+                    os.read(self._wake_r, 64)
+                    # PTY 可能已經重建（檔案描述元編號可能相同），重新初始化
+                    master = None
+                    continue
+                data = os.read(master, 1024)
+            except (OSError, ValueError):
+                # PTY 已被關閉（模擬斷線）
+                master = None
+                continue
+            if not data:
+                continue
+            received_at = time.perf_counter()
+            self.bytes_received += len(data)
+            self._transmit_delay(len(data))
+
+            if self.protocol == 'binary':
+                for seq, frame_type, payload in decoder.feed(data):
+                    self._handle_frame(seq, frame_type, payload, received_at)
+                continue
+
+            buffer.extend(data)
+            while True:
+                end = buffer.find(b'\n')
+                if end < 0:
+                    break
+                line = bytes(buffer[:end]).strip()
+                del buffer[:end + 1]
+                if line + b'\n' == HELLO:
+                    if self.framed:
+                        self._send(HELLO_REPLY + b'\n')
+                        self.protocol = 'binary'
+                        # 回覆之後的資料都是封包
+                        decoder.feed(bytes(buffer))
+                        buffer.clear()
+                        break
+                    continue
+                self._handle_line(line.decode('utf-8', 'replace'), received_at)
+
+    def _handle_line(self, line: str, received_at: float) -> None:
+        if line.startswith('CONF:'):
+            self._apply('CONF', int(line[len('CONF:'):]), received_at)
+        elif line in ('BUSY', 'READY'):
+            self._apply('STATUS', 1 if line == 'BUSY' else 0, received_at)
+
+    def _handle_frame(self, seq: int, frame_type: int, payload: bytes, received_at: float) -> None:
+        if frame_type == FRAME_ACK:
+            self.event_acks += 1
+            return
+        if random.random() < self.ack_loss:
+            self.acks_dropped += 1
+            return
+        self._send(encode_frame(seq, FRAME_ACK, bytes((seq,))))
+        kind = FRAME_KINDS.get(frame_type)
+        if kind and payload:
+            self._apply(kind, payload[0], received_at)
+
+    def _apply(self, kind: str, value: int, received_at: float) -> None:
+        self.commands_received += 1
+        if kind == 'CONF':
+            self.confidence = value
+        else:
+            self.busy = bool(value)
+        if self.on_command:
+            self.on_command(kind, value, received_at)
+
+    def stats(self) -> dict:
+        return {
+            'protocol': self.protocol,
+            'commands_received': self.commands_received,
+            'bytes_received': self.bytes_received,
+            'events_sent': self.events_sent,
+            'event_acks': self.event_acks,
+            'acks_dropped': self.acks_dropped,
+            'disconnects': self.disconnects,
+        }
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='在虛擬終端上模擬 Arduino 設備')
+    parser.add_argument('--link', default=DEFAULT_LINK, help='串口路徑（符號連結）')
+    parser.add_argument('--baudrate', type=int, default=9600, help='模擬的鮑率，0 表示不加延遲')
+    parser.add_argument('--text-only', action='store_true', help='只支援文字協定（模擬舊韌體）')
+    parser.add_argument('--events', type=float, default=0.0, help='每秒自動送出的按鈕事件數')
+    args = parser.parse_args()
+
+    def print_command(kind, value, received_at):
+        print(f"{kind} = {value}")
+
+    device = VirtualArduino(args.link, baudrate=args.baudrate, framed=not args.text_only,
+                            event_rate=args.events, on_command=print_command)
+    device.start()
+    print(f"虛擬 Arduino 已在 {device.port} 上執行，按 Ctrl+C 停止")
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        device.stop()
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    main()
@@ -0,0 +1,349 @@
+"""
+ASGI 進入點：以非同步方式提供 JSON 辨識 API
+
+    uvicorn asgi:application
+
+/api/v1/predict 與 /api/v1/predict/stream 在事件迴圈中接收請求內容，慢速上傳只佔用一個協程，
+不會佔住工作線程；驗證、解碼、等待模型結果與顏色分析交給 app.api_executor 執行。
+multipart 請求以 werkzeug 的 sans-IO 解析器邊收邊解析，每個檔案收完就開始辨識，
+串流端點依完成先後送出 NDJSON，第一張圖片的結果不必等整個上傳結束。
+其他路徑交給 Flask 處理（需要 asgiref；未安裝時只提供上述 API）。
+"""
+import asyncio
+import io
+import logging
+import math
+import time
+from typing import AsyncIterator, Optional, Tuple
+
+from werkzeug.http import parse_options_header
+from werkzeug.sansio.multipart import Data, Epilogue, File, MultipartDecoder, NeedData
+
+import app as web
+from admission import Overloaded
+from image_io import MAX_UPLOAD_BYTES, ImageValidationError, read_upload
+
+logger = logging.getLogger(__name__)
+
+PREDICT_PATH = '/api/v1/predict'
+STREAM_PATH = '/api/v1/predict/stream'
+MAX_FIELD_BYTES = 64 * 1024  # multipart 中非檔案欄位的大小上限
+DECODER_FEED_BYTES = 16 * 1024  # 每次送入 multipart 解析器的大小
+
+
+class RequestError(Exception):
+    def __init__(self, status: int, message: str, retry_after: Optional[float] = None):
+        super().__init__(message)
+        self.status = status
+        self.retry_after = retry_after
+
+
+def _json_bytes(item) -> bytes:
+    return web.ndjson_line(item).encode('utf-8')
+
+
+async def _send_json(send, status: int, item, headers=()) -> None:
+    body = _json_bytes(item)
+    await send({
+        'type': 'http.response.start',
+        'status': status,
+        'headers': [(b'content-type', b'application/json; charset=utf-8'),
+                    (b'content-length', str(len(body)).encode())] + list(headers),
+    })
+    await send({'type': 'http.response.body', 'body': body})
+
+
+def _too_large() -> RequestError:
+    web.REQUESTS_SHED.labels('too_large').inc()
+    return RequestError(413, f'上傳內容超過 {web.MAX_REQUEST_BYTES // (1024 * 1024)} MB 上限')
+
+
+async def _iter_body(receive) -> AsyncIterator[bytes]:
+    """逐塊讀取請求內容；用戶端中途斷線或超過 MAX_REQUEST_BYTES 時結束"""
+    size = 0
+    while True:
+        message = await receive()
+        if message['type'] == 'http.disconnect':
+            raise RequestError(400, '用戶端已中斷連線')
+        chunk = message.get('body', b'')
+        if chunk:
+            size += len(chunk)
+            if size > web.MAX_REQUEST_BYTES:
+                raise _too_large()
+            yield chunk
+        if not message.get('more_body', False):
+            return
+
+
+async def _read_raw(receive) -> bytes:
+    """讀取整個請求內容作為圖片，超過大小上限時立即停止"""
+    buffer = bytearray()
+    async for chunk in _iter_body(receive):
+        buffer += chunk
+        if len(buffer) > MAX_UPLOAD_BYTES:
+            raise RequestError(413, f'檔案超過 {MAX_UPLOAD_BYTES // (1024 * 1024)} MB 上限')
+    return bytes(buffer)
+
+
+async def _iter_files(receive, boundary: bytes) -> AsyncIterator[Tuple[str, str, Optional[bytes]]]:
+    """
+    邊接收邊解析 multipart，每個檔案收完就產出
+
+    Yields:
+        tuple: (欄位名稱, 檔案名稱, 內容)；檔案超過大小上限時內容為 None
+    """
+    decoder = MultipartDecoder(boundary, max_form_memory_size=MAX_FIELD_BYTES)
+    current: Optional[File] = None
+    buffer = bytearray()
+    oversized = False
+    completed = []
+
+    def drain():
+        nonlocal current, buffer, oversized
+        while True:
+            event = decoder.next_event()
+            if isinstance(event, (NeedData, Epilogue)):
+                return
+            if isinstance(event, File):
+                current, buffer, oversized = event, bytearray(), False
+            elif isinstance(event, Data) and current is not None:
+                if not oversized:
+                    buffer += event.data
+                    if len(buffer) > MAX_UPLOAD_BYTES:
+                        oversized, buffer = True, bytearray()
+                if not event.more_data:
+                    completed.append((current.name, current.filename, None if oversized else bytes(buffer)))
+                    current = None
+
+    async for chunk in _iter_body(receive):
+        # 解析器把 max_form_memory_size 套用在尚未解析的緩衝區上，一次收到的區塊比上限大時
+        # 會直接拒絕，所以切成小段逐段送入、逐段取出事件
+        for start in range(0, len(chunk), DECODER_FEED_BYTES):
+            decoder.receive_data(chunk[start:start + DECODER_FEED_BYTES])
+            drain()
+        while completed:
+            yield completed.pop(0)
+    decoder.receive_data(None)
+    drain()
+    while completed:
+        yield completed.pop(0)
+
+
+def _classify(index: int, filename: Optional[str], data: Optional[bytes]) -> dict:
+    """在 api_executor 中執行：計算摘要並辨識，錯誤以一筆結果回報"""
+    if data is None:
+        web.UPLOADS_REJECTED.labels('invalid').inc()
+        return {'index': index, 'filename': filename,
+                'error': f'檔案超過 {MAX_UPLOAD_BYTES // (1024 * 1024)} MB 上限'}
+    try:
+        data, digest = read_upload(io.BytesIO(data))
+    except ImageValidationError as e:
+        web.UPLOADS_REJECTED.labels('invalid').inc()
+        return {'index': index, 'filename': filename, 'error': str(e)}
+    return web.classify_item(index, filename, data, digest)
+
+
+async def _enter() -> None:
+    """上傳內容讀完、開始辨識前在事件迴圈中排隊取得處理空位，由 _submit() 的結果釋放"""
+    try:
+        waited = await web.admission.enter_async()
+    except Overloaded as e:
+        web.REQUESTS_SHED.labels(e.reason).inc()
+        logger.warning(f"請求過多（{e.reason}），拒絕辨識")
+        raise RequestError(503, '伺服器忙碌中，請稍後再試', e.retry_after)
+    web.QUEUE_WAIT_SECONDS.observe(waited)
+
+
+def _submit(index: int, filename: Optional[str], data: Optional[bytes]) -> asyncio.Future:
+    """
+    送入 api_executor 辨識（呼叫前需已以 _enter() 取得空位）。
+    空位在辨識實際結束時釋放；協程被取消時，還在執行的辨識仍佔著空位直到完成
+    """
+    future = web.api_executor.submit(_classify, index, filename, data)
+    future.add_done_callback(lambda _: web.admission.leave())
+    return asyncio.wrap_future(future)
+
+
+class AsyncPredictApp:
+    def __init__(self, fallback=None):
+        """
+        Args:
+            fallback: 處理其他路徑的 ASGI 應用程式，None 表示一律回應 404
+        """
+        self.fallback = fallback
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'http' and scope['path'] in (PREDICT_PATH, STREAM_PATH):
+            endpoint = 'api_predict' if scope['path'] == PREDICT_PATH else 'api_predict_stream'
+            start = time.perf_counter()
+            try:
+                await self.handle(scope, receive, send)
+            except RequestError as e:
+                headers = []
+                if e.retry_after is not None:
+                    headers.append((b'retry-after', str(max(1, math.ceil(e.retry_after))).encode()))
+                await _send_json(send, e.status, {'error': str(e)}, headers)
+            finally:
+                web.REQUEST_SECONDS.labels(endpoint).observe(time.perf_counter() - start)
+            return
+        if self.fallback is not None:
+            await self.fallback(scope, receive, send)
+            return
+        if scope['type'] == 'lifespan':
+            while True:
+                message = await receive()
+                if message['type'] == 'lifespan.startup':
+                    await send({'type': 'lifespan.startup.complete'})
+                elif message['type'] == 'lifespan.shutdown':
+                    await send({'type': 'lifespan.shutdown.complete'})
+                    return
+        if scope['type'] == 'http':
+            await _send_json(send, 404, {'error': '找不到這個路徑'})
+
+    async def handle(self, scope, receive, send) -> None:
+        if scope['method'] != 'POST':
+            raise RequestError(405, '只接受 POST')
+        if not web.model_loader.ready:
+            web.model_loader.start()
+            web.UPLOADS_REJECTED.labels('not_ready').inc()
+            message = '模型載入中，請稍後再試' if web.model_loader.state != web.FAILED else '模型未正確初始化'
+            await _send_json(send, 503, {'error': message, 'state': web.model_loader.state},
+                             [(b'retry-after', str(web.MODEL_RETRY_AFTER).encode())])
+            return
+
+        headers = {key.lower(): value for key, value in scope.get('headers', [])}
+        content_length = headers.get(b'content-length')
+        if content_length is not None and content_length.isdigit() and int(content_length) > web.MAX_REQUEST_BYTES:
+            raise _too_large()
+        if web.rate_limiter is not None and scope.get('client'):
+            try:
+                web.rate_limiter.acquire(scope['client'][0])
+            except Overloaded as e:
+                web.REQUESTS_SHED.labels(e.reason).inc()
+                logger.warning(f"請求過多（{e.reason}），拒絕請求：{scope['path']}")
+                raise RequestError(429, '請求太頻繁，請稍後再試', e.retry_after)
+        await self.process(scope, receive, send, headers)
+
+    async def process(self, scope, receive, send, headers) -> None:
+        mimetype, options = parse_options_header(headers.get(b'content-type', b'').decode('latin-1'))
+        if scope['path'] == PREDICT_PATH and mimetype in web.RAW_IMAGE_MIMETYPES:
+            data = await _read_raw(receive)
+            await _enter()
+            item = await _submit(0, None, data)
+            await self.send_item(send, item)
+            return
+        if mimetype != 'multipart/form-data' or 'boundary' not in options:
+            raise RequestError(400, '請以圖片本身或 multipart/form-data 上傳')
+        boundary = options['boundary'].encode('latin-1')
+
+        if scope['path'] == PREDICT_PATH:
+            async for name, filename, data in _iter_files(receive, boundary):
+                if name == 'file' and filename:
+                    if not web.allowed_file(filename):
+                        web.UPLOADS_REJECTED.labels('type').inc()
+                        raise RequestError(400, '只支援 PNG、JPG、JPEG 和 GIF 格式的圖片')
+                    await _enter()
+                    item = await _submit(0, filename, data)
+                    await self.send_item(send, item)
+                    return
+            web.UPLOADS_REJECTED.labels('missing').inc()
+            raise RequestError(400, '請選擇一個檔案')
+
+        await self.stream(receive, send, boundary)
+
+    async def send_item(self, send, item: dict) -> None:
+        """單張圖片的回應格式與 Flask 版的 /api/v1/predict 相同"""
+        error = item.pop('error', None)
+        item.pop('index', None)
+        item.pop('filename', None)
+        if error is not None:
+            await _send_json(send, 400, {'error': error})
+        else:
+            await _send_json(send, 200, item)
+
+    async def stream(self, receive, send, boundary: bytes) -> None:
+        """
+        每個檔案收完就送去辨識，結果依完成先後以 NDJSON 送出，上傳還沒結束時也會先送出。
+        每張圖片辨識時各佔一個處理空位，後面的檔案還在上傳時不佔空位；取不到空位的圖片回報一筆錯誤
+        """
+        await send({
+            'type': 'http.response.start',
+            'status': 200,
+            'headers': [(b'content-type', web.NDJSON_MIMETYPE.encode())],
+        })
+        results: asyncio.Queue = asyncio.Queue()
+        pending = 0
+
+        async def submit(item_or_args):
+            nonlocal pending
+            pending += 1
+            if not isinstance(item_or_args, dict):
+                try:
+                    await _enter()
+                except RequestError as e:
+                    item_or_args = {'index': item_or_args[0], 'filename': item_or_args[1], 'error': str(e)}
+            if isinstance(item_or_args, dict):
+                results.put_nowait(item_or_args)
+                return
+            future = _submit(*item_or_args)
+            future.add_done_callback(lambda f, args=item_or_args: results.put_nowait(collect(f, *args[:2])))
+
+        def collect(future, index, filename) -> dict:
+            """每個送出的檔案都要產生剛好一筆結果，否則最後等待 pending 歸零時會卡住"""
+            if future.cancelled():
+                return {'index': index, 'filename': filename, 'error': '處理圖片時已取消'}
+            if future.exception() is not None:
+                return {'index': index, 'filename': filename,
+                        'error': f'處理圖片時發生錯誤：{str(future.exception())}'}
+            return future.result()
+
+        async def flush():
+            nonlocal pending
+            while not results.empty():
+                await send({'type': 'http.response.body', 'body': _json_bytes(await results.get()),
+                            'more_body': True})
+                pending -= 1
+
+        # 回應標頭已經送出，之後的錯誤只能以最後一行 NDJSON 回報，不能再交給 __call__ 送出錯誤回應
+        index = 0
+        error = None
+        try:
+            async for name, filename, data in _iter_files(receive, boundary):
+                if name != 'files' or not filename:
+                    continue
+                if index >= web.MAX_BATCH_FILES:
+                    await submit({'index': index, 'filename': filename,
+                            'error': f'一次最多只能上傳 {web.MAX_BATCH_FILES} 個檔案'})
+                elif not web.allowed_file(filename):
+                    web.UPLOADS_REJECTED.labels('type').inc()
+                    await submit({'index': index, 'filename': filename, 'error': '只支援 PNG、JPG、JPEG 和 GIF 格式的圖片'})
+                else:
+                    await submit((index, filename, data))
+                index += 1
+                await flush()
+        except RequestError as e:
+            logger.warning(f"串流辨識中斷：{str(e)}")
+            error = str(e)
+        except Exception as e:
+            logger.error(f"串流辨識中斷：{str(e)}")
+            error = f'無法解析上傳內容：{str(e)}'
+        while pending:
+            await send({'type': 'http.response.body', 'body': _json_bytes(await results.get()),
+                        'more_body': True})
+            pending -= 1
+        if error is not None:
+            await send({'type': 'http.response.body', 'body': _json_bytes({'error': error}), 'more_body': True})
+        await send({'type': 'http.response.body', 'body': b''})
+
+
+def create_application():
+    """API 以原生 ASGI 處理，其他路徑透過 asgiref 交給 Flask"""
+    try:
+        from asgiref.wsgi import WsgiToAsgi
+    except ImportError:
+        logger.warning("未安裝 asgiref，ASGI 模式只提供 /api/v1 辨識 API")
+        return AsyncPredictApp()
+    return AsyncPredictApp(WsgiToAsgi(web.app))
+
+
+application = create_application()
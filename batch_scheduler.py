@@ -0,0 +1,159 @@
+import logging
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from typing import Any, List, Optional, Tuple
+
+from metrics import STAGE_SECONDS, Histogram
+
+logger = logging.getLogger(__name__)
+
+BATCH_SIZES = Histogram('fashion_batch_size', '每個微批次實際合併的請求數', buckets=(1, 2, 4, 8, 16, 32, 64))
+QUEUE_SECONDS = STAGE_SECONDS.labels('queue')
+
+
+class BatchScheduler:
+    def __init__(self, model, max_batch_size: int = 16, max_wait: float = 0.005, workers: int = 1):
+        """
+        動態微批次排程器：收集短時間內到達的預測請求，合併成一個批次送入模型
+
+        Args:
+            model: 提供 predict_batch(images) 的模型，例如 FashionModel
+            max_batch_size: 單一批次最多的圖片數
+            max_wait: 第一個請求到達後最多等待的秒數，也是排程額外增加延遲的上限
+            workers: 同時執行的批次數；模型為多行程推論池時設為行程數，讓所有行程都有工作
+        """
+        self.model = model
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self.workers = max(1, workers)
+        self.request_queue: queue.Queue = queue.Queue()
+        self.running = False
+        self.worker_threads: List[threading.Thread] = []
+        self._lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+
+        # 統計資料
+        self.batches_run = 0
+        self.requests_served = 0
+
+    def start(self) -> None:
+        """啟動批次處理線程"""
+        with self._lock:
+            if self.running:
+                return
+            self.running = True
+            self.worker_threads = []
+            for i in range(self.workers):
+                thread = threading.Thread(target=self._run, name=f'batch-scheduler-{i}')
+                thread.daemon = True
+                thread.start()
+                self.worker_threads.append(thread)
+        logger.info(f"批次排程器已啟動（最大批次 {self.max_batch_size}，等待上限 {self.max_wait * 1000:.1f} ms，"
+                    f"同時 {self.workers} 個批次）")
+
+    def stop(self, timeout: float = 1.0) -> None:
+        """停止批次處理線程，尚未處理的請求會收到例外"""
+        with self._lock:
+            if not self.running:
+                return
+            self.running = False
+            # 每個處理線程各需要一個停止訊號
+            for _ in self.worker_threads:
+                self.request_queue.put(None)
+        for thread in self.worker_threads:
+            thread.join(timeout)
+        self._fail_pending(RuntimeError("批次排程器已停止"))
+
+    def submit(self, image: Any) -> Future:
+        """
+        提交一張圖片
+
+        Args:
+            image: 任何 predict_batch 接受的輸入（路徑、bytes、陣列）
+
+        Returns:
+            Future: 完成後的結果為 (標籤, 信心度)
+        """
+        future: Future = Future()
+        if not self.running:
+            future.set_exception(RuntimeError("批次排程器尚未啟動"))
+            return future
+        self.request_queue.put((image, future, time.perf_counter()))
+        return future
+
+    def predict(self, image: Any, timeout: Optional[float] = None) -> Tuple[str, float]:
+        """提交圖片並等待結果，介面與 FashionModel.predict 相同"""
+        return self.submit(image).result(timeout)
+
+    @property
+    def average_batch_size(self) -> float:
+        return self.requests_served / self.batches_run if self.batches_run else 0.0
+
+    def _collect(self) -> List[Tuple[Any, Future, float]]:
+        """阻塞等待第一個請求，之後在時間窗內盡量湊滿一個批次"""
+        first = self.request_queue.get()
+        if first is None:
+            return []
+        batch = [first]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                item = self.request_queue.get(timeout=remaining)
+            except queue.Empty:
+                break
+            if item is None:
+                # 停止訊號放回佇列，讓主迴圈在處理完這個批次後結束
+                self.request_queue.put(None)
+                break
+            batch.append(item)
+        return batch
+
+    def _run(self) -> None:
+        """批次處理主迴圈"""
+        while self.running:
+            batch = self._collect()
+            if not batch:
+                continue
+            # 已被取消的請求不送入模型
+            batch = [item for item in batch if item[1].set_running_or_notify_cancel()]
+            if not batch:
+                continue
+            started = time.perf_counter()
+            for _, _, submitted in batch:
+                QUEUE_SECONDS.observe(started - submitted)
+            BATCH_SIZES.observe(len(batch))
+            batch = [(image, future) for image, future, _ in batch]
+            try:
+                results = self.model.predict_batch([image for image, _ in batch])
+            except Exception as e:
+                logger.error(f"批次預測時發生錯誤：{str(e)}")
+                for _, future in batch:
+                    future.set_exception(e)
+                continue
+            for (_, future), result in zip(batch, results):
+                future.set_result(result)
+            with self._stats_lock:
+                self.batches_run += 1
+                self.requests_served += len(batch)
+
+    def _fail_pending(self, error: Exception) -> None:
+        """讓佇列中剩下的請求立即得到例外，避免呼叫端永遠等待"""
+        while True:
+            try:
+                item = self.request_queue.get_nowait()
+            except queue.Empty:
+                return
+            if item is not None and item[1].set_running_or_notify_cancel():
+                item[1].set_exception(error)
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.stop()
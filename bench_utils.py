@@ -0,0 +1,34 @@
+"""
+效能測試共用的統計與基準比較（benchmark_app.py、benchmark_serial.py）
+"""
+from typing import Dict, List, Sequence, Tuple
+
+
+def percentile(values: List[float], fraction: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+
+def compare(results: Dict[str, float], baseline: Dict[str, float], tolerance: float,
+            metrics: Sequence[Tuple[str, bool]]) -> List[str]:
+    """
+    列出比基準退步超過 tolerance（比例）的指標
+
+    Args:
+        metrics: 要比較的 (名稱, 數值越大越好) 列表
+    """
+    regressions = []
+    for name, higher_is_better in metrics:
+        if name not in results or name not in baseline:
+            continue
+        current, reference = results[name], baseline[name]
+        if higher_is_better:
+            worse = current < reference * (1 - tolerance)
+        else:
+            # 非常小的數值（例如 0.1 ms）容易受雜訊影響，加上 1 的絕對容許量
+            worse = current > reference * (1 + tolerance) + 1.0
+        if worse:
+            regressions.append(f"{name}: {current:.2f}（基準 {reference:.2f}）")
+    return regressions
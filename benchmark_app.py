@@ -0,0 +1,385 @@
+"""
+網頁應用的端到端負載測試與微基準測試
+
+以 model/ 與 static/ 中附帶的 JPEG 作為測試圖片：
+  - 負載測試：在多個並行度下上傳圖片，量測吞吐量與 p50/p95/p99 延遲。
+    預設在同一個行程內以 Flask 測試用戶端驅動 app；指定 --url 時改為對執行中的伺服器發出 HTTP 請求。
+    行程內測試的上傳圖片、衍生檔與預測快取寫到暫存目錄，結束時刪除，不留在 static/ 與 instance/。
+    每個請求預設在 JPEG 結尾之後附加不同的位元組，讓圖片摘要都不相同，量測的是沒有命中預測快取的完整路徑；
+    --cached 則重複使用相同的圖片。
+  - 微基準：FashionModel.predict、前處理與 get_recommendation。
+
+用法：
+    python benchmark_app.py --output app.json
+    python benchmark_app.py --url http://localhost:5000 --concurrency 1,8,32
+    python benchmark_app.py --baseline app.json   # 與基準比較，退步超過容許範圍時結束代碼為 1
+"""
+import argparse
+import contextlib
+import glob
+import http.client
+import itertools
+import json
+import logging
+import os
+import platform
+import random
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from typing import Callable, Dict, List, Sequence, Tuple
+from urllib.parse import urlsplit
+
+from bench_utils import compare, percentile
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+CORPUS_PATTERNS = ('model/*.jpg', 'static/style_images/*.jpg', 'static/color_images/*.jpg')
+ENDPOINT_FIELDS = {'/': 'file', '/api/predict_batch': 'files'}  # 各端點的上傳欄位名稱
+READY_TIMEOUT = 180.0  # 等待模型就緒的最長時間（秒）
+
+
+def load_corpus() -> List[Tuple[str, bytes]]:
+    """
+    Returns:
+        list: (路徑, 檔案內容)，依路徑排序
+    """
+    paths = sorted(path for pattern in CORPUS_PATTERNS for path in glob.glob(os.path.join(BASE_DIR, pattern)))
+    corpus = []
+    for path in paths:
+        with open(path, 'rb') as f:
+            corpus.append((path, f.read()))
+    if not corpus:
+        raise RuntimeError("找不到測試圖片")
+    return corpus
+
+
+def encode_multipart(field: str, filename: str, data: bytes) -> Tuple[bytes, str]:
+    """
+    Returns:
+        tuple: (請求內容, Content-Type)
+    """
+    boundary = uuid.uuid4().hex
+    head = (f'--{boundary}\r\n'
+            f'Content-Disposition: form-data; name="{field}"; filename="{filename}"\r\n'
+            f'Content-Type: image/jpeg\r\n\r\n').encode('utf-8')
+    tail = f'\r\n--{boundary}--\r\n'.encode('utf-8')
+    return head + data + tail, f'multipart/form-data; boundary={boundary}'
+
+
+def summarize(latencies: List[float]) -> Dict[str, float]:
+    """由每次呼叫的耗時（秒）計算毫秒統計"""
+    ms = [value * 1000 for value in latencies]
+    return {
+        'mean_ms': sum(ms) / len(ms) if ms else 0.0,
+        'p50_ms': percentile(ms, 0.5),
+        'p95_ms': percentile(ms, 0.95),
+        'p99_ms': percentile(ms, 0.99),
+    }
+
+
+# ---- 負載測試的目標 ----
+
+class InProcessTarget:
+    def __init__(self, module):
+        """在同一個行程內以 Flask 測試用戶端呼叫 app，不經過網路"""
+        self.module = module
+        self.description = 'in-process'
+
+    def wait_ready(self, timeout: float) -> None:
+        if not self.module.model_loader.wait(timeout):
+            raise RuntimeError(f"模型未在 {timeout:.0f} 秒內就緒（{self.module.model_loader.state}）")
+
+    def session(self) -> Callable[[str, bytes, str], int]:
+        # 每個線程各用一個測試用戶端
+        client = self.module.app.test_client()
+
+        def post(path: str, body: bytes, content_type: str) -> int:
+            return client.post(path, data=body, content_type=content_type).status_code
+        return post
+
+
+@contextlib.contextmanager
+def isolated_storage(module):
+    """
+    行程內負載測試期間，把 app 的上傳目錄、上傳圖片衍生檔與預測快取改到暫存目錄，結束時刪除。
+    參考圖片的衍生檔不在暫存目錄中，結果頁的參考圖片不輸出 srcset
+    """
+    from image_variants import VARIANT_FOLDER
+
+    storage = module.upload_storage
+    saved = (module.UPLOAD_FOLDER, storage.root, storage.derived_root,
+             module.image_variants.static_folder, module.PREDICTION_CACHE_FILE)
+    storage.stop()
+    with tempfile.TemporaryDirectory(prefix='fashion-bench-') as root:
+        upload_folder = os.path.join(root, 'uploads')
+        os.makedirs(upload_folder)
+        module.UPLOAD_FOLDER = module.app.config['UPLOAD_FOLDER'] = storage.root = upload_folder
+        # 上傳圖片的衍生檔寫在 static_folder/variants/uploads 下
+        storage.derived_root = os.path.join(root, VARIANT_FOLDER, 'uploads')
+        module.image_variants.static_folder = root
+        # 模型可能在匯入 app 後才載入完成，預測快取建立時才讀取這個路徑
+        module.PREDICTION_CACHE_FILE = os.path.join(root, 'prediction_cache.json')
+        if module.prediction_cache is not None:
+            module.prediction_cache.persist_path = module.PREDICTION_CACHE_FILE
+        try:
+            yield root
+        finally:
+            # 測試資料不寫入正式的預測快取（結束行程時也不會保存）
+            if module.prediction_cache is not None:
+                module.prediction_cache.persist_path = None
+            (module.UPLOAD_FOLDER, storage.root, storage.derived_root,
+             module.image_variants.static_folder, module.PREDICTION_CACHE_FILE) = saved
+            module.app.config['UPLOAD_FOLDER'] = module.UPLOAD_FOLDER
+
+
+class HttpTarget:
+    def __init__(self, url: str):
+        """對執行中的伺服器發出 HTTP 請求；每個線程各自保持一條連線"""
+        parts = urlsplit(url)
+        self.host = parts.hostname or 'localhost'
+        self.port = parts.port or 80
+        self.description = url
+
+    def _connection(self) -> http.client.HTTPConnection:
+        return http.client.HTTPConnection(self.host, self.port, timeout=60)
+
+    def wait_ready(self, timeout: float) -> None:
+        deadline = time.monotonic() + timeout
+        while True:
+            try:
+                conn = self._connection()
+                conn.request('GET', '/readyz')
+                status = conn.getresponse().status
+                conn.close()
+                if status == 200:
+                    return
+            except OSError:
+                pass
+            if time.monotonic() > deadline:
+                raise RuntimeError(f"伺服器未在 {timeout:.0f} 秒內就緒")
+            time.sleep(1.0)
+
+    def session(self) -> Callable[[str, bytes, str], int]:
+        state = {'conn': None}
+
+        def post(path: str, body: bytes, content_type: str) -> int:
+            if state['conn'] is None:
+                state['conn'] = self._connection()
+            conn = state['conn']
+            try:
+                conn.request('POST', path, body, {'Content-Type': content_type})
+                response = conn.getresponse()
+                response.read()
+            except (http.client.HTTPException, OSError):
+                conn.close()
+                state['conn'] = None
+                raise
+            if response.will_close:
+                # 開發伺服器每個請求後都會關閉連線
+                conn.close()
+                state['conn'] = None
+            return response.status
+        return post
+
+
+def run_load(target, corpus: List[Tuple[str, bytes]], path: str, concurrency: int,
+             requests: int, cached: bool) -> Dict[str, float]:
+    """
+    以 concurrency 個線程送出共 requests 個上傳請求
+
+    Returns:
+        dict: 吞吐量、延遲百分位數與錯誤比例
+    """
+    field = ENDPOINT_FIELDS[path]
+    counter = itertools.count()
+    latencies: List[float] = []
+    errors = [0]
+    lock = threading.Lock()
+    run_id = uuid.uuid4().bytes
+
+    def worker():
+        post = target.session()
+        while True:
+            i = next(counter)
+            if i >= requests:
+                return
+            name, data = corpus[i % len(corpus)]
+            if not cached:
+                # JPEG 結尾之後的資料不影響解碼，但讓每個請求的摘要都不同
+                data = data + run_id + i.to_bytes(4, 'big')
+            body, content_type = encode_multipart(field, os.path.basename(name), data)
+            start = time.perf_counter()
+            try:
+                ok = post(path, body, content_type) == 200
+            except Exception:
+                ok = False
+            elapsed = time.perf_counter() - start
+            with lock:
+                latencies.append(elapsed)
+                if not ok:
+                    errors[0] += 1
+
+    threads = [threading.Thread(target=worker, name=f'load-{i}') for i in range(concurrency)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+
+    result = {'requests': requests, 'throughput_rps': requests / elapsed}
+    result.update(summarize(latencies))
+    result['error_percent'] = errors[0] / requests * 100
+    return result
+
+
+# ---- 微基準 ----
+
+def time_calls(function: Callable, inputs: Sequence, iterations: int) -> Dict[str, float]:
+    """依序以 inputs 中的參數呼叫 function 共 iterations 次"""
+    function(inputs[0])  # 第一次呼叫不計時
+    latencies = []
+    for i in range(iterations):
+        argument = inputs[i % len(inputs)]
+        start = time.perf_counter()
+        function(argument)
+        latencies.append(time.perf_counter() - start)
+    result = summarize(latencies)
+    total = sum(latencies)
+    result['ops_per_second'] = iterations / total if total else 0.0
+    return result
+
+
+SIMILARITY_CATALOG_SIZE = 100000  # 相似度檢索微基準使用的模擬目錄大小
+
+
+def run_micro(corpus: List[Tuple[str, bytes]], iterations: int) -> Dict[str, Dict[str, float]]:
+    import numpy as np
+    from color_analysis import ColorAnalyzer
+    from model_utils import BATCH_SIZE, COLOR_COMBINATIONS, FashionModel, get_recommendation
+    from similarity_index import DESCRIPTOR_DIM, SimilarityIndex, describe
+
+    model = FashionModel()
+    model.warm_up()
+    paths = [path for path, _ in corpus]
+    images = [data for _, data in corpus]
+    batches = [[images[(start + i) % len(images)] for i in range(BATCH_SIZE)] for start in range(len(images))]
+    rng = random.Random(0)
+    predictions = [(rng.choice(model.labels), rng.random()) for _ in range(64)]
+    pixels = [model.preprocessor.decode(data) for data in images]
+    # 以隨機單位向量模擬大型目錄，量測檢索時間隨目錄大小的表現
+    embeddings = np.random.default_rng(0).random((SIMILARITY_CATALOG_SIZE, DESCRIPTOR_DIM), dtype=np.float32)
+    embeddings /= np.linalg.norm(embeddings, axis=1, keepdims=True)
+    index = SimilarityIndex(embeddings, [str(i) for i in range(SIMILARITY_CATALOG_SIZE)])
+    descriptors = [describe(p) for p in pixels]
+    analyzer = ColorAnalyzer(COLOR_COMBINATIONS)
+
+    results = {
+        'predict': time_calls(model.predict, paths, iterations),
+        'preprocess': time_calls(model.preprocess, images, iterations),
+        f'preprocess_batch{BATCH_SIZE}': time_calls(model.preprocessor.preprocess_batch, batches,
+                                                    max(1, iterations // BATCH_SIZE)),
+        f'predict_batch{BATCH_SIZE}': time_calls(model.predict_batch, batches, max(1, iterations // BATCH_SIZE)),
+        'get_recommendation': time_calls(lambda p: get_recommendation(*p), predictions, iterations * 100),
+        'describe': time_calls(describe, pixels, iterations),
+        'color_analysis': time_calls(analyzer.analyze, pixels, iterations),
+        f'similarity_search{SIMILARITY_CATALOG_SIZE // 1000}k': time_calls(index.search, descriptors, iterations),
+    }
+    return results
+
+
+# ---- 與基準比較 ----
+
+def flatten(results: dict, prefix: str = '') -> Dict[str, float]:
+    """把巢狀結果攤平成 'load.c4.p95_ms' 形式的鍵"""
+    flat = {}
+    for key, value in results.items():
+        name = f'{prefix}{key}'
+        if isinstance(value, dict):
+            flat.update(flatten(value, name + '.'))
+        elif isinstance(value, (int, float)):
+            flat[name] = value
+    return flat
+
+
+def regression_metrics(flat: Dict[str, float]) -> List[Tuple[str, bool]]:
+    """延遲與錯誤比例越小越好，吞吐量越大越好"""
+    metrics = []
+    for name in flat:
+        if name.endswith('_ms') or name.endswith('error_percent'):
+            metrics.append((name, False))
+        elif name.endswith('throughput_rps') or name.endswith('ops_per_second'):
+            metrics.append((name, True))
+    return metrics
+
+
+def main():
+    parser = argparse.ArgumentParser(description='網頁應用的負載測試與微基準測試')
+    parser.add_argument('--url', help='對執行中的伺服器測試，例如 http://localhost:5000；預設在行程內測試')
+    parser.add_argument('--endpoint', choices=sorted(ENDPOINT_FIELDS), default='/', help='上傳的端點')
+    parser.add_argument('--concurrency', default='1,4,16', help='以逗號分隔的並行度')
+    parser.add_argument('--requests', type=int, default=200, help='每個並行度送出的請求數')
+    parser.add_argument('--cached', action='store_true', help='重複上傳相同的圖片（量測預測快取命中的路徑）')
+    parser.add_argument('--iterations', type=int, default=100, help='微基準的呼叫次數')
+    parser.add_argument('--skip-micro', action='store_true', help='不執行微基準')
+    parser.add_argument('--skip-load', action='store_true', help='不執行負載測試')
+    parser.add_argument('--output', help='將結果寫入 JSON 檔')
+    parser.add_argument('--baseline', help='與基準 JSON 比較')
+    parser.add_argument('--tolerance', type=float, default=0.5, help='允許的退步比例')
+    args = parser.parse_args()
+
+    corpus = load_corpus()
+    results = {
+        'environment': {
+            'python': platform.python_version(),
+            'cpu_count': os.cpu_count(),
+            'corpus_images': len(corpus),
+        },
+    }
+
+    if not args.skip_micro:
+        results['micro'] = run_micro(corpus, args.iterations)
+
+    if not args.skip_load:
+        with contextlib.ExitStack() as stack:
+            if args.url:
+                target = HttpTarget(args.url)
+            else:
+                # 匯入 app 時會在背景載入模型並啟動推論工作行程
+                import app
+                stack.enter_context(isolated_storage(app))
+                target = InProcessTarget(app)
+            target.wait_ready(READY_TIMEOUT)
+            results['environment']['target'] = target.description
+            results['environment']['endpoint'] = args.endpoint
+            results['environment']['cached'] = args.cached
+            # 預熱：每張圖片各送一次（--cached 時也同時填入預測快取）
+            run_load(target, corpus, args.endpoint, 1, len(corpus), args.cached)
+            results['load'] = {}
+            for level in (int(value) for value in args.concurrency.split(',') if value.strip()):
+                results['load'][f'c{level}'] = run_load(target, corpus, args.endpoint, level, args.requests,
+                                                        args.cached)
+
+    print(json.dumps(results, indent=2, ensure_ascii=False))
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=2, ensure_ascii=False)
+
+    if args.baseline:
+        with open(args.baseline, 'r', encoding='utf-8') as f:
+            baseline = flatten(json.load(f))
+        current = flatten(results)
+        regressions = compare(current, baseline, args.tolerance, regression_metrics(current))
+        if regressions:
+            print("效能退步：\n  " + "\n  ".join(regressions))
+            sys.exit(1)
+        print("沒有超過容許範圍的效能退步")
+
+
+if __name__ == '__main__':
+    # arduino_controller 匯入時已設定 INFO 等級，這裡覆蓋掉，避免每個請求的日誌淹沒結果
+    logging.basicConfig(level=logging.WARNING, force=True)
+    main()
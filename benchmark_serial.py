@@ -0,0 +1,178 @@
+"""
+ArduinoController 的串口效能測試（使用 arduino_simulator 的虛擬設備，不需要實體開發板）
+
+量測項目：
+  - 命令吞吐量：連續送出命令時，設備每秒實際收到的更新數與線路上的位元組數
+  - 命令延遲：set_confidence() 到設備收到該值的時間
+  - 事件延遲：設備送出按鈕事件到 style_callback 被呼叫的時間
+  - 重連時間：模擬拔線到 connection_callback(True) 的時間
+  - 控制器線程的 CPU 使用量（閒置與負載下）
+
+用法：
+    python benchmark_serial.py --output serial.json
+    python benchmark_serial.py --baseline serial.json   # 與基準比較，退步超過容許範圍時結束代碼為 1
+"""
+import argparse
+import json
+import logging
+import os
+import sys
+import threading
+import time
+from typing import Dict, List
+
+from arduino_controller import ArduinoController
+from arduino_simulator import VirtualArduino
+from bench_utils import compare, percentile
+
+# 與基準比較的指標：(名稱, 數值越大越好)
+REGRESSION_METRICS = (
+    ('command_latency_p95_ms', False),
+    ('event_latency_p95_ms', False),
+    ('reconnect_ms', False),
+    ('idle_cpu_percent', False),
+    ('updates_per_second', True),
+)
+
+
+def thread_cpu_seconds(threads) -> float:
+    """讀取 /proc 中指定線程的 CPU 時間（schedstat 第一欄，奈秒精度）"""
+    total = 0
+    for thread in threads:
+        if thread is None or thread.native_id is None:
+            continue
+        try:
+            with open(f'/proc/self/task/{thread.native_id}/schedstat') as f:
+                total += int(f.read().split()[0])
+        except OSError:
+            continue
+    return total / 1e9
+
+
+def controller_threads(controller: ArduinoController):
+    return [controller.receive_thread, controller.command_thread, controller.monitor_thread]
+
+
+def measure_cpu(controller: ArduinoController, duration: float) -> float:
+    """量測 duration 秒內控制器線程的 CPU 使用率（%）"""
+    threads = controller_threads(controller)
+    start = thread_cpu_seconds(threads)
+    time.sleep(duration)
+    return (thread_cpu_seconds(threads) - start) / duration * 100
+
+
+def run(link: str, baudrate: int, framed: bool, duration: float, rate: float) -> Dict[str, float]:
+    sent: Dict[int, float] = {}
+    latencies: List[float] = []
+    style_times: List[float] = []
+    connected = threading.Event()
+
+    def on_command(kind, value, received_at):
+        # 從最後一次要求這個值到設備收到的時間（中間被合併掉的舊值不計）
+        if kind == 'CONF' and value in sent:
+            latencies.append((received_at - sent[value]) * 1000)
+
+    device = VirtualArduino(link, baudrate=baudrate, framed=framed, on_command=on_command)
+    device.start()
+    controller = ArduinoController(link, baudrate=baudrate, framed=framed)
+    controller.reconnect_interval = 0.05
+    controller.register_callbacks(style_cb=lambda style: style_times.append(time.perf_counter()),
+                                  connection_cb=lambda ok: connected.set() if ok else connected.clear())
+    if not controller.connect():
+        device.stop()
+        raise RuntimeError("無法連接到虛擬 Arduino")
+    results: Dict[str, float] = {'protocol': controller.protocol}
+    try:
+        # 閒置 CPU
+        results['idle_cpu_percent'] = measure_cpu(controller, 1.0)
+
+        # 命令吞吐量與延遲：依 rate 送出遞增的信心度（0-100 循環）
+        cpu_start = thread_cpu_seconds(controller_threads(controller))
+        start = time.perf_counter()
+        count = 0
+        while time.perf_counter() - start < duration:
+            value = count % 101
+            sent[value] = time.perf_counter()
+            controller.set_confidence(value)
+            count += 1
+            time.sleep(1 / rate)
+        elapsed = time.perf_counter() - start
+        time.sleep(0.5)
+        results['busy_cpu_percent'] = (thread_cpu_seconds(controller_threads(controller)) - cpu_start) / (elapsed + 0.5) * 100
+        stats = controller.stats()
+        results['commands_submitted'] = count
+        results['updates_per_second'] = device.commands_received / elapsed
+        results['wire_bytes_per_second'] = stats['bytes_written'] / elapsed
+        results['command_latency_p50_ms'] = percentile(latencies, 0.5)
+        results['command_latency_p95_ms'] = percentile(latencies, 0.95)
+        results['commands_merged'] = stats['merged']
+
+        # 事件延遲
+        event_latencies = []
+        for i in range(50):
+            before = len(style_times)
+            sent_at = device.inject_style(i % 5)
+            deadline = time.perf_counter() + 1.0
+            while len(style_times) == before and time.perf_counter() < deadline:
+                time.sleep(0.0005)
+            if len(style_times) > before:
+                event_latencies.append((style_times[-1] - sent_at) * 1000)
+            time.sleep(0.01)
+        results['event_latency_p50_ms'] = percentile(event_latencies, 0.5)
+        results['event_latency_p95_ms'] = percentile(event_latencies, 0.95)
+
+        # 重連時間
+        connected.clear()
+        drop_at = time.perf_counter()
+        device.drop_connection()
+        if connected.wait(10.0):
+            results['reconnect_ms'] = (time.perf_counter() - drop_at) * 1000
+        else:
+            results['reconnect_ms'] = float('inf')
+        if framed:
+            rtt = controller.stats()['rtt'].get('CONF')
+            results['rtt_p95_ms'] = rtt['p95_ms'] if rtt else 0.0
+    finally:
+        controller.disconnect()
+        device.stop()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description='ArduinoController 串口效能測試')
+    parser.add_argument('--link', default=f'/tmp/virtual-arduino-bench-{os.getpid()}', help='虛擬串口路徑')
+    parser.add_argument('--baudrate', type=int, default=9600, help='模擬的鮑率')
+    parser.add_argument('--protocol', choices=('text', 'binary', 'both'), default='both', help='測試的協定')
+    parser.add_argument('--duration', type=float, default=3.0, help='吞吐量測試的秒數')
+    parser.add_argument('--rate', type=float, default=500.0, help='每秒呼叫 set_confidence 的次數')
+    parser.add_argument('--output', help='將結果寫入 JSON 檔')
+    parser.add_argument('--baseline', help='與基準 JSON 比較')
+    parser.add_argument('--tolerance', type=float, default=0.5, help='允許的退步比例')
+    args = parser.parse_args()
+
+    protocols = ('text', 'binary') if args.protocol == 'both' else (args.protocol,)
+    results = {}
+    for protocol in protocols:
+        results[protocol] = run(args.link, args.baudrate, protocol == 'binary', args.duration, args.rate)
+    print(json.dumps(results, indent=2, ensure_ascii=False))
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=2, ensure_ascii=False)
+
+    if args.baseline:
+        with open(args.baseline, 'r', encoding='utf-8') as f:
+            baseline = json.load(f)
+        regressions = []
+        for protocol, values in results.items():
+            if protocol in baseline:
+                regressions += [f"[{protocol}] {line}" for line in compare(values, baseline[protocol], args.tolerance, REGRESSION_METRICS)]
+        if regressions:
+            print("效能退步：\n  " + "\n  ".join(regressions))
+            sys.exit(1)
+        print("沒有超過容許範圍的效能退步")
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.WARNING)
+    main()
@@ -0,0 +1,220 @@
+"""
+離線批次辨識整個圖片目錄（例如 model/ 或匯出的商品照片），結果以 JSONL 串流寫出
+
+以線程池預先讀檔、計算摘要並解碼，主線程每湊滿一個批次就送入模型；同時處理中的圖片數有上限，
+目錄以 os.walk 逐層走訪，結果逐行寫入，所以記憶體用量與目錄大小無關。
+走訪順序固定（每層依名稱排序），每寫完一個批次就更新檢查點（已處理張數、最後一個路徑、輸出檔位置），
+中斷後以 --resume 從檢查點接續，並截掉輸出檔中檢查點之後寫了一半的內容。
+
+用法：
+    python classify_catalog.py model/ --output catalog.jsonl
+    python classify_catalog.py /data/export --output catalog.jsonl --resume
+
+每行格式：
+    {"path": "...", "label": "...", "confidence": 0.93, "digest": "<sha256>"}
+    {"path": "...", "error": "..."}          # 無法讀取或解碼的檔案
+"""
+import argparse
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+from typing import Callable, Iterable, Iterator, Optional, Sequence, Tuple
+
+logger = logging.getLogger(__name__)
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.gif')
+CHECKPOINT_SUFFIX = '.checkpoint'
+PROGRESS_INTERVAL = 10.0  # 顯示進度的間隔（秒）
+
+
+def iter_images(roots: Sequence[str], extensions: Tuple[str, ...] = IMAGE_EXTENSIONS) -> Iterator[str]:
+    """依固定順序逐一產出目錄中的圖片路徑（每層依名稱排序），不會一次列出整個目錄樹"""
+    for root in roots:
+        if os.path.isfile(root):
+            yield root
+            continue
+        for dirpath, dirnames, filenames in os.walk(root):
+            dirnames.sort()
+            for name in sorted(filenames):
+                if name.lower().endswith(extensions):
+                    yield os.path.join(dirpath, name)
+
+
+def prefetch(items: Iterable, function: Callable, workers: int, window: int) -> Iterator[tuple]:
+    """
+    以線程池預先處理，依輸入順序產出 (項目, Future)
+
+    Args:
+        window: 同時提交（處理中或已完成但尚未取用）的項目數上限
+    """
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='prefetch') as pool:
+        pending = deque()
+        for item in items:
+            pending.append((item, pool.submit(function, item)))
+            if len(pending) >= window:
+                yield pending.popleft()
+        while pending:
+            yield pending.popleft()
+
+
+def load_checkpoint(path: str) -> Optional[dict]:
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+def save_checkpoint(path: str, state: dict) -> None:
+    """寫入暫存檔後再取代，中斷時不會留下寫了一半的檢查點"""
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            json.dump(state, f, ensure_ascii=False)
+        os.replace(tmp_path, path)
+    except Exception:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def skip_processed(paths: Iterator[str], count: int, last_path: Optional[str]) -> Iterator[str]:
+    """略過檢查點之前已處理的 count 個路徑；最後一個路徑對不上時表示目錄內容已變動"""
+    skipped = None
+    for skipped in islice(paths, count):
+        pass
+    if count and skipped != last_path:
+        logger.warning(f"目錄內容在上次執行後有變動（預期 {last_path}，實際 {skipped}），接續位置可能不準確")
+    return paths
+
+
+class CatalogClassifier:
+    def __init__(self, model, batch_size: int, workers: int, window: int):
+        """
+        Args:
+            model: FashionModel
+            batch_size: 每次送入模型的張數
+            workers: 讀檔與解碼的線程數
+            window: 預先處理的圖片數上限（決定記憶體用量）
+        """
+        self.model = model
+        self.batch_size = batch_size
+        self.workers = workers
+        self.window = window
+
+    def load(self, path: str) -> Tuple[str, object]:
+        """在預讀線程中執行：讀檔、計算摘要並解碼成模型輸入尺寸的 uint8 陣列"""
+        with open(path, 'rb') as f:
+            data = f.read()
+        return hashlib.sha256(data).hexdigest(), self.model.preprocessor.decode(data)
+
+    def run(self, roots: Sequence[str], output: str, resume: bool = False) -> dict:
+        """
+        辨識 roots 底下的所有圖片，結果寫入 output（JSONL）
+
+        Returns:
+            dict: 本次處理的張數、失敗數、耗時與每秒張數
+        """
+        checkpoint_path = output + CHECKPOINT_SUFFIX
+        roots = list(roots)
+        state = load_checkpoint(checkpoint_path) if resume else None
+        if state is not None and state.get('roots') != roots:
+            raise ValueError(f"檢查點的目錄 {state.get('roots')} 與這次指定的 {roots} 不同")
+        if state is not None and os.path.exists(output):
+            # 截掉檢查點之後可能寫了一半的內容
+            with open(output, 'r+b') as f:
+                f.truncate(state['offset'])
+            mode = 'ab'
+        else:
+            state = {'roots': roots, 'processed': 0, 'last_path': None, 'offset': 0}
+            mode = 'wb'
+
+        paths = skip_processed(iter_images(roots), state['processed'], state['last_path'])
+        if state['processed']:
+            logger.info(f"從檢查點接續：已處理 {state['processed']} 張")
+
+        processed = errors = 0
+        start = last_report = time.perf_counter()
+        records = []  # (路徑, 摘要, 像素) 或 (路徑, None, 錯誤訊息)
+
+        with open(output, mode) as out:
+            def flush():
+                nonlocal processed, errors
+                decoded = [pixels for _, digest, pixels in records if digest is not None]
+                predictions = iter(self.model.predict_batch(decoded, self.batch_size)) if decoded else iter(())
+                lines = []
+                for path, digest, value in records:
+                    if digest is None:
+                        errors += 1
+                        item = {'path': path, 'error': value}
+                    else:
+                        label, confidence = next(predictions)
+                        item = {'path': path, 'label': label, 'confidence': confidence, 'digest': digest}
+                    lines.append(json.dumps(item, ensure_ascii=False) + '\n')
+                out.write(''.join(lines).encode('utf-8'))
+                out.flush()
+                processed += len(records)
+                state['processed'] += len(records)
+                state['last_path'] = records[-1][0]
+                state['offset'] = out.tell()
+                save_checkpoint(checkpoint_path, state)
+                records.clear()
+
+            for path, future in prefetch(paths, self.load, self.workers, self.window):
+                try:
+                    digest, pixels = future.result()
+                    records.append((path, digest, pixels))
+                except Exception as e:
+                    records.append((path, None, str(e)))
+                if len(records) >= self.batch_size:
+                    flush()
+                    now = time.perf_counter()
+                    if now - last_report >= PROGRESS_INTERVAL:
+                        logger.info(f"已處理 {state['processed']} 張（{processed / (now - start):.1f} 張/秒）")
+                        last_report = now
+            if records:
+                flush()
+
+        elapsed = time.perf_counter() - start
+        return {
+            'processed': processed,
+            'errors': errors,
+            'total': state['processed'],
+            'seconds': elapsed,
+            'images_per_second': processed / elapsed if elapsed > 0 else 0.0,
+        }
+
+
+def main():
+    from model_utils import BATCH_SIZE, FashionModel
+
+    parser = argparse.ArgumentParser(description='離線批次辨識圖片目錄，結果以 JSONL 輸出')
+    parser.add_argument('roots', nargs='*', default=['model'], help='圖片目錄或檔案')
+    parser.add_argument('--output', default='catalog.jsonl', help='輸出的 JSONL 路徑（檢查點為同名加上 .checkpoint）')
+    parser.add_argument('--resume', action='store_true', help='從檢查點接續上次中斷的執行')
+    parser.add_argument('--batch-size', type=int, default=BATCH_SIZE, help='每次送入模型的張數')
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1, help='讀檔與解碼的線程數')
+    parser.add_argument('--prefetch', type=int, default=None, help='預先解碼的圖片數上限（預設為批次大小的 4 倍）')
+    args = parser.parse_args()
+
+    model = FashionModel()
+    classifier = CatalogClassifier(model, args.batch_size, args.workers, args.prefetch or 4 * args.batch_size)
+    try:
+        summary = classifier.run(args.roots, args.output, resume=args.resume)
+    except ValueError as e:
+        parser.error(str(e))
+    print(f"完成：本次處理 {summary['processed']} 張（失敗 {summary['errors']} 張），"
+          f"累計 {summary['total']} 張，耗時 {summary['seconds']:.1f} 秒，"
+          f"{summary['images_per_second']:.1f} 張/秒 → {args.output}")
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    main()
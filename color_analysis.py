@@ -0,0 +1,153 @@
+"""
+上傳圖片的主要顏色分析，用來挑選 COLOR_COMBINATIONS 中最接近的配色方案
+
+直接使用 Preprocessor.decode() 已解碼的像素陣列，不再解碼一次。先以固定間隔取樣到最多
+SAMPLE_SIDE × SAMPLE_SIDE 個像素，再以每通道 QUANT_LEVELS 階的直方圖量化（一次 np.bincount），
+所以耗時固定，與上傳圖片的大小無關。各配色方案的代表色在建立 ColorAnalyzer 時就轉成 CIELAB，
+每個量化區間依感知色差對各方案計分。
+"""
+import math
+from typing import Dict, List, Sequence, Tuple
+
+import numpy as np
+
+SAMPLE_SIDE = 64  # 取樣後每邊最多的像素數
+QUANT_LEVELS = 4  # 每個色彩通道的量化階數（共 4^3 = 64 個區間）
+TOP_COLORS = 3  # 回傳的主要顏色數
+MIN_WEIGHT = 0.05  # 佔比低於此值的顏色不列為主要顏色
+MATCH_SCALE = 25.0  # CIELAB 色差的尺度，色差為此值時相似度約為 0.37
+
+# 配色方案與風格中用到的顏色名稱對應的 sRGB
+COLOR_RGB = {
+    '黑色': (30, 30, 30),
+    '白色': (245, 245, 245),
+    '灰色': (128, 128, 128),
+    '淺灰': (200, 200, 200),
+    '米色': (230, 215, 185),
+    '米白': (240, 234, 220),
+    '奶油色': (255, 245, 210),
+    '杏色': (240, 200, 160),
+    '卡其色': (195, 176, 145),
+    '淺卡其': (215, 200, 170),
+    '棕色': (120, 80, 50),
+    '咖啡色': (111, 78, 55),
+    '淺咖啡': (166, 123, 91),
+    '淺藍': (170, 205, 235),
+    '粉色': (245, 180, 195),
+    '淺紫': (200, 180, 225),
+    '薄荷綠': (170, 230, 200),
+    '藍色': (30, 90, 200),
+    '紅色': (210, 40, 40),
+    '黃色': (245, 205, 40),
+    '墨綠': (30, 70, 50),
+    '酒紅': (120, 20, 40),
+    '深藍': (20, 35, 90),
+}
+
+
+def rgb_to_lab(rgb: np.ndarray) -> np.ndarray:
+    """
+    向量化的 sRGB → CIELAB（D65）
+
+    Args:
+        rgb: (..., 3) 的 0-255 陣列
+
+    Returns:
+        np.ndarray: (..., 3) 的 float32 Lab 值
+    """
+    srgb = np.asarray(rgb, dtype=np.float32) / 255
+    linear = np.where(srgb > 0.04045, ((srgb + 0.055) / 1.055) ** 2.4, srgb / 12.92)
+    xyz = linear @ np.array([[0.4124, 0.2126, 0.0193],
+                             [0.3576, 0.7152, 0.1192],
+                             [0.1805, 0.0722, 0.9505]], dtype=np.float32)
+    xyz /= np.array([0.95047, 1.0, 1.08883], dtype=np.float32)
+    f = np.where(xyz > 0.008856, np.cbrt(xyz), 7.787 * xyz + 16 / 116)
+    lab = np.stack([116 * f[..., 1] - 16, 500 * (f[..., 0] - f[..., 1]), 200 * (f[..., 1] - f[..., 2])], axis=-1)
+    return lab.astype(np.float32)
+
+
+def sample_pixels(pixels: np.ndarray, side: int = SAMPLE_SIDE) -> np.ndarray:
+    """以固定間隔取樣，回傳最多 side × side 個像素的 (N, 3) uint8 陣列"""
+    step = max(1, math.ceil(max(pixels.shape[0], pixels.shape[1]) / side))
+    return pixels[::step, ::step, :3].reshape(-1, 3)
+
+
+def quantize(pixels: np.ndarray, levels: int = QUANT_LEVELS) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    直方圖量化
+
+    Args:
+        pixels: (N, 3) 的 uint8 陣列
+
+    Returns:
+        tuple: (每個區間的佔比 (levels^3,), 每個區間的平均顏色 (levels^3, 3))
+    """
+    bins = levels ** 3
+    channel = pixels.astype(np.intp) * levels // 256
+    index = (channel[:, 0] * levels + channel[:, 1]) * levels + channel[:, 2]
+    counts = np.bincount(index, minlength=bins).astype(np.float32)
+    sums = np.stack([np.bincount(index, weights=pixels[:, c], minlength=bins) for c in range(3)], axis=1)
+    means = sums / np.maximum(counts, 1)[:, None]
+    return counts / max(len(pixels), 1), means.astype(np.float32)
+
+
+class ColorAnalyzer:
+    def __init__(self, combinations: Dict[str, dict], named_colors: Dict[str, Sequence[int]] = COLOR_RGB):
+        """
+        Args:
+            combinations: COLOR_COMBINATIONS，每個方案以 main_colors 作為代表色
+            named_colors: 顏色名稱 → sRGB
+        """
+        self.schemes = list(combinations)
+        self.color_names = list(named_colors)
+        self.color_lab = rgb_to_lab(np.array([named_colors[name] for name in self.color_names]))
+        # 各方案代表色的 Lab 值與所屬方案，預先算好
+        centroids, owners = [], []
+        for i, scheme in enumerate(self.schemes):
+            for name in combinations[scheme]['main_colors']:
+                centroids.append(named_colors[name])
+                owners.append(i)
+        self.centroid_lab = rgb_to_lab(np.array(centroids))
+        owners = np.array(owners)
+        self._scheme_columns = [np.flatnonzero(owners == i) for i in range(len(self.schemes))]
+
+    def analyze(self, pixels: np.ndarray) -> dict:
+        """
+        分析主要顏色並挑選最接近的配色方案
+
+        Args:
+            pixels: (H, W, 3) 的 uint8 陣列，通常是 Preprocessor.decode() 的結果
+
+        Returns:
+            dict: scheme（最接近的配色方案）、scores（各方案分數，總和為 1）、
+                  colors（主要顏色，每項包含 hex、最接近的顏色名稱 name 與佔比 weight）
+        """
+        weights, means = quantize(sample_pixels(pixels))
+        used = np.flatnonzero(weights)
+        weights, means = weights[used], means[used]
+        lab = rgb_to_lab(means)
+
+        # 每個區間對每個方案的相似度取該方案最接近的代表色
+        distance = np.linalg.norm(lab[:, None, :] - self.centroid_lab[None, :, :], axis=-1)
+        similarity = np.exp(-(distance / MATCH_SCALE) ** 2)
+        per_scheme = np.stack([similarity[:, columns].max(axis=1) for columns in self._scheme_columns], axis=1)
+        scores = weights @ per_scheme
+        total = scores.sum()
+        scores = scores / total if total > 0 else np.full(len(self.schemes), 1 / len(self.schemes))
+
+        colors: List[dict] = []
+        nearest = np.linalg.norm(lab[:, None, :] - self.color_lab[None, :, :], axis=-1).argmin(axis=1)
+        for i in np.argsort(-weights)[:TOP_COLORS]:
+            if weights[i] < MIN_WEIGHT:
+                break
+            r, g, b = (int(round(v)) for v in means[i])
+            colors.append({
+                'hex': f'#{r:02x}{g:02x}{b:02x}',
+                'name': self.color_names[nearest[i]],
+                'weight': float(weights[i]),
+            })
+        return {
+            'scheme': self.schemes[int(scores.argmax())],
+            'scores': {scheme: float(score) for scheme, score in zip(self.schemes, scores)},
+            'colors': colors,
+        }
@@ -0,0 +1,50 @@
+"""
+將 Keras .h5 模型轉成攤平、對齊的權重檔
+
+轉換後的檔案已完成 BatchNorm 併入等編譯步驟，FashionModel 會以唯讀 mmap 載入，
+啟動時不需要解析 HDF5，多個工作行程也共用同一份權重記憶體。
+這是部署時的建置步驟：應用程式只讀取這個檔案，標頭記錄的來源摘要與 .h5 內容不符時會改用 .h5。
+
+用法：
+    python convert_model.py [model/model.h5] [model/model.npkm]
+    python convert_model.py --if-stale   # 只在 .h5 內容有變動時重新轉換
+"""
+import argparse
+import time
+
+from model_utils import MODEL_PATH, FLAT_MODEL_PATH, model_digest
+from inference_engine import NumpyKerasModel
+
+
+def is_stale(model_path, output_path):
+    """攤平權重檔不存在、無法讀取，或記錄的來源摘要與 .h5 內容不符時需要重新轉換"""
+    try:
+        engine = NumpyKerasModel.from_flat(output_path)
+    except Exception:
+        return True
+    return engine.metadata.get('source_digest') != model_digest(model_path)
+
+
+def convert(model_path, output_path):
+    start = time.perf_counter()
+    engine = NumpyKerasModel.from_h5(model_path)
+    engine.save_flat(output_path, {'source_digest': model_digest(model_path)})
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description='將 Keras .h5 模型轉成可 mmap 的攤平權重檔')
+    parser.add_argument('model', nargs='?', default=str(MODEL_PATH), help='輸入的 .h5 模型')
+    parser.add_argument('output', nargs='?', default=str(FLAT_MODEL_PATH), help='輸出的攤平權重檔')
+    parser.add_argument('--if-stale', action='store_true', help='攤平權重檔仍與 .h5 相符時不重新轉換')
+    args = parser.parse_args()
+
+    if args.if_stale and not is_stale(args.model, args.output):
+        print(f"攤平權重檔已是最新：{args.output}")
+        return
+    elapsed = convert(args.model, args.output)
+    print(f"已轉換 {args.model} → {args.output}（{elapsed:.2f} 秒）")
+
+
+if __name__ == '__main__':
+    main()
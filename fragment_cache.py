@@ -0,0 +1,61 @@
+"""
+已渲染 HTML 片段的快取
+
+結果頁中只取決於少數離散輸入的區塊（例如搭配建議：標籤 × 信心度分級 × 風格 × 色系，共幾百種組合）
+只需要渲染一次，之後的請求直接取用字串。片段若還取決於執行期間會改變的狀態（例如參考圖片的衍生檔
+是否已產生完成），由 version 回傳的值區分，值改變時舊片段自動失效。
+"""
+import threading
+from typing import Callable, Dict, Hashable, Tuple
+
+from markupsafe import Markup
+
+
+class FragmentCache:
+    def __init__(self, version: Callable[[], Hashable] = lambda: None, max_entries: int = 1024):
+        """
+        Args:
+            version: 回傳片段所依賴狀態的版本，值改變時重新渲染
+            max_entries: 最多保留的片段數；鍵的組合有限，超過時表示鍵設計有誤，直接清空重來
+        """
+        self.version = version
+        self.max_entries = max_entries
+        self._entries: Dict[Hashable, Tuple[Hashable, Markup]] = {}
+        self._lock = threading.Lock()
+
+        # 統計資料
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: Hashable, render: Callable[[], str]) -> Markup:
+        """
+        取得片段，沒有快取或版本過期時呼叫 render() 渲染並保存
+
+        Args:
+            key: 決定片段內容的所有輸入
+            render: 渲染片段的函式（需在 Flask 請求情境中呼叫時，由呼叫端負責）
+
+        Returns:
+            Markup: 可直接插入模板、不會再被跳脫的 HTML
+        """
+        version = self.version()
+        entry = self._entries.get(key)
+        if entry is not None and entry[0] == version:
+            self.hits += 1
+            return entry[1]
+
+        # 同一個鍵可能被多個線程同時渲染，結果相同，不必互相等待
+        html = Markup(render())
+        with self._lock:
+            self.misses += 1
+            if key not in self._entries and len(self._entries) >= self.max_entries:
+                self._entries.clear()
+            self._entries[key] = (version, html)
+        return html
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self) -> int:
+        return len(self._entries)
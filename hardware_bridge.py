@@ -0,0 +1,413 @@
+"""
+網頁應用與 Arduino 之間的非阻塞橋接
+
+請求處理線程只把 BUSY/READY 與信心度訊號放進有界的通道（滿了就丟棄最舊的訊號）就立即返回，
+由背景線程交給 ArduinoController；設備斷線、重連或串口很慢都不會拖慢 HTTP 回應。
+設備送來的按鈕事件則廣播給所有訂閱者（例如 /events 的 server-sent events 串流）。
+
+串口同時只能由一個行程開啟。多個網頁行程時以本機 TCP 中繼埠選出擁有者：第一個綁定成功的行程
+開啟串口，其他行程連到中繼埠，把訊號交給擁有者，並收到擁有者轉送的設備事件與連線狀態；
+擁有者結束時埠被釋放，其餘行程重新選出新的擁有者。
+"""
+import itertools
+import json
+import logging
+import socket
+import threading
+import time
+from collections import deque
+from typing import Callable, List, Optional, Sequence, Tuple
+
+logger = logging.getLogger(__name__)
+
+RELAY_RETRY_INTERVAL = 1.0  # 中繼連線中斷後重新選出擁有者的間隔（秒）
+RELAY_MAX_LINE = 4096  # 中繼訊息一行的長度上限
+
+
+class DropOldestChannel:
+    def __init__(self, capacity: int):
+        """有界佇列：put 永不阻塞，滿了時丟棄最舊的項目"""
+        self.capacity = capacity
+        self._items: deque = deque()
+        self._cond = threading.Condition()
+        self.closed = False
+
+        # 統計資料
+        self.put_count = 0
+        self.dropped = 0
+
+    def put(self, item) -> None:
+        with self._cond:
+            if len(self._items) >= self.capacity:
+                self._items.popleft()
+                self.dropped += 1
+            self._items.append(item)
+            self.put_count += 1
+            self._cond.notify()
+
+    def get(self, timeout: Optional[float] = None):
+        """取出最舊的項目；逾時或通道關閉時回傳 None"""
+        with self._cond:
+            if not self._items and not self.closed:
+                self._cond.wait(timeout)
+            if not self._items:
+                return None
+            return self._items.popleft()
+
+    def close(self) -> None:
+        with self._cond:
+            self.closed = True
+            self._cond.notify_all()
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+
+class EventBroadcaster:
+    def __init__(self, capacity: int = 32):
+        """
+        把設備事件廣播給所有訂閱者；每個訂閱者各有一個有界通道，慢的訂閱者只會遺失自己的舊事件
+
+        Args:
+            capacity: 每個訂閱者最多保留的未讀事件數
+        """
+        self.capacity = capacity
+        self._subscribers: List[DropOldestChannel] = []
+        self._lock = threading.Lock()
+        self._ids = itertools.count(1)
+
+    def subscribe(self) -> DropOldestChannel:
+        channel = DropOldestChannel(self.capacity)
+        with self._lock:
+            self._subscribers.append(channel)
+        return channel
+
+    def unsubscribe(self, channel: DropOldestChannel) -> None:
+        channel.close()
+        with self._lock:
+            if channel in self._subscribers:
+                self._subscribers.remove(channel)
+
+    def publish(self, event_type: str, data: dict) -> None:
+        event = (next(self._ids), event_type, data)
+        with self._lock:
+            subscribers = list(self._subscribers)
+        for channel in subscribers:
+            channel.put(event)
+
+    @property
+    def subscriber_count(self) -> int:
+        return len(self._subscribers)
+
+
+def format_sse(event: Tuple[int, str, dict]) -> str:
+    """將事件轉成 text/event-stream 格式"""
+    event_id, event_type, data = event
+    return f"id: {event_id}\nevent: {event_type}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+def _send_line(sock: socket.socket, message: dict) -> None:
+    sock.sendall(json.dumps(message, ensure_ascii=False).encode('utf-8') + b'\n')
+
+
+def _read_lines(sock: socket.socket):
+    """逐行讀出中繼訊息，連線中斷時結束；過長或無法解析的行直接略過"""
+    reader = sock.makefile('rb')
+    try:
+        while True:
+            line = reader.readline(RELAY_MAX_LINE)
+            if not line:
+                return
+            try:
+                yield json.loads(line)
+            except ValueError:
+                logger.warning(f"無法解析的中繼訊息：{line[:64]!r}")
+    except OSError:
+        return
+    finally:
+        reader.close()
+
+
+class HardwareBridge:
+    def __init__(self, controller_factory: Callable[[], object], capacity: int = 64,
+                 retry_interval: float = 30.0, style_names: Sequence[str] = (),
+                 relay_address: Optional[Tuple[str, int]] = None):
+        """
+        Args:
+            controller_factory: 建立 ArduinoController 的函數；在背景線程中呼叫並連線
+            capacity: 訊號通道的容量，滿了時丟棄最舊的訊號
+            retry_interval: 首次連線失敗後重試的間隔（秒）；連上之後由控制器自行重連
+            style_names: 風格按鈕編號對應的風格名稱
+            relay_address: 多個行程共用設備時的本機中繼位址 (主機, 埠)；None 表示本行程直接開啟串口
+        """
+        self.controller_factory = controller_factory
+        self.retry_interval = retry_interval
+        self.style_names = list(style_names)
+        self.relay_address = relay_address
+        self.role: Optional[str] = None  # 'owner'（開啟串口）或 'relay'（經由擁有者轉送）
+        self.controller = None
+        self.signals = DropOldestChannel(capacity)
+        self.events = EventBroadcaster()
+        self.running = False
+        self.worker_thread: Optional[threading.Thread] = None
+        self._stop_event = threading.Event()
+        self._sockets: List[socket.socket] = []  # 停止時要關閉的中繼連線
+        self._sockets_lock = threading.Lock()
+        self._device_connected = False  # relay 時由擁有者通知的設備連線狀態
+
+        # 統計資料
+        self.signals_sent = 0
+        self.signals_skipped = 0  # 設備未連線時略過的訊號
+        self.relay_clients = 0  # owner 時目前連入的其他行程數
+
+    # ---- 請求處理線程呼叫的介面：只放進通道，不做任何 I/O ----
+
+    def signal_busy(self) -> None:
+        self.signals.put(('status', True))
+
+    def signal_ready(self) -> None:
+        self.signals.put(('status', False))
+
+    def signal_result(self, confidence: float) -> None:
+        """
+        預測完成：更新信心度 LED 並切回就緒
+
+        Args:
+            confidence: 0-1 之間的信心度
+        """
+        self.signals.put(('confidence', confidence * 100))
+        self.signals.put(('status', False))
+
+    # ---- 背景線程 ----
+
+    def start(self) -> None:
+        if self.running:
+            return
+        self.running = True
+        self._stop_event.clear()
+        target = self._run if self.relay_address is None else self._run_elected
+        self.worker_thread = threading.Thread(target=target, name='hardware-bridge')
+        self.worker_thread.daemon = True
+        self.worker_thread.start()
+
+    def stop(self) -> None:
+        self.running = False
+        self._stop_event.set()
+        self.signals.close()
+        with self._sockets_lock:
+            sockets, self._sockets = self._sockets, []
+        for sock in sockets:
+            try:
+                sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+            sock.close()
+        if self.worker_thread:
+            self.worker_thread.join(timeout=2.0)
+        if self.controller is not None and self.controller.running:
+            self.controller.disconnect()
+
+    def _connect(self) -> bool:
+        if self.controller is None:
+            self.controller = self.controller_factory()
+            self.controller.register_callbacks(style_cb=self._on_style,
+                                               confirm_cb=self._on_confirm,
+                                               connection_cb=self._on_connection)
+        return self.controller.connect()
+
+    def _track(self, sock: socket.socket) -> bool:
+        with self._sockets_lock:
+            if not self.running:
+                sock.close()
+                return False
+            self._sockets.append(sock)
+            return True
+
+    def _untrack(self, sock: socket.socket) -> None:
+        with self._sockets_lock:
+            if sock in self._sockets:
+                self._sockets.remove(sock)
+        sock.close()
+
+    def _bind_relay(self) -> Optional[socket.socket]:
+        """嘗試綁定中繼埠；成功表示本行程成為擁有者，埠已被佔用時回傳 None"""
+        server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        # Windows 的 SO_REUSEADDR 允許搶用已在監聽的埠，改用獨佔綁定
+        if hasattr(socket, 'SO_EXCLUSIVEADDRUSE'):
+            server.setsockopt(socket.SOL_SOCKET, socket.SO_EXCLUSIVEADDRUSE, 1)
+        else:
+            server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        try:
+            server.bind(self.relay_address)
+            server.listen()
+        except OSError:
+            server.close()
+            return None
+        return server
+
+    def _run_elected(self) -> None:
+        """選出擁有者：綁定中繼埠成功就開啟串口，否則連到擁有者轉送，連線中斷後重新選舉"""
+        while self.running:
+            server = self._bind_relay()
+            if server is not None:
+                if not self._track(server):
+                    return
+                self.role = 'owner'
+                logger.info(f"本行程負責 Arduino 串口，其他行程經由 {self.relay_address[0]}:{self.relay_address[1]} 轉送")
+                threading.Thread(target=self._serve_relay, args=(server,), name='hardware-relay',
+                                 daemon=True).start()
+                self._run()
+                return
+            try:
+                sock = socket.create_connection(self.relay_address, timeout=RELAY_RETRY_INTERVAL)
+                sock.settimeout(None)
+            except OSError:
+                # 擁有者剛結束（埠尚未釋放）或還在啟動
+                if self._stop_event.wait(RELAY_RETRY_INTERVAL):
+                    return
+                continue
+            if not self._track(sock):
+                return
+            self.role = 'relay'
+            logger.info("Arduino 串口由其他行程負責，訊號經由中繼轉送")
+            self._relay_signals(sock)
+            self._untrack(sock)
+            self.role = None
+            self._set_device_connected(False)
+            if self._stop_event.wait(RELAY_RETRY_INTERVAL):
+                return
+
+    def _relay_signals(self, sock: socket.socket) -> None:
+        """relay：把本行程的訊號送給擁有者，同時在另一個線程接收擁有者轉送的設備事件"""
+        closed = threading.Event()
+
+        def receive():
+            for message in _read_lines(sock):
+                if message.get('event') == 'connection':
+                    self._set_device_connected(bool(message['data'].get('connected')))
+                elif 'event' in message:
+                    self.events.publish(message['event'], message.get('data', {}))
+            closed.set()
+            self.signals.put(None)  # 喚醒等待訊號的迴圈
+
+        reader = threading.Thread(target=receive, name='hardware-relay-receive', daemon=True)
+        reader.start()
+        while self.running and not closed.is_set():
+            signal = self.signals.get()
+            if signal is None:
+                continue
+            try:
+                _send_line(sock, {'signal': list(signal)})
+                self.signals_sent += 1
+            except OSError:
+                break
+        try:
+            sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        reader.join(timeout=1.0)
+
+    def _serve_relay(self, server: socket.socket) -> None:
+        """owner：接受其他行程的連線"""
+        while self.running:
+            try:
+                conn, _ = server.accept()
+            except OSError:
+                return
+            if not self._track(conn):
+                return
+            threading.Thread(target=self._serve_client, args=(conn,), name='hardware-relay-client',
+                             daemon=True).start()
+
+    def _serve_client(self, conn: socket.socket) -> None:
+        """owner：轉送設備事件給一個 relay 行程，並把它送來的訊號放進本行程的訊號通道"""
+        channel = self.events.subscribe()
+        self.relay_clients += 1
+
+        def forward():
+            try:
+                _send_line(conn, {'event': 'connection', 'data': {'connected': self.connected}})
+                while True:
+                    event = channel.get()
+                    if event is None:
+                        if channel.closed:
+                            return
+                        continue
+                    _, event_type, data = event
+                    _send_line(conn, {'event': event_type, 'data': data})
+            except OSError:
+                return
+
+        writer = threading.Thread(target=forward, name='hardware-relay-forward', daemon=True)
+        writer.start()
+        try:
+            for message in _read_lines(conn):
+                signal = message.get('signal')
+                if isinstance(signal, list) and len(signal) == 2 and signal[0] in ('status', 'confidence'):
+                    self.signals.put(tuple(signal))
+        finally:
+            self.events.unsubscribe(channel)
+            self.relay_clients -= 1
+            self._untrack(conn)
+            writer.join(timeout=1.0)
+
+    def _set_device_connected(self, connected: bool) -> None:
+        if connected != self._device_connected:
+            self._device_connected = connected
+            self.events.publish('connection', {'connected': connected, 'time': time.time()})
+
+    def _run(self) -> None:
+        # 連線（含重試）可能要數秒，只會延遲這個線程
+        while self.running and not self._connect():
+            if self._stop_event.wait(self.retry_interval):
+                return
+        while self.running:
+            signal = self.signals.get()
+            if signal is None:
+                continue
+            if not self.controller.is_connected:
+                self.signals_skipped += 1
+                continue
+            kind, value = signal
+            try:
+                if kind == 'status':
+                    self.controller.set_status(value)
+                else:
+                    self.controller.set_confidence(value)
+                self.signals_sent += 1
+            except Exception as e:
+                logger.error(f"傳送訊號到 Arduino 時發生錯誤：{str(e)}")
+
+    # ---- 設備事件（在控制器的接收線程中呼叫） ----
+
+    def _on_style(self, style: int) -> None:
+        name = self.style_names[style] if 0 <= style < len(self.style_names) else None
+        self.events.publish('style', {'style': style, 'name': name, 'time': time.time()})
+
+    def _on_confirm(self) -> None:
+        self.events.publish('confirm', {'time': time.time()})
+
+    def _on_connection(self, connected: bool) -> None:
+        self.events.publish('connection', {'connected': connected, 'time': time.time()})
+
+    @property
+    def connected(self) -> bool:
+        if self.role == 'relay':
+            return self._device_connected
+        return self.controller is not None and self.controller.is_connected
+
+    def stats(self) -> dict:
+        result = {
+            'role': self.role,
+            'connected': self.connected,
+            'relay_clients': self.relay_clients,
+            'queue_depth': len(self.signals),
+            'signals_queued': self.signals.put_count,
+            'signals_dropped': self.signals.dropped,
+            'signals_sent': self.signals_sent,
+            'signals_skipped': self.signals_skipped,
+            'event_subscribers': self.events.subscriber_count,
+        }
+        if self.controller is not None:
+            result['controller'] = self.controller.stats()
+        return result
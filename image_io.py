@@ -0,0 +1,145 @@
+import hashlib
+import io
+import logging
+import os
+import tempfile
+from typing import Tuple
+
+from PIL import Image
+
+logger = logging.getLogger(__name__)
+
+CHUNK_SIZE = 64 * 1024
+MAX_UPLOAD_BYTES = 20 * 1024 * 1024  # 單一上傳檔案的大小上限
+MAX_IMAGE_SIDE = 12000  # 單邊像素上限
+MAX_IMAGE_PIXELS = 16_000_000  # PNG / GIF 需要完整解碼，像素上限較低
+MAX_JPEG_PIXELS = 64_000_000  # JPEG 以縮小比例解碼，可以接受較大的照片
+
+# 檔頭簽章 → Pillow 格式名稱
+SIGNATURES = {
+    b'\xff\xd8\xff': 'JPEG',
+    b'\x89PNG\r\n\x1a\n': 'PNG',
+    b'GIF87a': 'GIF',
+    b'GIF89a': 'GIF',
+}
+EXTENSIONS = {'JPEG': 'jpg', 'PNG': 'png', 'GIF': 'gif'}
+
+
+class ImageValidationError(ValueError):
+    """上傳內容不是可接受的圖片"""
+
+
+def _sniff_signature(head: bytes) -> str:
+    for signature, fmt in SIGNATURES.items():
+        if head.startswith(signature):
+            return fmt
+    raise ImageValidationError('檔案內容不是 PNG、JPG 或 GIF 圖片')
+
+
+def read_upload(stream, max_bytes: int = MAX_UPLOAD_BYTES) -> Tuple[bytes, str]:
+    """
+    從上傳串流讀入記憶體，同時計算 SHA-256 摘要
+
+    第一個區塊到達時就檢查檔頭簽章，超過大小上限時立即停止讀取，
+    不必等整個檔案傳完才拒絕。
+
+    Args:
+        stream: 上傳檔案的串流（例如 FileStorage.stream）
+        max_bytes: 檔案大小上限
+
+    Returns:
+        tuple: (檔案內容, 摘要)
+    """
+    hasher = hashlib.sha256()
+    buffer = io.BytesIO()
+    size = 0
+    checked = False
+    while True:
+        chunk = stream.read(CHUNK_SIZE)
+        if not chunk:
+            break
+        size += len(chunk)
+        if size > max_bytes:
+            raise ImageValidationError(f'檔案超過 {max_bytes // (1024 * 1024)} MB 上限')
+        hasher.update(chunk)
+        buffer.write(chunk)
+        if not checked and size >= 16:
+            _sniff_signature(buffer.getvalue()[:16])
+            checked = True
+    if size == 0:
+        raise ImageValidationError('檔案是空的')
+    if not checked:
+        _sniff_signature(buffer.getvalue())
+    return buffer.getvalue(), hasher.hexdigest()
+
+
+def inspect_image(data: bytes) -> Tuple[str, Tuple[int, int]]:
+    """
+    只解析檔頭取得格式與尺寸，拒絕過大的圖片與解壓縮炸彈
+
+    Returns:
+        tuple: (格式, (寬, 高))
+    """
+    fmt = _sniff_signature(data[:16])
+    try:
+        with Image.open(io.BytesIO(data)) as img:
+            # Image.open 只讀取檔頭，不會解碼像素
+            width, height = img.size
+            actual = img.format
+    except Image.DecompressionBombError:
+        raise ImageValidationError('圖片尺寸過大')
+    except Exception:
+        raise ImageValidationError('無法辨識的圖片檔案')
+    if actual != fmt:
+        raise ImageValidationError('檔案內容與圖片格式不符')
+    if width <= 0 or height <= 0 or max(width, height) > MAX_IMAGE_SIDE:
+        raise ImageValidationError(f'圖片尺寸 {width}x{height} 超出限制')
+    limit = MAX_JPEG_PIXELS if fmt == 'JPEG' else MAX_IMAGE_PIXELS
+    if width * height > limit:
+        raise ImageValidationError(f'圖片尺寸 {width}x{height} 超出限制')
+    return fmt, (width, height)
+
+
+def open_image(source, target_size: Tuple[int, int]) -> Image.Image:
+    """
+    解碼圖片並轉成 RGB
+
+    JPEG 會以 draft 模式在 DCT 階段直接縮小（1/2、1/4、1/8），
+    只解碼到不小於 target_size 的解析度，大幅降低大照片的記憶體與 CPU 用量。
+
+    Args:
+        source: bytes、圖片路徑或類檔案物件
+        target_size: 之後要縮放到的尺寸 (寬, 高)
+    """
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        source = io.BytesIO(source)
+    with Image.open(source) as img:
+        if img.format == 'JPEG':
+            img.draft('RGB', target_size)
+        return img.convert('RGB')
+
+
+def persist_upload(data: bytes, digest: str, fmt: str, folder: str) -> str:
+    """
+    以摘要為檔名把圖片寫入磁碟；相同內容的檔案已存在時不再寫入
+
+    Returns:
+        str: 保存的檔名
+    """
+    filename = f"{digest}.{EXTENSIONS[fmt]}"
+    filepath = os.path.join(folder, filename)
+    if os.path.exists(filepath):
+        logger.info(f"相同內容的檔案已存在：{filename}")
+        return filename
+
+    # 先寫到暫存檔再改名，避免其他請求讀到寫到一半的檔案
+    fd, tmp_path = tempfile.mkstemp(dir=folder, suffix='.part')
+    try:
+        with os.fdopen(fd, 'wb') as out:
+            out.write(data)
+        os.replace(tmp_path, filepath)
+    except Exception:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    return filename
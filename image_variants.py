@@ -0,0 +1,202 @@
+"""
+產生參考圖片與上傳圖片的多尺寸 WebP / JPEG 衍生檔
+
+衍生檔放在 static/variants/ 下，保留原始的相對路徑，例如
+style_images/abc.jpg → variants/style_images/abc.240w.webp
+
+執行 python image_variants.py 可以預先產生所有參考圖片的衍生檔。
+"""
+import io
+import logging
+import os
+import tempfile
+import threading
+from typing import Dict, List, Optional, Tuple
+
+from flask import url_for
+from PIL import Image, features
+
+logger = logging.getLogger(__name__)
+
+# 衍生檔寬度（像素）
+VARIANT_WIDTHS = {
+    'thumb': 240,
+    'medium': 480,
+}
+VARIANT_FOLDER = 'variants'
+REFERENCE_FOLDERS = ('style_images', 'color_images')
+SOURCE_EXTENSIONS = ('.jpg', '.jpeg', '.png')
+
+WEBP_SUPPORTED = features.check('webp')
+FORMATS = ('webp', 'jpg') if WEBP_SUPPORTED else ('jpg',)
+SAVE_OPTIONS = {
+    'webp': {'format': 'WEBP', 'quality': 80, 'method': 4},
+    'jpg': {'format': 'JPEG', 'quality': 82, 'optimize': True, 'progressive': True},
+}
+
+
+def variant_path(filename: str, width: int, ext: str) -> str:
+    """衍生檔相對於 static 目錄的路徑"""
+    stem = os.path.splitext(filename)[0]
+    return f"{VARIANT_FOLDER}/{stem}.{width}w.{ext}"
+
+
+def generate_variants(static_folder: str, filename: str, data: Optional[bytes] = None) -> List[str]:
+    """
+    為一張圖片產生所有尺寸與格式的衍生檔；已存在且比原圖新的衍生檔會略過
+
+    Args:
+        static_folder: static 目錄的路徑
+        filename: 圖片相對於 static 目錄的路徑
+        data: 圖片內容；已在記憶體中時傳入可省去一次讀檔
+
+    Returns:
+        list: 新產生的衍生檔路徑
+    """
+    source = os.path.join(static_folder, filename)
+    source_mtime = os.path.getmtime(source) if os.path.exists(source) else 0
+    pending = []
+    for width in VARIANT_WIDTHS.values():
+        for ext in FORMATS:
+            target = os.path.join(static_folder, variant_path(filename, width, ext))
+            if not os.path.exists(target) or os.path.getmtime(target) < source_mtime:
+                pending.append((width, ext, target))
+    if not pending:
+        return []
+
+    created = []
+    with Image.open(io.BytesIO(data) if data is not None else source) as img:
+        largest = max(width for width, _, _ in pending)
+        if img.width <= min(VARIANT_WIDTHS.values()):
+            # 原圖已經比最小的衍生尺寸還小，不需要衍生檔
+            return []
+        if img.format == 'JPEG':
+            img.draft('RGB', (largest, largest * img.height // img.width))
+        img = img.convert('RGB')
+        for width, ext, target in sorted(pending, reverse=True):
+            if width >= img.width:
+                continue
+            height = max(1, round(img.height * width / img.width))
+            resized = img.resize((width, height), Image.Resampling.LANCZOS, reducing_gap=3.0)
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            # 先寫到暫存檔再改名，同時有多個線程產生同一張圖時也不會讀到半個檔案
+            fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(target), suffix='.part')
+            try:
+                with os.fdopen(fd, 'wb') as out:
+                    resized.save(out, **SAVE_OPTIONS[ext])
+                os.replace(tmp_path, target)
+            except Exception:
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+                raise
+            created.append(target)
+    return created
+
+
+class ImageVariants:
+    def __init__(self, app=None):
+        """
+        在模板中提供 image_srcset(filename, ext)，輸出可用衍生檔的 srcset 字串
+        """
+        self.static_folder: Optional[str] = None
+        self._widths: Dict[str, Tuple[float, int]] = {}
+        # 每次參考圖片的衍生檔產生完成後加一，讓依賴 srcset 的快取片段知道要重新渲染
+        self.generation = 0
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app) -> None:
+        self.static_folder = app.static_folder
+        app.add_template_global(self.srcset, 'image_srcset')
+
+    def _original_width(self, filename: str) -> Optional[int]:
+        """讀取原圖寬度（只解析檔頭），依修改時間快取"""
+        path = os.path.join(self.static_folder, filename)
+        try:
+            mtime = os.path.getmtime(path)
+        except OSError:
+            return None
+        cached = self._widths.get(filename)
+        if cached and cached[0] == mtime:
+            return cached[1]
+        try:
+            with Image.open(path) as img:
+                width = img.width
+        except Exception:
+            return None
+        self._widths[filename] = (mtime, width)
+        return width
+
+    def srcset(self, filename: str, ext: str = 'jpg') -> str:
+        """
+        產生 srcset 屬性值；JPEG 版本會包含原圖作為最大的選項
+
+        Returns:
+            str: 例如 "/static/variants/a.240w.jpg?v=... 240w, /static/a.jpg?v=... 736w"，
+                 沒有可用衍生檔時為空字串
+        """
+        candidates = []
+        for width in sorted(VARIANT_WIDTHS.values()):
+            path = variant_path(filename, width, ext)
+            if os.path.exists(os.path.join(self.static_folder, path)):
+                candidates.append(f"{url_for('static', filename=path)} {width}w")
+        if not candidates:
+            return ''
+        if ext == 'jpg':
+            width = self._original_width(filename)
+            if width:
+                candidates.append(f"{url_for('static', filename=filename)} {width}w")
+        return ', '.join(candidates)
+
+    def generate_for(self, filename: str, data: Optional[bytes] = None) -> List[str]:
+        """產生單張圖片的衍生檔，失敗時只記錄錯誤；回傳新產生的衍生檔路徑"""
+        try:
+            return generate_variants(self.static_folder, filename, data)
+        except Exception as e:
+            logger.error(f"產生衍生圖片時發生錯誤（{filename}）：{str(e)}")
+            return []
+
+    def remove_for(self, filename: str) -> None:
+        """刪除某張圖片的所有衍生檔（原圖被清除時呼叫）"""
+        for width in VARIANT_WIDTHS.values():
+            for ext in FORMATS:
+                try:
+                    os.remove(os.path.join(self.static_folder, variant_path(filename, width, ext)))
+                except FileNotFoundError:
+                    pass
+
+    def generate_references(self) -> int:
+        """產生所有參考圖片的衍生檔"""
+        count = 0
+        for folder in REFERENCE_FOLDERS:
+            directory = os.path.join(self.static_folder, folder)
+            if not os.path.isdir(directory):
+                continue
+            for name in sorted(os.listdir(directory)):
+                if name.lower().endswith(SOURCE_EXTENSIONS):
+                    try:
+                        count += len(generate_variants(self.static_folder, f"{folder}/{name}"))
+                    except Exception as e:
+                        logger.error(f"產生衍生圖片時發生錯誤（{folder}/{name}）：{str(e)}")
+        self.generation += 1
+        return count
+
+    def generate_references_async(self) -> threading.Thread:
+        """在背景線程產生參考圖片的衍生檔，不延遲伺服器啟動"""
+        thread = threading.Thread(target=self.generate_references, name='image-variants')
+        thread.daemon = True
+        thread.start()
+        return thread
+
+
+def main():
+    static_folder = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'static')
+    variants = ImageVariants()
+    variants.static_folder = static_folder
+    count = variants.generate_references()
+    print(f"已產生 {count} 個衍生圖片")
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    main()
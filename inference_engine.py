@@ -0,0 +1,632 @@
+"""
+純 NumPy 推論引擎
+
+讀取 Keras 匯出的 .h5 模型（model_config + model_weights），
+將網路圖攤平成一串運算步驟，並以向量化的 NumPy 運算執行前向傳播。
+不需要安裝 TensorFlow。
+"""
+import json
+import logging
+import os
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# 攤平權重檔（save_flat / from_flat）的格式
+FLAT_MAGIC = b'NPKM0001'
+FLAT_ALIGN = 64
+
+# 不影響推論結果的層
+_IDENTITY_LAYERS = {'InputLayer', 'Dropout', 'SpatialDropout2D', 'GaussianNoise', 'ActivityRegularization'}
+
+
+def _same_padding(size, kernel, stride):
+    """計算 TensorFlow 'same' 模式下的 (前, 後) 填充量"""
+    out = -(-size // stride)
+    total = max((out - 1) * stride + kernel - size, 0)
+    return total // 2, total - total // 2
+
+
+def _resolve_pads(x, ksize, strides, padding, extra):
+    """
+    計算 NHWC 張量實際的 (上, 下, 左, 右) 填充量
+
+    Args:
+        extra: 由前一個 ZeroPadding2D 併入的填充量，沒有則為 None
+    """
+    if padding == 'same':
+        top, bottom = _same_padding(x.shape[1], ksize[0], strides[0])
+        left, right = _same_padding(x.shape[2], ksize[1], strides[1])
+    else:
+        top = bottom = left = right = 0
+    if extra is not None:
+        top, bottom, left, right = top + extra[0], bottom + extra[1], left + extra[2], right + extra[3]
+    return top, bottom, left, right
+
+
+def _tap_range(size, out_size, offset, stride):
+    """
+    卷積核某個位置在輸出上的有效範圍（落在補零區域的部分直接略過）
+
+    Returns:
+        (輸出起點, 輸出終點, 對應的輸入起點)
+    """
+    start = max(0, -(offset // stride))
+    end = min(out_size, (size - 1 - offset) // stride + 1)
+    return start, max(start, end), start * stride + offset
+
+
+def _linear_to_none(activation):
+    return None if activation == 'linear' else activation
+
+
+def _apply_activation(x, activation, max_value=None):
+    """就地套用激活函數"""
+    if activation in (None, 'linear'):
+        return x
+    if activation == 'relu':
+        if max_value is None:
+            return np.maximum(x, 0, out=x)
+        return np.clip(x, 0, max_value, out=x)
+    if activation == 'relu6':
+        return np.clip(x, 0, 6.0, out=x)
+    if activation == 'softmax':
+        x -= x.max(axis=-1, keepdims=True)
+        np.exp(x, out=x)
+        x /= x.sum(axis=-1, keepdims=True)
+        return x
+    if activation == 'sigmoid':
+        np.negative(x, out=x)
+        np.exp(x, out=x)
+        x += 1.0
+        return np.reciprocal(x, out=x)
+    if activation == 'tanh':
+        return np.tanh(x, out=x)
+    raise NotImplementedError(f"不支援的激活函數：{activation}")
+
+
+class _Op:
+    """運算步驟：inputs 為來源張量名稱，output 為輸出張量名稱"""
+
+    def __init__(self, name, inputs, output):
+        self.name = name
+        self.inputs = inputs
+        self.output = output
+
+    def __call__(self, *tensors):
+        raise NotImplementedError
+
+    def _restore(self):
+        """從攤平權重檔重建後呼叫，用來初始化不會被保存的快取"""
+
+
+class _ZeroPad(_Op):
+    def __init__(self, name, inputs, output, padding):
+        super().__init__(name, inputs, output)
+        (top, bottom), (left, right) = padding
+        self.pad = ((0, 0), (top, bottom), (left, right), (0, 0))
+
+    def __call__(self, x):
+        return np.pad(x, self.pad)
+
+
+class _Conv(_Op):
+    """一般卷積；1x1 卷積直接轉成矩陣乘法，其餘以 im2col 展開"""
+
+    def __init__(self, name, inputs, output, kernel, bias, strides, padding):
+        super().__init__(name, inputs, output)
+        self.ksize = kernel.shape[:2]
+        self.strides = tuple(strides)
+        self.padding = padding
+        self.extra_pads = None
+        self.filters = kernel.shape[3]
+        self.kernel = np.ascontiguousarray(kernel.reshape(-1, self.filters), dtype=np.float32)
+        self.bias = bias
+        self.activation = None
+        self.max_value = None
+
+    def __call__(self, x):
+        kh, kw = self.ksize
+        sh, sw = self.strides
+        if (kh, kw) == (1, 1) and self.extra_pads is None:
+            if (sh, sw) != (1, 1):
+                x = x[:, ::sh, ::sw, :]
+            n, oh, ow, c = x.shape
+            cols = x.reshape(-1, c)
+        else:
+            top, bottom, left, right = _resolve_pads(x, self.ksize, self.strides, self.padding, self.extra_pads)
+            n, h, w, c = x.shape
+            oh = (h + top + bottom - kh) // sh + 1
+            ow = (w + left + right - kw) // sw + 1
+            if top or bottom or left or right:
+                cols = np.zeros((n, oh, ow, kh * kw * c), dtype=np.float32)
+            else:
+                cols = np.empty((n, oh, ow, kh * kw * c), dtype=np.float32)
+            for i in range(kh):
+                a0, a1, r = _tap_range(h, oh, i - top, sh)
+                for j in range(kw):
+                    b0, b1, q = _tap_range(w, ow, j - left, sw)
+                    k = (i * kw + j) * c
+                    cols[:, a0:a1, b0:b1, k:k + c] = x[:, r:r + sh * (a1 - a0 - 1) + 1:sh,
+                                                       q:q + sw * (b1 - b0 - 1) + 1:sw, :]
+            cols = cols.reshape(-1, kh * kw * c)
+        out = cols @ self.kernel
+        if self.bias is not None:
+            out += self.bias
+        _apply_activation(out, self.activation, self.max_value)
+        return out.reshape(n, oh, ow, self.filters)
+
+
+class _DepthwiseConv(_Op):
+    """逐通道卷積：對每個卷積核位置做一次切片乘加，補零區域直接略過"""
+
+    def __init__(self, name, inputs, output, kernel, bias, strides, padding):
+        super().__init__(name, inputs, output)
+        if kernel.shape[3] != 1:
+            raise NotImplementedError(f"{name}：不支援 depth_multiplier > 1")
+        self.ksize = kernel.shape[:2]
+        self.strides = tuple(strides)
+        self.padding = padding
+        self.extra_pads = None
+        self.kernel = np.ascontiguousarray(kernel[:, :, :, 0], dtype=np.float32)
+        self.bias = bias
+        self.activation = None
+        self.max_value = None
+        self._row_weights = {}
+
+    def _restore(self):
+        self._row_weights = {}
+
+    def _row_weight(self, i, j, width):
+        """
+        將單一位置的權重鋪成 (寬, 通道) 的連續陣列
+
+        權重與輸入列的記憶體排列一致時，NumPy 可以把最後兩個維度合併成一個長迴圈，
+        通道數很少（例如 16）時速度約快一倍。
+        """
+        key = (i, j, width)
+        weight = self._row_weights.get(key)
+        if weight is None:
+            weight = np.ascontiguousarray(np.broadcast_to(self.kernel[i, j], (width, self.kernel.shape[2])))
+            self._row_weights[key] = weight
+        return weight
+
+    def __call__(self, x):
+        kh, kw = self.ksize
+        sh, sw = self.strides
+        top, bottom, left, right = _resolve_pads(x, self.ksize, self.strides, self.padding, self.extra_pads)
+        n, h, w, c = x.shape
+        oh = (h + top + bottom - kh) // sh + 1
+        ow = (w + left + right - kw) // sw + 1
+
+        taps = []
+        for i in range(kh):
+            a0, a1, r = _tap_range(h, oh, i - top, sh)
+            for j in range(kw):
+                b0, b1, q = _tap_range(w, ow, j - left, sw)
+                if a1 > a0 and b1 > b0:
+                    window = x[:, r:r + sh * (a1 - a0 - 1) + 1:sh, q:q + sw * (b1 - b0 - 1) + 1:sw, :]
+                    taps.append(((a1 - a0) * (b1 - b0), a0, a1, b0, b1, window, self._row_weight(i, j, b1 - b0)))
+        # 先處理覆蓋整個輸出的位置（通常是中心點），省去一次清零
+        taps.sort(key=lambda t: -t[0])
+
+        out = np.empty((n, oh, ow, c), dtype=np.float32)
+        tmp = np.empty_like(out)
+        first = taps[0]
+        if first[0] == oh * ow:
+            np.multiply(first[5], first[6], out=out)
+            taps = taps[1:]
+        else:
+            out.fill(0)
+        for _, a0, a1, b0, b1, window, weight in taps:
+            part = tmp[:, :a1 - a0, :b1 - b0, :]
+            np.multiply(window, weight, out=part)
+            out[:, a0:a1, b0:b1, :] += part
+        if self.bias is not None:
+            out += self.bias
+        return _apply_activation(out, self.activation, self.max_value)
+
+
+class _Affine(_Op):
+    """未能併入卷積的 BatchNormalization"""
+
+    def __init__(self, name, inputs, output, scale, shift):
+        super().__init__(name, inputs, output)
+        self.scale = scale
+        self.shift = shift
+
+    def __call__(self, x):
+        return x * self.scale + self.shift
+
+
+class _Activation(_Op):
+    def __init__(self, name, inputs, output, activation, max_value=None):
+        super().__init__(name, inputs, output)
+        self.activation = activation
+        self.max_value = max_value
+
+    def __call__(self, x):
+        return _apply_activation(x.copy(), self.activation, self.max_value)
+
+
+class _Add(_Op):
+    def __call__(self, *tensors):
+        out = tensors[0] + tensors[1]
+        for t in tensors[2:]:
+            out += t
+        return out
+
+
+class _GlobalAvgPool(_Op):
+    def __call__(self, x):
+        return x.mean(axis=(1, 2), dtype=np.float32)
+
+
+class _Flatten(_Op):
+    def __call__(self, x):
+        return x.reshape(x.shape[0], -1)
+
+
+class _Dense(_Op):
+    def __init__(self, name, inputs, output, kernel, bias, activation):
+        super().__init__(name, inputs, output)
+        self.kernel = np.ascontiguousarray(kernel, dtype=np.float32)
+        self.bias = bias
+        self.activation = activation
+
+    def __call__(self, x):
+        out = x @ self.kernel
+        if self.bias is not None:
+            out += self.bias
+        return _apply_activation(out, self.activation)
+
+
+_OP_TYPES = {cls.__name__: cls for cls in (
+    _ZeroPad, _Conv, _DepthwiseConv, _Affine, _Activation, _Add, _GlobalAvgPool, _Flatten, _Dense)}
+
+
+def _align(offset):
+    return -(-offset // FLAT_ALIGN) * FLAT_ALIGN
+
+
+def _tuples(value):
+    """JSON 讀回的 list 轉回 tuple（運算步驟中的尺寸與填充量都是 tuple）"""
+    if isinstance(value, list):
+        return tuple(_tuples(v) for v in value)
+    return value
+
+
+def _flatten_graph(layer_cfg, inputs, nodes):
+    """
+    將巢狀的 Sequential / Functional 設定攤平成節點列表
+
+    Args:
+        layer_cfg: Keras 層設定（含 class_name 與 config）
+        inputs: 此層的輸入張量名稱列表
+        nodes: 收集 (class_name, config, inputs, output) 的列表
+
+    Returns:
+        此層輸出張量的名稱
+    """
+    class_name = layer_cfg['class_name']
+    config = layer_cfg['config']
+
+    if class_name == 'Sequential':
+        current = inputs
+        for sub in config['layers']:
+            if sub['class_name'] == 'InputLayer':
+                continue
+            current = [_flatten_graph(sub, current, nodes)]
+        return current[0]
+
+    if class_name in ('Functional', 'Model'):
+        tensors = {}
+        for (name, _, _), source in zip(config['input_layers'], inputs):
+            tensors[name] = source
+        for sub in config['layers']:
+            if sub['class_name'] == 'InputLayer':
+                continue
+            inbound = sub['inbound_nodes'][0] if sub['inbound_nodes'] else []
+            sub_inputs = [tensors[item[0]] for item in inbound]
+            tensors[sub['name']] = _flatten_graph(sub, sub_inputs, nodes)
+        (output_name, _, _), = config['output_layers']
+        return tensors[output_name]
+
+    if class_name in _IDENTITY_LAYERS:
+        return inputs[0]
+
+    output = config['name']
+    nodes.append((class_name, config, list(inputs), output))
+    return output
+
+
+def _collect_weights(group):
+    """收集 model_weights 內的所有權重，鍵為 (層名稱, 權重名稱)"""
+    weights = {}
+
+    def visit(path, obj):
+        if hasattr(obj, 'shape'):
+            parts = path.split('/')
+            weights[(parts[-2], parts[-1].split(':')[0])] = np.asarray(obj[()], dtype=np.float32)
+
+    group.visititems(visit)
+    return weights
+
+
+class NumpyKerasModel:
+    """
+    以 NumPy 執行的 Keras 模型
+
+    載入時會把 BatchNormalization 併入前一個卷積層，並把 ReLU 併入卷積輸出，
+    推論時只剩矩陣乘法與逐通道乘加。物件建立後不再修改，可在多執行緒間共用。
+    """
+
+    def __init__(self, ops, input_name, output_name, input_shape, metadata=None):
+        self.ops = ops
+        self.input_name = input_name
+        self.output_name = output_name
+        self.input_shape = input_shape
+        self.metadata = metadata or {}
+        self._last_use = self._compute_last_use()
+
+    @classmethod
+    def from_h5(cls, path):
+        """
+        從 Keras .h5 檔案建立模型
+
+        Args:
+            path: .h5 模型路徑
+        """
+        import h5py
+
+        with h5py.File(path, 'r') as f:
+            config = f.attrs['model_config']
+            if isinstance(config, bytes):
+                config = config.decode('utf-8')
+            config = json.loads(config)
+            group = f['model_weights'] if 'model_weights' in f else f
+            weights = _collect_weights(group)
+        return cls.from_config(config, weights)
+
+    def save_flat(self, path, metadata=None):
+        """
+        將編譯後（已併入 BatchNorm）的運算步驟與權重寫成單一攤平檔案
+
+        檔案格式：8 bytes 標記 + 8 bytes 標頭長度 + JSON 標頭，之後是依 FLAT_ALIGN 對齊的
+        float32 原始陣列。from_flat 以唯讀 mmap 載入，多個行程共用同一份分頁快取。
+
+        Args:
+            path: 輸出路徑
+            metadata: 額外寫入標頭的資訊，例如來源模型的摘要
+        """
+        arrays = []
+        ops = []
+        for op in self.ops:
+            attrs = {}
+            refs = {}
+            for key, value in vars(op).items():
+                if key.startswith('_'):
+                    continue
+                if isinstance(value, np.ndarray):
+                    refs[key] = len(arrays)
+                    arrays.append(np.ascontiguousarray(value, dtype=np.float32))
+                else:
+                    attrs[key] = value
+            ops.append({'type': type(op).__name__, 'attrs': attrs, 'arrays': refs})
+
+        index = []
+        offset = 0
+        for array in arrays:
+            offset = _align(offset)
+            index.append({'offset': offset, 'shape': list(array.shape), 'dtype': array.dtype.str})
+            offset += array.nbytes
+
+        header = json.dumps({
+            'input_name': self.input_name,
+            'output_name': self.output_name,
+            'input_shape': list(self.input_shape),
+            'ops': ops,
+            'arrays': index,
+            'metadata': metadata if metadata is not None else self.metadata,
+        }, ensure_ascii=False).encode('utf-8')
+        data_start = _align(len(FLAT_MAGIC) + 8 + len(header))
+
+        # 先寫暫存檔再改名，其他行程不會讀到寫到一半的檔案
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        try:
+            with open(tmp_path, 'wb') as f:
+                f.write(FLAT_MAGIC)
+                f.write(len(header).to_bytes(8, 'little'))
+                f.write(header)
+                for array, entry in zip(arrays, index):
+                    f.write(b'\0' * (data_start + entry['offset'] - f.tell()))
+                    f.write(array.tobytes())
+            os.replace(tmp_path, path)
+        except Exception:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+    @classmethod
+    def from_flat(cls, path):
+        """
+        以唯讀 mmap 載入 save_flat 產生的檔案
+
+        權重陣列直接指向映射的檔案內容，不複製到行程私有記憶體，
+        同一台機器上的所有工作行程共用作業系統分頁快取中的同一份權重。
+        """
+        with open(path, 'rb') as f:
+            if f.read(len(FLAT_MAGIC)) != FLAT_MAGIC:
+                raise ValueError(f"不是攤平權重檔：{path}")
+            header_len = int.from_bytes(f.read(8), 'little')
+            header = json.loads(f.read(header_len).decode('utf-8'))
+        data_start = _align(len(FLAT_MAGIC) + 8 + header_len)
+
+        mapped = np.memmap(path, dtype=np.uint8, mode='r')
+        arrays = [np.ndarray(tuple(entry['shape']), dtype=np.dtype(entry['dtype']),
+                             buffer=mapped, offset=data_start + entry['offset'])
+                  for entry in header['arrays']]
+
+        ops = []
+        for entry in header['ops']:
+            op = _OP_TYPES[entry['type']].__new__(_OP_TYPES[entry['type']])
+            for key, value in entry['attrs'].items():
+                setattr(op, key, _tuples(value))
+            for key, idx in entry['arrays'].items():
+                setattr(op, key, arrays[idx])
+            op._restore()
+            ops.append(op)
+        return cls(ops, header['input_name'], header['output_name'],
+                   tuple(header['input_shape']), header.get('metadata'))
+
+    @classmethod
+    def from_config(cls, config, weights):
+        """
+        由模型設定與權重字典建立模型
+
+        Args:
+            config: model_config 解析後的字典
+            weights: {(層名稱, 權重名稱): ndarray}
+        """
+        input_shape = cls._find_input_shape(config)
+        nodes = []
+        output_name = _flatten_graph(config, ['input'], nodes)
+        ops = cls._compile(nodes, weights)
+        return cls(ops, 'input', output_name, input_shape)
+
+    @staticmethod
+    def _find_input_shape(config):
+        """找出最外層的輸入尺寸，例如 (None, 224, 224, 3)"""
+        layer = config
+        while True:
+            cfg = layer['config']
+            if 'batch_input_shape' in cfg:
+                return tuple(cfg['batch_input_shape'])
+            layers = cfg.get('layers')
+            if not layers:
+                raise ValueError("模型設定中找不到輸入尺寸")
+            layer = layers[0]
+
+    @staticmethod
+    def _compile(nodes, weights):
+        """將節點轉為運算步驟，並合併 Conv → BatchNorm → ReLU"""
+        consumers = {}
+        for _, _, inputs, _ in nodes:
+            for name in inputs:
+                consumers[name] = consumers.get(name, 0) + 1
+
+        ops = []
+        by_output = {}
+
+        for class_name, cfg, inputs, output in nodes:
+            name = cfg['name']
+            prev = by_output.get(inputs[0]) if len(inputs) == 1 else None
+            fusable = (isinstance(prev, (_Conv, _DepthwiseConv)) and prev.activation is None
+                       and consumers.get(inputs[0], 0) == 1)
+
+            extra_pads = None
+            if class_name in ('Conv2D', 'DepthwiseConv2D') and isinstance(prev, _ZeroPad) \
+                    and consumers.get(inputs[0], 0) == 1:
+                # 補零併入下一個卷積，不另外複製一份張量
+                ops.remove(prev)
+                del by_output[inputs[0]]
+                inputs = prev.inputs
+                extra_pads = tuple(prev.pad[1]) + tuple(prev.pad[2])
+
+            if class_name == 'ZeroPadding2D':
+                op = _ZeroPad(name, inputs, output, cfg['padding'])
+            elif class_name == 'Conv2D':
+                if cfg.get('groups', 1) != 1 or tuple(cfg.get('dilation_rate', (1, 1))) != (1, 1):
+                    raise NotImplementedError(f"{name}：不支援分組或擴張卷積")
+                bias = weights.get((name, 'bias')) if cfg.get('use_bias', True) else None
+                op = _Conv(name, inputs, output, weights[(name, 'kernel')], bias,
+                           cfg['strides'], cfg['padding'])
+                op.activation = _linear_to_none(cfg.get('activation'))
+                op.extra_pads = extra_pads
+            elif class_name == 'DepthwiseConv2D':
+                bias = weights.get((name, 'bias')) if cfg.get('use_bias', True) else None
+                op = _DepthwiseConv(name, inputs, output, weights[(name, 'depthwise_kernel')], bias,
+                                    cfg['strides'], cfg['padding'])
+                op.activation = _linear_to_none(cfg.get('activation'))
+                op.extra_pads = extra_pads
+            elif class_name == 'BatchNormalization':
+                eps = cfg.get('epsilon', 1e-3)
+                mean = weights[(name, 'moving_mean')]
+                var = weights[(name, 'moving_variance')]
+                gamma = weights.get((name, 'gamma'), np.ones_like(mean)) if cfg.get('scale', True) else np.ones_like(mean)
+                beta = weights.get((name, 'beta'), np.zeros_like(mean)) if cfg.get('center', True) else np.zeros_like(mean)
+                scale = (gamma / np.sqrt(var + eps)).astype(np.float32)
+                shift = (beta - mean * scale).astype(np.float32)
+                if fusable:
+                    # 併入卷積：W' = W * scale，b' = b * scale + shift
+                    prev.kernel = np.ascontiguousarray(prev.kernel * scale)
+                    prev.bias = shift if prev.bias is None else (prev.bias * scale + shift).astype(np.float32)
+                    prev.output = output
+                    by_output[output] = by_output.pop(inputs[0])
+                    continue
+                op = _Affine(name, inputs, output, scale, shift)
+            elif class_name in ('ReLU', 'Activation'):
+                if class_name == 'ReLU':
+                    if cfg.get('negative_slope', 0.0) or cfg.get('threshold', 0.0):
+                        raise NotImplementedError(f"{name}：不支援 negative_slope / threshold")
+                    activation, max_value = 'relu', cfg.get('max_value')
+                else:
+                    activation, max_value = cfg['activation'], None
+                if fusable:
+                    prev.activation = activation
+                    prev.max_value = max_value
+                    prev.output = output
+                    by_output[output] = by_output.pop(inputs[0])
+                    continue
+                op = _Activation(name, inputs, output, activation, max_value)
+            elif class_name == 'Add':
+                op = _Add(name, inputs, output)
+            elif class_name == 'GlobalAveragePooling2D':
+                op = _GlobalAvgPool(name, inputs, output)
+            elif class_name == 'Flatten':
+                op = _Flatten(name, inputs, output)
+            elif class_name == 'Dense':
+                bias = weights.get((name, 'bias')) if cfg.get('use_bias', True) else None
+                op = _Dense(name, inputs, output, weights[(name, 'kernel')], bias, cfg.get('activation'))
+            elif class_name == 'Softmax':
+                op = _Activation(name, inputs, output, 'softmax')
+            else:
+                raise NotImplementedError(f"不支援的層類型：{class_name}（{name}）")
+
+            ops.append(op)
+            by_output[output] = op
+        return ops
+
+    def _compute_last_use(self):
+        """計算每個張量最後一次被使用的步驟，以便盡早釋放記憶體"""
+        last_use = {}
+        for idx, op in enumerate(self.ops):
+            for name in op.inputs:
+                last_use[name] = idx
+        return last_use
+
+    @property
+    def num_classes(self):
+        return self.ops[-1].kernel.shape[-1] if isinstance(self.ops[-1], _Dense) else None
+
+    def predict(self, batch):
+        """
+        執行前向傳播
+
+        Args:
+            batch: (N, H, W, C) 的 float32 陣列，已完成正規化
+
+        Returns:
+            np.ndarray: (N, 類別數) 的模型輸出
+        """
+        batch = np.asarray(batch, dtype=np.float32)
+        if batch.ndim == 3:
+            batch = batch[None]
+        tensors = {self.input_name: batch}
+        for idx, op in enumerate(self.ops):
+            tensors[op.output] = op(*(tensors[name] for name in op.inputs))
+            for name in op.inputs:
+                if self._last_use.get(name) == idx and name != op.output:
+                    tensors.pop(name, None)
+        return tensors[self.output_name]
@@ -0,0 +1,292 @@
+"""
+推論工作行程池
+
+每個工作行程各自以 mmap 載入攤平權重（多個行程共用同一份實體記憶體），
+並擁有一塊共享記憶體作為輸入張量區。網頁行程把前處理結果直接寫入該區塊，
+只透過 Pipe 傳送 (任務編號, 張數)，結果（每張圖片的機率向量）再從 Pipe 傳回，
+張量本身不經過 pickle。工作行程崩潰或逾時會被自動重啟，批次改送到其他工作行程。
+"""
+import itertools
+import logging
+import os
+import queue
+import signal
+import threading
+import time
+from multiprocessing import get_context
+from multiprocessing.shared_memory import SharedMemory
+from typing import Any, List, Optional, Tuple
+
+import numpy as np
+
+from metrics import STAGE_SECONDS
+
+logger = logging.getLogger(__name__)
+
+READY_TIMEOUT = 120.0  # 等待工作行程載入模型的最長時間（秒）
+POLL_INTERVAL = 0.5  # 等待結果時檢查工作行程是否存活的間隔（秒）
+INFERENCE_SECONDS = STAGE_SECONDS.labels('inference')  # 含行程間傳遞，從送出任務到收到機率輸出
+
+
+def _worker_main(conn, shm_name: str, shape: Tuple[int, ...], model_path: str, flat_path: str) -> None:
+    """工作行程主程式：載入模型，之後依序處理父行程送來的批次"""
+    # Ctrl+C 由父行程處理，工作行程跟著 Pipe 關閉結束
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    from model_utils import load_engine
+
+    engine, _ = load_engine(model_path, flat_path)
+    shm = SharedMemory(name=shm_name)
+    batch = np.ndarray(shape, dtype=np.float32, buffer=shm.buf)
+    # 預熱：讓權重分頁與暫存陣列在第一個任務前就準備好
+    engine.predict(np.zeros(shape, dtype=np.float32))
+    conn.send(('ready', os.getpid()))
+    try:
+        while True:
+            try:
+                task = conn.recv()
+            except (EOFError, OSError):
+                # 父行程已結束
+                break
+            if task is None:
+                break
+            task_id, n = task
+            try:
+                conn.send(('ok', task_id, engine.predict(batch[:n])))
+            except Exception as e:
+                conn.send(('error', task_id, str(e)))
+    finally:
+        del batch
+        shm.close()
+
+
+class WorkerCrashed(RuntimeError):
+    """工作行程在處理批次時結束或逾時"""
+
+
+class _Worker:
+    def __init__(self, index: int, shm: SharedMemory, shape: Tuple[int, ...]):
+        self.index = index
+        self.shm = shm
+        self.batch = np.ndarray(shape, dtype=np.float32, buffer=shm.buf)
+        self.process = None
+        self.conn = None
+
+
+class InferencePool:
+    def __init__(self, model, processes: Optional[int] = None, max_batch_size: int = 16,
+                 task_timeout: float = 30.0, model_path: Optional[str] = None, flat_path: Optional[str] = None):
+        """
+        多行程推論池，介面與 FashionModel.predict_batch 相同，可以直接交給 BatchScheduler
+
+        Args:
+            model: 已載入的 FashionModel，提供前處理、標籤與模型版本
+            processes: 工作行程數，預設為 CPU 核心數
+            max_batch_size: 單一批次最多的圖片數（決定每塊共享記憶體的大小）
+            task_timeout: 單一批次的最長處理時間（秒），超過時視為當機並重啟工作行程
+            model_path: 工作行程載入的 .h5 模型路徑
+            flat_path: 工作行程載入的攤平權重檔路徑
+        """
+        from model_utils import MODEL_PATH, FLAT_MODEL_PATH
+
+        self.model = model
+        self.version = model.version
+        self.processes = processes or os.cpu_count() or 1
+        self.max_batch_size = max_batch_size
+        self.task_timeout = task_timeout
+        self.model_path = str(model_path or MODEL_PATH)
+        self.flat_path = str(flat_path or FLAT_MODEL_PATH)
+        height, width = model.input_size
+        self.shape = (max_batch_size, height, width, 3)
+        # 使用 spawn：網頁行程已經有多個線程，fork 可能複製到被鎖住的鎖
+        self._context = get_context('spawn')
+        self._workers: List[_Worker] = []
+        self._idle: queue.Queue = queue.Queue()
+        self._task_ids = itertools.count()
+        self._stats_lock = threading.Lock()
+        self.running = False
+
+        # 統計資料
+        self.batches_run = 0
+        self.images_served = 0
+        self.restarts = 0
+
+    def label_for(self, index: int) -> str:
+        return self.model.label_for(index)
+
+    def start(self) -> None:
+        """建立共享記憶體並啟動所有工作行程，等到全部載入完成才返回"""
+        if self.running:
+            return
+        nbytes = int(np.prod(self.shape)) * np.dtype(np.float32).itemsize
+        try:
+            for index in range(self.processes):
+                worker = _Worker(index, SharedMemory(create=True, size=nbytes), self.shape)
+                try:
+                    self._spawn(worker)
+                except Exception:
+                    del worker.batch
+                    worker.shm.close()
+                    worker.shm.unlink()
+                    raise
+                self._workers.append(worker)
+            for worker in self._workers:
+                self._wait_ready(worker)
+                self._idle.put(worker)
+        except Exception:
+            self.stop()
+            raise
+        self.running = True
+        logger.info(f"推論工作行程池已啟動（{self.processes} 個行程，批次上限 {self.max_batch_size}）")
+
+    def stop(self, timeout: float = 5.0) -> None:
+        """停止所有工作行程並釋放共享記憶體"""
+        self.running = False
+        for worker in self._workers:
+            try:
+                worker.conn.send(None)
+            except (OSError, ValueError):
+                pass
+        for worker in self._workers:
+            worker.process.join(timeout)
+            if worker.process.is_alive():
+                worker.process.terminate()
+                worker.process.join(timeout)
+            worker.conn.close()
+            del worker.batch
+            worker.shm.close()
+            worker.shm.unlink()
+        self._workers = []
+
+    def _spawn(self, worker: _Worker) -> None:
+        parent_conn, child_conn = self._context.Pipe()
+        process = self._context.Process(
+            target=_worker_main,
+            args=(child_conn, worker.shm.name, self.shape, self.model_path, self.flat_path),
+            name=f'inference-worker-{worker.index}')
+        process.daemon = True
+        process.start()
+        child_conn.close()
+        worker.process = process
+        worker.conn = parent_conn
+
+    def _wait_ready(self, worker: _Worker) -> None:
+        if not worker.conn.poll(READY_TIMEOUT):
+            raise WorkerCrashed(f"推論工作行程 {worker.index} 未在 {READY_TIMEOUT:.0f} 秒內就緒")
+        try:
+            message = worker.conn.recv()
+        except EOFError:
+            raise WorkerCrashed(f"推論工作行程 {worker.index} 啟動失敗（結束代碼 {worker.process.exitcode}）")
+        logger.info(f"推論工作行程 {worker.index} 已就緒（pid {message[1]}）")
+
+    def _restart(self, worker: _Worker) -> None:
+        """重啟崩潰的工作行程，就緒後放回閒置佇列；失敗時稍後再試"""
+        while self.running:
+            if worker.process.is_alive():
+                worker.process.kill()
+            worker.process.join()
+            worker.conn.close()
+            with self._stats_lock:
+                self.restarts += 1
+            try:
+                self._spawn(worker)
+                self._wait_ready(worker)
+            except Exception as e:
+                logger.error(f"重啟推論工作行程時發生錯誤：{str(e)}")
+                time.sleep(POLL_INTERVAL)
+                continue
+            self._idle.put(worker)
+            return
+
+    def _restart_async(self, worker: _Worker) -> None:
+        thread = threading.Thread(target=self._restart, args=(worker,), name=f'inference-restart-{worker.index}')
+        thread.daemon = True
+        thread.start()
+
+    def _run_on(self, worker: _Worker, n: int) -> np.ndarray:
+        """把共享記憶體中的前 n 張圖片交給工作行程，等待機率輸出"""
+        task_id = next(self._task_ids)
+        deadline = time.monotonic() + self.task_timeout
+        try:
+            worker.conn.send((task_id, n))
+            while not worker.conn.poll(POLL_INTERVAL):
+                if not worker.process.is_alive():
+                    raise WorkerCrashed(f"推論工作行程 {worker.index} 已結束（結束代碼 {worker.process.exitcode}）")
+                if time.monotonic() > deadline:
+                    raise WorkerCrashed(f"推論工作行程 {worker.index} 處理逾時")
+            status, result_id, payload = worker.conn.recv()
+        except (EOFError, OSError) as e:
+            raise WorkerCrashed(f"推論工作行程 {worker.index} 連線中斷：{str(e)}")
+        if result_id != task_id:
+            raise WorkerCrashed(f"推論工作行程 {worker.index} 回傳了錯誤的任務")
+        if status != 'ok':
+            raise RuntimeError(payload)
+        return payload
+
+    def _predict_chunk(self, images: List[Any]) -> List[Tuple[str, float]]:
+        results = [("未知", 0.0)] * len(images)
+        worker = self._idle.get()
+        try:
+            # 前處理結果直接寫入工作行程的共享記憶體
+            batch, indices, failures = self.model.preprocessor.preprocess_batch(images, out=worker.batch)
+            for i, e in failures:
+                logger.warning(f"第 {i + 1} 張圖片讀取失敗：{str(e)}")
+            if not indices:
+                return results
+            try:
+                with INFERENCE_SECONDS.time():
+                    probs = self._run_on(worker, len(indices))
+            except WorkerCrashed as e:
+                logger.error(f"{str(e)}，重啟並改由其他工作行程處理")
+                self._restart_async(worker)
+                worker = self._idle.get()
+                worker.batch[:len(indices)] = batch
+                probs = self._run_on(worker, len(indices))
+        except WorkerCrashed as e:
+            logger.error(f"{str(e)}，放棄此批次")
+            self._restart_async(worker)
+            return results
+        except Exception as e:
+            logger.error(f"批次預測時發生錯誤：{str(e)}")
+            self._idle.put(worker)
+            return results
+        self._idle.put(worker)
+
+        classes = probs.argmax(axis=1)
+        for i, cls, row in zip(indices, classes, probs):
+            results[i] = (self.label_for(int(cls)), float(row[cls]))
+        with self._stats_lock:
+            self.batches_run += 1
+            self.images_served += len(indices)
+        return results
+
+    def predict_batch(self, images: List[Any], batch_size: Optional[int] = None) -> List[Tuple[str, float]]:
+        """
+        預測多張圖片；可由多個線程同時呼叫，每個批次由一個閒置的工作行程處理
+
+        Returns:
+            list: 與輸入順序相同的 (標籤, 信心度)；無法處理的圖片回傳 ("未知", 0.0)
+        """
+        if not self.running:
+            raise RuntimeError("推論工作行程池尚未啟動")
+        batch_size = min(batch_size or self.max_batch_size, self.max_batch_size)
+        results = []
+        for start in range(0, len(images), batch_size):
+            results.extend(self._predict_chunk(images[start:start + batch_size]))
+        return results
+
+    def stats(self) -> dict:
+        with self._stats_lock:
+            return {
+                'processes': self.processes,
+                'idle': self._idle.qsize(),
+                'batches_run': self.batches_run,
+                'images_served': self.images_served,
+                'restarts': self.restarts,
+            }
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.stop()
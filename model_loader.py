@@ -0,0 +1,117 @@
+import logging
+import threading
+import time
+from typing import Any, Callable, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# 載入狀態
+PENDING = 'pending'
+LOADING = 'loading'
+WARMING = 'warming'
+READY = 'ready'
+FAILED = 'failed'
+
+
+class ModelLoader:
+    def __init__(self, factory: Callable[[], Any], retry_interval: float = 30.0):
+        """
+        在背景線程載入並預熱模型，伺服器不必等模型就緒就能開始回應
+
+        Args:
+            factory: 建立模型的函數，例如 FashionModel
+            retry_interval: 載入失敗後重試的間隔（秒），0 表示不重試
+        """
+        self.factory = factory
+        self.retry_interval = retry_interval
+        self.model = None
+        self.state = PENDING
+        self.error: Optional[str] = None
+        self.attempts = 0
+        self.load_thread: Optional[threading.Thread] = None
+        self._ready = threading.Event()
+        self._lock = threading.Lock()
+        self._callbacks: List[Callable[[Any], None]] = []
+
+        # 統計資料
+        self.started_at: Optional[float] = None
+        self.ready_at: Optional[float] = None
+        self.load_duration = 0.0
+        self.warm_up_duration = 0.0
+
+    def on_ready(self, callback: Callable[[Any], None]) -> None:
+        """
+        註冊模型就緒後的回調函數，參數為模型；回調在背景線程中執行，
+        全部完成後 ready 才會成立
+        """
+        self._callbacks.append(callback)
+
+    def start(self) -> None:
+        """啟動背景載入；可以重複呼叫，只會載入一次"""
+        with self._lock:
+            if self.load_thread is not None:
+                return
+            self.started_at = time.monotonic()
+            self.load_thread = threading.Thread(target=self._run, name='model-loader')
+            self.load_thread.daemon = True
+            self.load_thread.start()
+
+    def _run(self) -> None:
+        while True:
+            self.attempts += 1
+            try:
+                self._load()
+                return
+            except Exception as e:
+                self.state = FAILED
+                self.error = str(e)
+                logger.error(f"模型初始化失敗：{str(e)}")
+            if not self.retry_interval:
+                return
+            time.sleep(self.retry_interval)
+
+    def _load(self) -> None:
+        self.state = LOADING
+        start = time.perf_counter()
+        model = self.factory()
+        loaded = time.perf_counter()
+        self.load_duration = loaded - start
+
+        self.state = WARMING
+        warm_up = getattr(model, 'warm_up', None)
+        if warm_up is not None:
+            warm_up()
+        for callback in self._callbacks:
+            callback(model)
+        self.warm_up_duration = time.perf_counter() - loaded
+
+        self.model = model
+        self.error = None
+        self.state = READY
+        self.ready_at = time.monotonic()
+        self._ready.set()
+        logger.info(f"模型已就緒（載入 {self.load_duration * 1000:.0f} ms，"
+                    f"預熱 {self.warm_up_duration * 1000:.0f} ms）")
+
+    @property
+    def ready(self) -> bool:
+        return self._ready.is_set()
+
+    def wait(self, timeout: Optional[float] = None) -> bool:
+        """等待模型就緒，回傳是否已就緒"""
+        return self._ready.wait(timeout)
+
+    def status(self) -> dict:
+        """目前的載入狀態，供 /readyz 使用"""
+        # 就緒後固定為啟動到就緒的時間
+        elapsed = (self.ready_at or time.monotonic()) - self.started_at if self.started_at is not None else 0.0
+        return {
+            'state': self.state,
+            'ready': self.ready,
+            'attempts': self.attempts,
+            'error': self.error,
+            'elapsed_ms': elapsed * 1000,
+            'load_ms': self.load_duration * 1000,
+            'warm_up_ms': self.warm_up_duration * 1000,
+            'version': getattr(self.model, 'version', None),
+        }
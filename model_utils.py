@@ -1,7 +1,26 @@
+import hashlib
+import io
 import random
+import time
 from pathlib import Path
+from types import MappingProxyType
 import json
 
+import numpy as np
+
+from PIL import Image
+
+from inference_engine import NumpyKerasModel
+from metrics import STAGE_SECONDS
+from preprocessing import Preprocessor
+
+MODEL_PATH = Path(__file__).resolve().parent / 'model' / 'model.h5'
+# convert_model.py 產生的攤平權重檔，以 mmap 載入並由所有工作行程共用
+FLAT_MODEL_PATH = Path(__file__).resolve().parent / 'model' / 'model.npkm'
+LABELS_PATH = Path(__file__).resolve().parent / 'model' / 'labels.txt'
+BATCH_SIZE = 16  # 單次前向傳播的最大張數
+INFERENCE_SECONDS = STAGE_SECONDS.labels('inference')  # 每個批次前向傳播的耗時
+
 # 風格定義
 STYLES = {
     '簡約風': {
@@ -96,7 +115,7 @@ COLOR_COMBINATIONS = {
     }
 }
 
-def load_labels(label_file='model/labels.txt'):
+def load_labels(label_file=LABELS_PATH):
     try:
         with open(label_file, 'r', encoding='utf-8') as f:
             # 讀取每一行並處理，格式應該是 "索引 類別名稱"
@@ -109,30 +128,138 @@ def load_labels(label_file='model/labels.txt'):
         print(f"無法讀取標籤文件：{str(e)}")
         return ['Class 1', 'Class 2']  # 預設標籤
 
-LABELS = load_labels()
+def model_digest(model_path):
+    """模型檔案的摘要，用來判斷快取的預測結果與攤平權重檔是否仍然有效"""
+    with open(model_path, 'rb') as f:
+        return hashlib.sha256(f.read()).hexdigest()[:16]
+
+def load_engine(model_path=MODEL_PATH, flat_path=FLAT_MODEL_PATH):
+    """
+    載入推論引擎：攤平權重檔由 python convert_model.py 事先產生，
+    其中記錄的來源摘要與 .h5 內容相符時直接 mmap，否則解析 .h5（不會寫入任何檔案）
+
+    Returns:
+        tuple: (NumpyKerasModel, 模型版本摘要)
+    """
+    model_path, flat_path = Path(model_path), Path(flat_path)
+    version = model_digest(model_path) if model_path.is_file() else None
+    if flat_path.is_file():
+        try:
+            engine = NumpyKerasModel.from_flat(flat_path)
+            source = engine.metadata.get('source_digest', '')
+            # 只有攤平權重檔時（部署不附 .h5）直接採用；否則以內容摘要而非修改時間判斷是否過期
+            if version is None or source == version:
+                return engine, source
+            print(f"攤平權重檔與 {model_path.name} 內容不符，改用 .h5；請重新執行 python convert_model.py")
+        except Exception as e:
+            print(f"無法載入攤平權重檔，改用 .h5：{str(e)}")
+    else:
+        print("找不到攤平權重檔，改用 .h5；執行 python convert_model.py 可加快啟動並讓工作行程共用權重")
+
+    return NumpyKerasModel.from_h5(model_path), version
 
 class FashionModel:
-    def __init__(self):
-        self.labels = LABELS
-        print("測試模式已啟動！")
-        
+    def __init__(self, model_path=MODEL_PATH, flat_path=FLAT_MODEL_PATH, labels_path=LABELS_PATH):
+        self.labels = load_labels(labels_path)
+        # 只載入一次權重，之後每次預測都只執行 NumPy 前向傳播
+        self.engine, self.version = load_engine(model_path, flat_path)
+        self.input_size = tuple(self.engine.input_shape[1:3])
+        height, width = self.input_size
+        self.preprocessor = Preprocessor((width, height), batch_size=BATCH_SIZE)
+        num_classes = self.engine.num_classes
+        if num_classes is not None and num_classes != len(self.labels):
+            print(f"警告：模型輸出 {num_classes} 個類別，標籤文件有 {len(self.labels)} 個")
+        print("模型已載入！")
+
+    def warm_up(self, batch_sizes=(1, BATCH_SIZE)):
+        """
+        以假資料跑過完整的解碼、前處理與前向傳播，
+        讓 mmap 權重分頁、批次緩衝區與 NumPy 暫存陣列在第一個真正的請求前就準備好
+
+        Args:
+            batch_sizes: 要預熱的批次大小
+
+        Returns:
+            float: 預熱耗時（秒）
+        """
+        start = time.perf_counter()
+        height, width = self.input_size
+        buffer = io.BytesIO()
+        Image.new('RGB', (width * 2, height * 2), (128, 128, 128)).save(buffer, format='JPEG')
+        # 假資料不計入前處理統計與 /metrics：用不記錄指標的前處理器，直接呼叫推論引擎
+        preprocessor = Preprocessor(self.preprocessor.input_size, batch_size=1, record_metrics=False)
+        batch, _, _ = preprocessor.preprocess_batch([buffer.getvalue()])
+        self.engine.predict(batch)
+        for n in batch_sizes:
+            self.engine.predict(np.zeros((n, height, width, 3), dtype=np.float32))
+        return time.perf_counter() - start
+
+    def preprocess(self, source):
+        """
+        讀取圖片並轉成模型輸入：置中裁切、縮放，並正規化到 [-1, 1]
+
+        Args:
+            source: 圖片路徑、bytes、類檔案物件，或 (H, W, 3) 的 NumPy 陣列
+        """
+        return self.preprocessor.preprocess(source)
+
+    def label_for(self, index):
+        if index < len(self.labels):
+            return self.labels[index]
+        return f'Class {index + 1}'
+
     def predict(self, img_path):
         """
-        預測圖片中的配件（測試模式）
+        預測圖片中的配件
+
+        Returns:
+            tuple: (標籤, 信心度)，信心度為 softmax 輸出的機率
         """
         try:
             # 檢查圖片是否存在
             if not Path(img_path).is_file(): 
                 raise FileNotFoundError("找不到圖片檔案")
             
-            # 測試模式：隨機返回結果
-            predicted_class = random.randint(0, len(self.labels)-1)
-            confidence = random.uniform(0.7, 0.9)
-            return self.labels[predicted_class], confidence
+            batch, _, failures = self.preprocessor.preprocess_batch([img_path])
+            if failures:
+                raise failures[0][1]
+            probs = self.engine.predict(batch)[0]
+            predicted_class = int(np.argmax(probs))
+            return self.label_for(predicted_class), float(probs[predicted_class])
         except Exception as e:
             print(f"預測時發生錯誤：{str(e)}")
             return "未知", 0.0
 
+    def predict_batch(self, images, batch_size=BATCH_SIZE):
+        """
+        一次預測多張圖片，所有圖片疊成同一個張量執行前向傳播
+
+        Args:
+            images: 圖片列表，每一項可以是路徑、bytes、類檔案物件或 NumPy 陣列
+            batch_size: 每次前向傳播最多處理的張數，用來限制記憶體用量
+
+        Returns:
+            list: 與輸入順序相同的 (標籤, 信心度)；無法處理的圖片回傳 ("未知", 0.0)
+        """
+        results = [("未知", 0.0)] * len(images)
+        for start in range(0, len(images), batch_size):
+            # 每個區塊直接寫入預先配置的連續緩衝區，不另外 np.stack
+            batch, indices, failures = self.preprocessor.preprocess_batch(images[start:start + batch_size])
+            for i, e in failures:
+                print(f"第 {start + i + 1} 張圖片讀取失敗：{str(e)}")
+            if not indices:
+                continue
+            try:
+                with INFERENCE_SECONDS.time():
+                    probs = self.engine.predict(batch)
+            except Exception as e:
+                print(f"批次預測時發生錯誤：{str(e)}")
+                continue
+            classes = probs.argmax(axis=1)
+            for i, cls, row in zip(indices, classes, probs):
+                results[start + i] = (self.label_for(int(cls)), float(row[cls]))
+        return results
+
 # 搭配建議規則
 FASHION_ITEMS = {
     '帽子': {
@@ -249,47 +376,100 @@ FASHION_ITEMS = {
     }
 }
 
-def get_style_recommendation():
+# 信心度分級（下限由高到低）
+CONFIDENCE_LEVELS = (('high', 0.7), ('medium', 0.4), ('low', float('-inf')))
+DEFAULT_BASIC_RECOMMENDATION = '無特定搭配建議'
+
+def confidence_level(confidence):
+    """信心度對應的分級：high、medium 或 low"""
+    for level, threshold in CONFIDENCE_LEVELS:
+        if confidence >= threshold:
+            return level
+    return CONFIDENCE_LEVELS[-1][0]
+
+def _compile_style_table():
     """
-    隨機生成風格搭配建議
+    預先組好每個（風格, 色系）組合的風格建議，請求時只需查表
+
+    Returns:
+        MappingProxyType: (風格, 色系) → 建議內容。內容在所有請求間共用，
+        每一層都是唯讀的 MappingProxyType / tuple，輸出 JSON 時由 app 的 JSON provider 轉成一般物件
     """
-    style = random.choice(list(STYLES.keys()))
-    color_scheme = random.choice(list(COLOR_COMBINATIONS.keys()))
-    
-    style_info = STYLES[style]
-    color_info = COLOR_COMBINATIONS[color_scheme]
-    
-    recommendation = {
-        '風格': style,
-        '風格描述': style_info['description'],
-        '主要色系': color_scheme,
-        '主色調': color_info['main_colors'],
-        '點綴色': color_info['accent_colors'],
-        '風格關鍵字': style_info['keywords'],
-        '建議單品': [],  # 將根據不同風格添加具體單品
-        '圖片參考': {
-            **style_info['images'],
-            **color_info['images']
-        }
-    }
-    
-    return recommendation
+    table = {}
+    for style, style_info in STYLES.items():
+        for color_scheme, color_info in COLOR_COMBINATIONS.items():
+            table[(style, color_scheme)] = MappingProxyType({
+                '風格': style,
+                '風格描述': style_info['description'],
+                '主要色系': color_scheme,
+                '主色調': tuple(color_info['main_colors']),
+                '點綴色': tuple(color_info['accent_colors']),
+                '風格關鍵字': tuple(style_info['keywords']),
+                '建議單品': (),  # 將根據不同風格添加具體單品
+                '圖片參考': MappingProxyType({
+                    **style_info['images'],
+                    **color_info['images']
+                })
+            })
+    return MappingProxyType(table)
 
-def get_recommendation(label, confidence):
+def _compile_basic_table():
+    """(標籤, 信心度分級) → 基本搭配建議"""
+    return MappingProxyType({(label, level): text
+                             for label, levels in FASHION_ITEMS.items()
+                             for level, text in levels.items()})
+
+STYLE_NAMES = tuple(STYLES)
+COLOR_SCHEME_NAMES = tuple(COLOR_COMBINATIONS)
+STYLE_TABLE = _compile_style_table()
+BASIC_TABLE = _compile_basic_table()
+
+def pick_by_references(options, reference_images):
     """
-    根據預測結果和信心度返回搭配建議，並加入風格推薦
+    依相似參考圖片的排名為每個選項計分（排名越前分數越高），回傳得分最高的選項
+
+    Args:
+        options: STYLES 或 COLOR_COMBINATIONS
+        reference_images: 依相似度排列的參考圖片路徑（相對於 static/）
+
+    Returns:
+        str: 選項名稱；沒有任何選項的圖片出現在 reference_images 中時回傳 None
     """
-    if confidence >= 0.7:
-        level = 'high'
-    elif confidence >= 0.4:
-        level = 'medium'
-    else:
-        level = 'low'
+    ranks = {path: len(reference_images) - i for i, path in enumerate(reference_images)}
+    best, best_score = None, 0
+    for name, info in options.items():
+        score = sum(ranks.get(path, 0) for path in info['images'].values())
+        if score > best_score:
+            best, best_score = name, score
+    return best
+
+def get_style_recommendation(reference_images=(), color_scheme=None):
+    """
+    生成風格搭配建議：依與上傳圖片相似的參考圖片挑選風格與配色，沒有相似圖片時隨機挑選。
+    建議內容在匯入時已預先組好（STYLE_TABLE），這裡只挑選組合並查表
+
+    Args:
+        reference_images: 依相似度排列的參考圖片路徑（相對於 static/）
+        color_scheme: 由上傳圖片主要顏色分析出的配色方案，有指定時優先使用
+    """
+    style = pick_by_references(STYLES, reference_images) or random.choice(STYLE_NAMES)
+    if color_scheme not in COLOR_COMBINATIONS:
+        color_scheme = (pick_by_references(COLOR_COMBINATIONS, reference_images)
+                        or random.choice(COLOR_SCHEME_NAMES))
+    return STYLE_TABLE[(style, color_scheme)]
+
+def get_recommendation(label, confidence, reference_images=(), color_scheme=None):
+    """
+    根據預測結果和信心度返回搭配建議，並加入風格推薦
+
+    Args:
+        reference_images: 與上傳圖片相似的參考圖片（相對於 static/），用來挑選風格與配色
+        color_scheme: 上傳圖片主要顏色對應的配色方案（見 color_analysis）
 
-    basic_recommendation = FASHION_ITEMS.get(label, {}).get(level, '無特定搭配建議')
-    style_recommendation = get_style_recommendation()
-    
+    Returns:
+        dict: basic（基本搭配建議）與 style（風格建議，來自 STYLE_TABLE 的唯讀 MappingProxyType）
+    """
     return {
-        'basic': basic_recommendation,
-        'style': style_recommendation
+        'basic': BASIC_TABLE.get((label, confidence_level(confidence)), DEFAULT_BASIC_RECOMMENDATION),
+        'style': get_style_recommendation(reference_images, color_scheme)
     }
@@ -0,0 +1,108 @@
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+class PredictionCache:
+    def __init__(self, max_entries: int = 4096, persist_path: Optional[str] = None,
+                 namespace: str = '', persist_interval: float = 30.0):
+        """
+        以圖片摘要為鍵的預測結果快取（LRU）
+
+        Args:
+            max_entries: 最多保留的筆數，超過時淘汰最久未使用的項目
+            persist_path: 保存到磁碟的 JSON 路徑，None 表示只存在記憶體
+            namespace: 模型版本識別碼，模型更換後舊的快取會被捨棄
+            persist_interval: 兩次寫入磁碟之間的最短間隔（秒）
+        """
+        self.max_entries = max_entries
+        self.persist_path = persist_path
+        self.namespace = namespace
+        self.persist_interval = persist_interval
+        self._entries: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+        self._dirty = False
+        self._last_save = time.monotonic()
+
+        # 統計資料
+        self.hits = 0
+        self.misses = 0
+
+        if persist_path:
+            self.load()
+
+    def get(self, digest: str) -> Optional[Tuple[str, float]]:
+        """查詢快取，命中時回傳 (標籤, 信心度)"""
+        with self._lock:
+            entry = self._entries.get(digest)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(digest)
+            self.hits += 1
+            return entry
+
+    def put(self, digest: str, label: str, confidence: float) -> None:
+        """寫入一筆預測結果"""
+        with self._lock:
+            self._entries[digest] = (label, float(confidence))
+            self._entries.move_to_end(digest)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+            self._dirty = True
+            should_save = (self.persist_path is not None
+                           and time.monotonic() - self._last_save >= self.persist_interval)
+        if should_save:
+            self.save()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __contains__(self, digest: str) -> bool:
+        return digest in self._entries
+
+    def load(self) -> None:
+        """從磁碟載入快取；檔案不存在、損毀或模型版本不同時從空白開始"""
+        if not self.persist_path or not os.path.exists(self.persist_path):
+            return
+        try:
+            with open(self.persist_path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            if data.get('namespace') != self.namespace:
+                logger.info("模型版本已變更，捨棄舊的預測快取")
+                return
+            with self._lock:
+                for digest, label, confidence in data.get('entries', [])[-self.max_entries:]:
+                    self._entries[digest] = (label, float(confidence))
+            logger.info(f"已載入 {len(self._entries)} 筆預測快取")
+        except Exception as e:
+            logger.error(f"讀取預測快取時發生錯誤：{str(e)}")
+
+    def save(self) -> None:
+        """將快取寫入磁碟（先寫暫存檔再改名）"""
+        if not self.persist_path:
+            return
+        with self._lock:
+            if not self._dirty:
+                return
+            entries = [[digest, label, confidence] for digest, (label, confidence) in self._entries.items()]
+            self._dirty = False
+            self._last_save = time.monotonic()
+        try:
+            folder = os.path.dirname(os.path.abspath(self.persist_path))
+            os.makedirs(folder, exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(dir=folder, suffix='.tmp')
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                json.dump({'namespace': self.namespace, 'entries': entries}, f, ensure_ascii=False)
+            os.replace(tmp_path, self.persist_path)
+        except Exception as e:
+            logger.error(f"保存預測快取時發生錯誤：{str(e)}")
+            with self._lock:
+                self._dirty = True
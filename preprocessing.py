@@ -0,0 +1,184 @@
+import threading
+import time
+from typing import Any, List, Optional, Tuple
+
+import numpy as np
+from PIL import Image
+
+from image_io import open_image
+from metrics import STAGE_SECONDS
+
+# 各階段名稱，依執行順序排列
+STAGES = ('decode', 'resize', 'normalize')
+
+
+class PreprocessTimings:
+    def __init__(self, record_metrics: bool = True):
+        """
+        累計各前處理階段的耗時，同時記錄到 /metrics 的階段直方圖
+
+        Args:
+            record_metrics: 是否記錄到 /metrics；離線工作（例如建立索引）不應計入請求的延遲分佈
+        """
+        self._lock = threading.Lock()
+        self.totals = dict.fromkeys(STAGES, 0.0)
+        self.counts = dict.fromkeys(STAGES, 0)
+        self._histograms = {stage: STAGE_SECONDS.labels(stage) for stage in STAGES} if record_metrics else {}
+
+    def add(self, **seconds: float) -> None:
+        """
+        記錄一張圖片各階段的耗時；已經解碼好的像素陣列只會有 normalize
+
+        Args:
+            seconds: 階段名稱 → 耗時（秒）
+        """
+        for stage, value in seconds.items():
+            if stage in self._histograms:
+                self._histograms[stage].observe(value)
+        with self._lock:
+            for stage, value in seconds.items():
+                self.totals[stage] += value
+                self.counts[stage] += 1
+
+    @property
+    def count(self) -> int:
+        """完成前處理的張數"""
+        return self.counts['normalize']
+
+    def snapshot(self) -> dict:
+        """
+        Returns:
+            dict: 處理張數，以及每個階段每張圖片的平均耗時（毫秒）
+        """
+        with self._lock:
+            counts = dict(self.counts)
+            totals = dict(self.totals)
+        result = {'count': counts['normalize']}
+        for stage in STAGES:
+            result[f'{stage}_ms'] = totals[stage] / counts[stage] * 1000 if counts[stage] else 0.0
+        return result
+
+    def reset(self) -> None:
+        with self._lock:
+            self.totals = dict.fromkeys(STAGES, 0.0)
+            self.counts = dict.fromkeys(STAGES, 0)
+
+
+class Preprocessor:
+    def __init__(self, input_size: Tuple[int, int], batch_size: int = 16, record_metrics: bool = True):
+        """
+        模型輸入前處理：解碼 → 置中裁切縮放 → 正規化到 [-1, 1]
+
+        每個執行緒各自擁有一塊預先配置的 float32 批次緩衝區，
+        圖片直接寫入緩衝區中對應的位置，整個批次是一塊連續記憶體，不需要再 np.stack。
+
+        Args:
+            input_size: 模型輸入尺寸 (寬, 高)
+            batch_size: 緩衝區初始可容納的張數
+            record_metrics: 是否把各階段耗時記錄到 /metrics
+        """
+        self.input_size = tuple(input_size)
+        self.batch_size = batch_size
+        self.timings = PreprocessTimings(record_metrics)
+        self._local = threading.local()
+
+    def _buffer(self, n: int) -> np.ndarray:
+        """取得目前執行緒的批次緩衝區，容量不足時才重新配置"""
+        buffer = getattr(self._local, 'buffer', None)
+        if buffer is None or buffer.shape[0] < n:
+            width, height = self.input_size
+            buffer = np.empty((max(n, self.batch_size), height, width, 3), dtype=np.float32)
+            self._local.buffer = buffer
+        return buffer
+
+    def _crop_box(self, size: Tuple[int, int]) -> Tuple[float, float, float, float]:
+        """計算置中裁切的範圍（與 ImageOps.fit 相同的比例）"""
+        width, height = size
+        target_ratio = self.input_size[0] / self.input_size[1]
+        if width / height > target_ratio:
+            crop_width = height * target_ratio
+            left = (width - crop_width) / 2
+            return left, 0, left + crop_width, height
+        crop_height = width / target_ratio
+        top = (height - crop_height) / 2
+        return 0, top, width, top + crop_height
+
+    def decode(self, source: Any) -> np.ndarray:
+        """
+        解碼並置中裁切縮放到模型輸入尺寸，不做正規化
+
+        回傳的 uint8 像素陣列可以再交給 fill / preprocess_batch（只剩正規化），
+        也可以給色彩分析、相似圖片檢索等其他階段共用，圖片只需要解碼一次。
+
+        Args:
+            source: bytes、圖片路徑、類檔案物件或 NumPy 陣列
+
+        Returns:
+            np.ndarray: (高, 寬, 3) 的 uint8 陣列
+        """
+        start = time.perf_counter()
+        if isinstance(source, np.ndarray):
+            img = Image.fromarray(np.asarray(source, dtype=np.uint8)).convert('RGB')
+        else:
+            img = open_image(source, self.input_size)
+        decoded = time.perf_counter()
+
+        # 以 box 參數直接在裁切範圍內縮放，省去一次裁切複製
+        img = img.resize(self.input_size, Image.Resampling.LANCZOS,
+                         box=self._crop_box(img.size), reducing_gap=3.0)
+        pixels = np.asarray(img)
+        self.timings.add(decode=decoded - start, resize=time.perf_counter() - decoded)
+        return pixels
+
+    def fill(self, source: Any, out: np.ndarray) -> None:
+        """
+        處理一張圖片並寫入 out（形狀為 (高, 寬, 3) 的 float32 陣列）
+
+        Args:
+            source: bytes、圖片路徑、類檔案物件或 NumPy 陣列；
+                    decode() 產生的 uint8 陣列只需要正規化
+        """
+        prepared = isinstance(source, np.ndarray) and source.shape == out.shape
+        if prepared and source.dtype == np.float32:
+            # 已經是模型輸入格式
+            out[...] = source
+            return
+        pixels = source if prepared and source.dtype == np.uint8 else self.decode(source)
+
+        start = time.perf_counter()
+        np.multiply(pixels, np.float32(1 / 127.5), out=out)
+        out -= 1.0
+        self.timings.add(normalize=time.perf_counter() - start)
+
+    def preprocess(self, source: Any) -> np.ndarray:
+        """處理一張圖片，回傳獨立的 (高, 寬, 3) 陣列"""
+        width, height = self.input_size
+        out = np.empty((height, width, 3), dtype=np.float32)
+        self.fill(source, out)
+        return out
+
+    def preprocess_batch(self, sources: List[Any], out: Optional[np.ndarray] = None
+                         ) -> Tuple[np.ndarray, List[int], List[Tuple[int, Exception]]]:
+        """
+        將多張圖片依序寫入同一塊連續的批次緩衝區
+
+        回傳的陣列是緩衝區的一部分，同一執行緒下一次呼叫時會被覆寫，
+        必須在那之前用完（例如立即送入模型）。
+
+        Args:
+            sources: 圖片列表
+            out: 指定寫入的緩衝區（例如共享記憶體），形狀為 (N, 高, 寬, 3)；None 時使用執行緒自己的緩衝區
+
+        Returns:
+            tuple: (批次陣列, 成功的輸入索引, [(失敗的輸入索引, 例外)])
+        """
+        buffer = self._buffer(len(sources)) if out is None else out
+        indices = []
+        failures = []
+        for i, source in enumerate(sources):
+            try:
+                self.fill(source, buffer[len(indices)])
+                indices.append(i)
+            except Exception as e:
+                failures.append((i, e))
+        return buffer[:len(indices)], indices, failures
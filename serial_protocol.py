@@ -0,0 +1,126 @@
+"""
+Arduino 串口協定
+
+文字協定（預設）：每個命令一行 UTF-8 文字，例如 "CONF:85\\n"、"BUSY\\n"、"STYLE:2\\n"。
+
+二進位封包協定（連線時協商）：
+    SYNC(0xA5) | SEQ | TYPE << 4 | LEN | PAYLOAD(LEN bytes) | CRC-8
+  - SEQ：0-255 循環的序號，ACK 以 PAYLOAD 帶回被確認的序號
+  - LEN：0-15，PAYLOAD 的長度
+  - CRC-8（多項式 0x07）涵蓋 SEQ 到 PAYLOAD
+協商方式：主機送出 "BIN?\\n"，支援封包模式的設備回覆 "BIN:1\\n" 並切換到封包模式；
+舊韌體不回應，主機逾時後繼續使用文字協定。
+"""
+from typing import List, Optional, Tuple
+
+SYNC = 0xA5
+HEADER_SIZE = 3  # SYNC、SEQ、TYPE/LEN
+MAX_PAYLOAD = 15
+FRAME_OVERHEAD = HEADER_SIZE + 1  # 加上 CRC
+
+HELLO = b'BIN?\n'
+HELLO_REPLY = b'BIN:1'
+
+# 封包類型：主機 → 設備
+FRAME_CONF = 0x1
+FRAME_STATUS = 0x2
+# 封包類型：設備 → 主機
+FRAME_STYLE = 0x8
+FRAME_CONFIRM = 0x9
+# 雙向
+FRAME_ACK = 0xF
+
+# 命令類型對應的封包類型
+COMMAND_FRAMES = {
+    'CONF': FRAME_CONF,
+    'STATUS': FRAME_STATUS,
+}
+
+
+def _build_crc8_table() -> List[int]:
+    table = []
+    for byte in range(256):
+        crc = byte
+        for _ in range(8):
+            crc = ((crc << 1) ^ 0x07) & 0xFF if crc & 0x80 else (crc << 1) & 0xFF
+        table.append(crc)
+    return table
+
+
+_CRC8_TABLE = _build_crc8_table()
+
+
+def crc8(data: bytes) -> int:
+    crc = 0
+    for byte in data:
+        crc = _CRC8_TABLE[crc ^ byte]
+    return crc
+
+
+def encode_text(kind: str, value: int) -> bytes:
+    """文字協定的命令"""
+    if kind == 'CONF':
+        return f"CONF:{value}\n".encode('utf-8')
+    if kind == 'STATUS':
+        return b"BUSY\n" if value else b"READY\n"
+    raise ValueError(f"未知的命令類型: {kind}")
+
+
+def encode_frame(seq: int, frame_type: int, payload: bytes = b'') -> bytes:
+    """組出一個完整的封包"""
+    if len(payload) > MAX_PAYLOAD:
+        raise ValueError(f"封包內容過長: {len(payload)} bytes")
+    body = bytes((seq & 0xFF, (frame_type << 4) | len(payload))) + payload
+    return bytes((SYNC,)) + body + bytes((crc8(body),))
+
+
+def encode_command(seq: int, kind: str, value: int) -> bytes:
+    """封包協定的命令"""
+    return encode_frame(seq, COMMAND_FRAMES[kind], bytes((value & 0xFF,)))
+
+
+class FrameDecoder:
+    def __init__(self):
+        """從位元組串流中切出完整的封包；遇到錯誤的 CRC 時往後找下一個 SYNC 重新同步"""
+        self.buffer = bytearray()
+        self.corrupt_frames = 0
+
+    def feed(self, data: bytes) -> List[Tuple[int, int, bytes]]:
+        """
+        加入收到的資料
+
+        Returns:
+            list: 完整封包的 (序號, 類型, 內容)
+        """
+        self.buffer.extend(data)
+        frames = []
+        while True:
+            frame = self._next_frame()
+            if frame is None:
+                return frames
+            frames.append(frame)
+
+    def _next_frame(self) -> Optional[Tuple[int, int, bytes]]:
+        buffer = self.buffer
+        while buffer:
+            start = buffer.find(SYNC)
+            if start < 0:
+                buffer.clear()
+                return None
+            if start:
+                del buffer[:start]
+            if len(buffer) < HEADER_SIZE:
+                return None
+            length = buffer[2] & 0x0F
+            size = FRAME_OVERHEAD + length
+            if len(buffer) < size:
+                return None
+            body = bytes(buffer[1:size - 1])
+            if crc8(body) != buffer[size - 1]:
+                # 不是真正的封包開頭（或資料損毀），略過這個 SYNC
+                self.corrupt_frames += 1
+                del buffer[:1]
+                continue
+            del buffer[:size]
+            return body[0], body[1] >> 4, body[2:]
+        return None
@@ -0,0 +1,91 @@
+import hashlib
+import logging
+import os
+from typing import Dict, Optional, Tuple
+
+from flask import request
+from werkzeug.security import safe_join
+
+logger = logging.getLogger(__name__)
+
+FINGERPRINT_PARAM = 'v'
+FINGERPRINT_LENGTH = 12
+IMMUTABLE_MAX_AGE = 365 * 24 * 3600  # 帶指紋的網址內容永遠不變，可以快取一年
+
+
+class StaticFingerprints:
+    def __init__(self, app=None):
+        """
+        靜態檔案內容指紋
+
+        url_for('static', ...) 產生的網址會自動加上內容摘要（?v=...），
+        帶有正確摘要的請求回應 immutable 長效快取；檔案內容改變時網址也跟著改變。
+        未帶摘要或摘要過期的請求仍可透過 ETag 取得 304。
+        """
+        self.static_folder: Optional[str] = None
+        self._cache: Dict[str, Tuple[int, int, str]] = {}
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app) -> None:
+        self.static_folder = app.static_folder
+        app.url_defaults(self._add_fingerprint)
+        app.after_request(self._set_cache_headers)
+
+    def fingerprint(self, filename: str) -> Optional[str]:
+        """
+        計算靜態檔案的內容摘要；依檔案的修改時間與大小快取，內容改變時重新計算
+
+        Returns:
+            str: 摘要前 FINGERPRINT_LENGTH 個字元，檔案不存在時為 None
+        """
+        path = safe_join(self.static_folder, filename)
+        if path is None:
+            return None
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return None
+        cached = self._cache.get(filename)
+        if cached and cached[0] == stat.st_mtime_ns and cached[1] == stat.st_size:
+            return cached[2]
+
+        hasher = hashlib.sha256()
+        try:
+            with open(path, 'rb') as f:
+                for chunk in iter(lambda: f.read(64 * 1024), b''):
+                    hasher.update(chunk)
+        except OSError as e:
+            logger.error(f"計算靜態檔案摘要時發生錯誤：{str(e)}")
+            return None
+        digest = hasher.hexdigest()[:FINGERPRINT_LENGTH]
+        self._cache[filename] = (stat.st_mtime_ns, stat.st_size, digest)
+        return digest
+
+    def _add_fingerprint(self, endpoint, values) -> None:
+        """url_for('static', filename=...) 自動加上 ?v=摘要"""
+        if endpoint != 'static' or FINGERPRINT_PARAM in values:
+            return
+        filename = values.get('filename')
+        if not filename:
+            return
+        digest = self.fingerprint(filename)
+        if digest:
+            values[FINGERPRINT_PARAM] = digest
+
+    def _set_cache_headers(self, response):
+        if request.endpoint != 'static' or response.status_code not in (200, 304):
+            return response
+        requested = request.args.get(FINGERPRINT_PARAM)
+        filename = (request.view_args or {}).get('filename')
+        if requested and filename and requested == self.fingerprint(filename):
+            response.cache_control.no_cache = None
+            response.cache_control.public = True
+            response.cache_control.max_age = IMMUTABLE_MAX_AGE
+            response.cache_control.immutable = True
+        else:
+            # 沒有指紋的網址：每次都要向伺服器確認，但內容未變時只回 304
+            response.cache_control.public = True
+            response.cache_control.no_cache = True
+            response.cache_control.max_age = 0
+        return response
@@ -0,0 +1,245 @@
+"""
+整合測試：以虛擬 Arduino（PTY）驅動 ArduinoController，以及網頁應用的准入控制回應（413、429、503）
+
+網頁應用的測試會載入 model/ 中的模型，不開啟串口，推論在測試行程內執行。
+
+執行：python -m pytest -q test.py
+"""
+import io
+import os
+import time
+
+import numpy as np
+import pytest
+from PIL import Image
+
+# 必須在匯入 app 之前設定：不開啟 Arduino 串口，也不啟動推論工作行程
+os.environ.setdefault('FASHION_ARDUINO', '0')
+os.environ.setdefault('FASHION_INFERENCE_WORKERS', '0')
+
+from admission import AdmissionController, RateLimiter
+from arduino_controller import ArduinoController
+from serial_protocol import FRAME_STYLE, encode_frame
+
+MODEL_READY_TIMEOUT = 120.0
+
+
+def wait_for(predicate, timeout=5.0, interval=0.01):
+    """輪詢直到 predicate() 成立；逾時回傳 False"""
+    deadline = time.monotonic() + timeout
+    while not predicate():
+        if time.monotonic() > deadline:
+            return False
+        time.sleep(interval)
+    return True
+
+
+# ---- 虛擬 Arduino ----
+
+@pytest.fixture
+def arduino(tmp_path):
+    """
+    回傳 start(framed, ack_loss, **callbacks)：啟動虛擬 Arduino 並以 ArduinoController 連上，
+    測試結束時兩者都會關閉
+    """
+    simulator = pytest.importorskip('arduino_simulator', reason='虛擬 Arduino 需要 POSIX 虛擬終端')
+    created = []
+
+    def start(framed=True, ack_loss=0.0, **callbacks):
+        device = simulator.VirtualArduino(str(tmp_path / 'arduino'), baudrate=115200,
+                                          framed=framed, ack_loss=ack_loss)
+        device.start()
+        controller = ArduinoController(device.port, baudrate=115200, framed=framed)
+        controller.register_callbacks(**callbacks)
+        created.append((device, controller))
+        assert controller.connect()
+        return device, controller
+
+    yield start
+    for device, controller in created:
+        controller.disconnect()
+        device.stop()
+
+
+def test_text_protocol_coalesces_updates(arduino):
+    device, controller = arduino(framed=False)
+    assert controller.protocol == 'text'
+    controller.write_interval = 0.5
+
+    controller.set_confidence(1)
+    assert wait_for(lambda: device.confidence == 1)
+    received = device.commands_received
+
+    # 寫入間隔內的更新合併成一次寫入，只送出每種命令的最新值
+    for value in range(2, 22):
+        controller.set_confidence(value)
+    controller.set_status(True)
+    assert wait_for(lambda: device.confidence == 21 and device.busy is True)
+    stats = controller.stats()
+    assert stats['submitted'] == 22
+    assert stats['merged'] == 19
+    assert device.commands_received - received == 2
+    assert stats['writes'] == 2
+
+    # 與設備目前顯示相同的值不再送出
+    controller.set_confidence(21)
+    assert wait_for(lambda: controller.stats()['unchanged'] == 1)
+    time.sleep(controller.write_interval + 0.1)
+    assert device.commands_received - received == 2
+
+
+def test_binary_protocol_skips_corrupt_frames(arduino):
+    styles, confirms = [], []
+    device, controller = arduino(framed=True, style_cb=styles.append, confirm_cb=lambda: confirms.append(True))
+    assert controller.protocol == 'binary'
+    assert wait_for(lambda: device.protocol == 'binary')
+
+    controller.set_confidence(85)
+    assert wait_for(lambda: device.confidence == 85 and controller.stats()['acked'] == 1)
+    assert controller.stats()['rtt']['CONF']['count'] == 1
+
+    # CRC 錯誤的封包被略過，之後的封包照常分派並回覆 ACK
+    corrupted = bytearray(encode_frame(200, FRAME_STYLE, bytes((4,))))
+    corrupted[-1] ^= 0xFF
+    os.write(device.master, bytes(corrupted))
+    device.inject_style(3)
+    device.inject_confirm()
+    assert wait_for(lambda: styles == [3] and confirms == [True])
+    assert controller.stats()['corrupt_frames'] >= 1
+    assert wait_for(lambda: device.event_acks == 2)
+
+
+def test_binary_protocol_retransmits_unacknowledged_frames(arduino):
+    device, controller = arduino(framed=True, ack_loss=1.0)
+    controller.ack_timeout = 0.05
+
+    # 一直沒有 ACK：重送 max_retransmits 次後放棄
+    controller.set_confidence(42)
+    assert wait_for(lambda: controller.stats()['dropped'] == 1)
+    stats = controller.stats()
+    assert stats['retransmits'] == controller.max_retransmits
+    assert stats['acked'] == 0 and stats['inflight'] == 0
+    assert device.acks_dropped == controller.max_retransmits + 1
+
+    # ACK 遺失後恢復：重送的封包被確認，放棄過的值也會再次送出
+    controller.set_confidence(43)
+    assert wait_for(lambda: controller.stats()['retransmits'] > stats['retransmits'])
+    device.ack_loss = 0.0
+    assert wait_for(lambda: device.confidence == 43 and controller.stats()['acked'] == 1)
+    controller.set_confidence(42)
+    assert wait_for(lambda: device.confidence == 42 and controller.stats()['acked'] == 2)
+    assert controller.stats()['dropped'] == 1
+
+
+def test_controller_reconnects_and_replays_state(arduino):
+    events = []
+    device, controller = arduino(framed=True, connection_cb=events.append)
+    controller.reconnect_interval = 0.05
+    controller.set_confidence(60)
+    controller.set_status(False)
+    assert wait_for(lambda: device.confidence == 60 and device.busy is False)
+
+    replayed = []
+    device.on_command = lambda kind, value, received_at: replayed.append((kind, value))
+    device.drop_connection(down_time=0.2)
+    assert wait_for(lambda: events == [True, False, True])
+    # 重新連線時重新協商封包協定，並重送最後要求的狀態
+    assert controller.protocol == 'binary'
+    assert wait_for(lambda: sorted(replayed) == [('CONF', 60), ('STATUS', 0)])
+
+    controller.set_confidence(61)
+    assert wait_for(lambda: device.confidence == 61)
+    assert device.stats()['disconnects'] == 1
+
+
+# ---- 網頁應用的准入控制 ----
+
+@pytest.fixture(scope='module')
+def web():
+    import app as web
+
+    if not web.model_loader.wait(MODEL_READY_TIMEOUT):
+        pytest.skip(f'模型未就緒（{web.model_loader.state}）')
+    # 測試的預測結果不寫入 instance/
+    web.prediction_cache.persist_path = None
+    return web
+
+
+@pytest.fixture
+def client(web):
+    return web.app.test_client()
+
+
+def jpeg(seed):
+    pixels = np.random.default_rng(seed).integers(0, 256, size=(64, 64, 3), dtype=np.uint8)
+    buffer = io.BytesIO()
+    Image.fromarray(pixels).save(buffer, 'JPEG')
+    return buffer.getvalue()
+
+
+def post_image(client, seed, path='/api/v1/predict'):
+    return client.post(path, data=jpeg(seed), content_type='image/jpeg')
+
+
+def test_predict_returns_result(client):
+    response = post_image(client, 1)
+    assert response.status_code == 200
+    result = response.get_json()
+    assert {'label', 'confidence', 'colors', 'recommendation'} <= set(result)
+
+
+def test_rate_limited_client_gets_429(web, client, monkeypatch):
+    monkeypatch.setattr(web, 'rate_limiter', RateLimiter(rate=0.5, burst=1))
+    assert post_image(client, 2).status_code == 200
+    response = post_image(client, 3)
+    assert response.status_code == 429
+    assert response.headers['Retry-After'] == '2'
+    assert 'error' in response.get_json()
+
+
+def test_full_queue_gets_503(web, client, monkeypatch):
+    admission = AdmissionController(max_active=1, max_waiting=0, max_wait=1.0, retry_after=3)
+    monkeypatch.setattr(web, 'admission', admission)
+    admission.enter()
+    response = post_image(client, 4)
+    assert response.status_code == 503
+    assert response.headers['Retry-After'] == '3'
+    assert admission.stats()['shed']['queue_full'] == 1
+
+    # 主頁以 HTML 顯示同樣的錯誤
+    response = client.post('/', data={'file': (io.BytesIO(jpeg(5)), 'a.jpg')}, content_type='multipart/form-data')
+    assert response.status_code == 503 and response.mimetype == 'text/html'
+
+    # 空位釋放後恢復，請求結束時歸還空位
+    admission.leave()
+    assert post_image(client, 6).status_code == 200
+    assert admission.active == 0
+
+
+def test_queue_timeout_gets_503(web, client, monkeypatch):
+    admission = AdmissionController(max_active=1, max_waiting=1, max_wait=0.05)
+    monkeypatch.setattr(web, 'admission', admission)
+    admission.enter()
+    response = post_image(client, 7)
+    assert response.status_code == 503
+    assert admission.stats()['shed']['timeout'] == 1
+    admission.leave()
+
+
+def test_oversized_upload_gets_413(web, client, monkeypatch):
+    monkeypatch.setattr(web, 'MAX_REQUEST_BYTES', 100)
+    response = post_image(client, 8)
+    assert response.status_code == 413
+    assert 'error' in response.get_json()
+
+
+def test_batch_inference_failure_gets_json_503(web, client, monkeypatch):
+    def fail(images):
+        raise RuntimeError('worker crashed')
+
+    monkeypatch.setattr(web.inference, 'predict_batch', fail)
+    response = client.post('/api/predict_batch', data={'files': [(io.BytesIO(jpeg(9)), 'a.jpg')]},
+                           content_type='multipart/form-data')
+    assert response.status_code == 503
+    assert 'worker crashed' in response.get_json()['error']
+    assert web.admission.active == 0
@@ -0,0 +1,473 @@
+"""
+不需要模型檔、網路或串口的單元測試：推論引擎運算、封包協定、預測快取、上傳目錄清理與准入控制
+
+執行：python -m pytest -q test_simple.py
+"""
+import asyncio
+import json
+import math
+import os
+import threading
+import time
+
+import numpy as np
+import pytest
+
+from admission import AdmissionController, Overloaded, RateLimiter
+from inference_engine import NumpyKerasModel
+from prediction_cache import PredictionCache
+from serial_protocol import FRAME_ACK, FRAME_CONF, FRAME_STYLE, FrameDecoder, crc8, encode_frame
+from upload_storage import PARTIAL_FILE_MAX_AGE, UploadStorage
+
+
+# ---- 推論引擎：與逐點計算的參考實作比較 ----
+
+def reference_pad(x, ksize, strides, padding):
+    """TensorFlow 的 'same'：輸出尺寸為 ceil(輸入 / 步長)，多出的一格補在後面"""
+    if padding != 'same':
+        return x
+    pads = []
+    for size, kernel, stride in zip(x.shape[1:3], ksize, strides):
+        total = max((math.ceil(size / stride) - 1) * stride + kernel - size, 0)
+        pads.append((total // 2, total - total // 2))
+    return np.pad(x, ((0, 0), *pads, (0, 0)))
+
+
+def reference_conv(x, kernel, bias, strides, padding):
+    """逐個輸出位置計算的一般卷積"""
+    kh, kw = kernel.shape[:2]
+    sh, sw = strides
+    x = reference_pad(x, (kh, kw), strides, padding)
+    n, h, w, _ = x.shape
+    oh, ow = (h - kh) // sh + 1, (w - kw) // sw + 1
+    out = np.zeros((n, oh, ow, kernel.shape[3]))
+    for i in range(oh):
+        for j in range(ow):
+            window = x[:, i * sh:i * sh + kh, j * sw:j * sw + kw, :]
+            out[:, i, j, :] = np.tensordot(window, kernel, axes=([1, 2, 3], [0, 1, 2]))
+    return out + (bias if bias is not None else 0)
+
+
+def reference_depthwise(x, kernel, bias, strides, padding):
+    """逐個輸出位置計算的逐通道卷積（depth_multiplier = 1）"""
+    kh, kw = kernel.shape[:2]
+    sh, sw = strides
+    x = reference_pad(x, (kh, kw), strides, padding)
+    n, h, w, c = x.shape
+    oh, ow = (h - kh) // sh + 1, (w - kw) // sw + 1
+    out = np.zeros((n, oh, ow, c))
+    for i in range(oh):
+        for j in range(ow):
+            window = x[:, i * sh:i * sh + kh, j * sw:j * sw + kw, :]
+            out[:, i, j, :] = (window * kernel[:, :, :, 0]).sum(axis=(1, 2))
+    return out + (bias if bias is not None else 0)
+
+
+def reference_batchnorm(x, gamma, beta, mean, var, eps=1e-3):
+    return (x - mean) / np.sqrt(var + eps) * gamma + beta
+
+
+def layer(class_name, **config):
+    return {'class_name': class_name, 'config': config}
+
+
+def batchnorm_weights(rng, name, channels):
+    return {
+        (name, 'gamma'): rng.uniform(0.5, 1.5, channels).astype(np.float32),
+        (name, 'beta'): rng.normal(size=channels).astype(np.float32),
+        (name, 'moving_mean'): rng.normal(size=channels).astype(np.float32),
+        (name, 'moving_variance'): rng.uniform(0.5, 2.0, channels).astype(np.float32),
+    }
+
+
+def build_sequential(rng, input_shape=(9, 9, 3)):
+    """Conv → BN → ReLU → 補零 → DepthwiseConv → BN → ReLU6 → Conv 1x1 → GAP → Dense softmax"""
+    channels = input_shape[2]
+    config = layer('Sequential', name='tiny', layers=[
+        layer('InputLayer', name='input', batch_input_shape=[None, *input_shape]),
+        layer('Conv2D', name='conv', filters=4, strides=[1, 1], padding='same', activation='linear'),
+        layer('BatchNormalization', name='bn', epsilon=1e-3),
+        layer('ReLU', name='relu'),
+        layer('ZeroPadding2D', name='pad', padding=[[1, 2], [2, 1]]),
+        layer('DepthwiseConv2D', name='dw', strides=[2, 2], padding='valid', use_bias=False, activation='linear'),
+        layer('BatchNormalization', name='dw_bn', epsilon=1e-3),
+        layer('ReLU', name='relu6', max_value=6.0),
+        layer('Conv2D', name='project', filters=5, strides=[1, 1], padding='valid', activation='linear'),
+        layer('GlobalAveragePooling2D', name='gap'),
+        layer('Dropout', name='dropout', rate=0.5),
+        layer('Dense', name='fc', units=3, activation='softmax'),
+    ])
+    weights = {
+        ('conv', 'kernel'): rng.normal(size=(3, 3, channels, 4)).astype(np.float32),
+        ('conv', 'bias'): rng.normal(size=4).astype(np.float32),
+        ('dw', 'depthwise_kernel'): rng.normal(size=(3, 3, 4, 1)).astype(np.float32),
+        ('project', 'kernel'): rng.normal(size=(1, 1, 4, 5)).astype(np.float32),
+        ('project', 'bias'): rng.normal(size=5).astype(np.float32),
+        # 權重較小，softmax 不會飽和，前面各層的誤差都會反映在輸出上
+        ('fc', 'kernel'): (rng.normal(size=(5, 3)) * 0.1).astype(np.float32),
+        ('fc', 'bias'): rng.normal(size=3).astype(np.float32),
+    }
+    weights.update(batchnorm_weights(rng, 'bn', 4))
+    weights.update(batchnorm_weights(rng, 'dw_bn', 4))
+    return config, weights
+
+
+def reference_sequential(x, w):
+    bn = [w[('bn', key)] for key in ('gamma', 'beta', 'moving_mean', 'moving_variance')]
+    dw_bn = [w[('dw_bn', key)] for key in ('gamma', 'beta', 'moving_mean', 'moving_variance')]
+    x = reference_conv(x, w[('conv', 'kernel')], w[('conv', 'bias')], (1, 1), 'same')
+    x = np.maximum(reference_batchnorm(x, *bn), 0)
+    x = np.pad(x, ((0, 0), (1, 2), (2, 1), (0, 0)))
+    x = reference_depthwise(x, w[('dw', 'depthwise_kernel')], None, (2, 2), 'valid')
+    x = np.clip(reference_batchnorm(x, *dw_bn), 0, 6)
+    x = reference_conv(x, w[('project', 'kernel')], w[('project', 'bias')], (1, 1), 'valid')
+    logits = x.mean(axis=(1, 2)) @ w[('fc', 'kernel')] + w[('fc', 'bias')]
+    exp = np.exp(logits - logits.max(axis=1, keepdims=True))
+    return exp / exp.sum(axis=1, keepdims=True)
+
+
+@pytest.mark.parametrize('size, kernel, stride, padding', [
+    (7, 3, 1, 'same'),
+    (8, 3, 2, 'same'),
+    (7, 3, 2, 'same'),
+    (9, 3, 2, 'valid'),
+    (6, 1, 2, 'valid'),
+    (5, 5, 1, 'same'),
+])
+def test_conv_matches_reference(size, kernel, stride, padding):
+    rng = np.random.default_rng(size * 31 + kernel)
+    config = layer('Sequential', name='conv_only', layers=[
+        layer('InputLayer', name='input', batch_input_shape=[None, size, size, 3]),
+        layer('Conv2D', name='conv', filters=4, strides=[stride, stride], padding=padding, activation='relu'),
+    ])
+    weights = {
+        ('conv', 'kernel'): rng.normal(size=(kernel, kernel, 3, 4)).astype(np.float32),
+        ('conv', 'bias'): rng.normal(size=4).astype(np.float32),
+    }
+    x = rng.normal(size=(2, size, size, 3)).astype(np.float32)
+    expected = np.maximum(reference_conv(x, weights[('conv', 'kernel')], weights[('conv', 'bias')],
+                                         (stride, stride), padding), 0)
+    result = NumpyKerasModel.from_config(config, weights).predict(x)
+    np.testing.assert_allclose(result, expected, rtol=1e-4, atol=1e-4)
+
+
+@pytest.mark.parametrize('size, stride, padding', [(7, 1, 'same'), (8, 2, 'same'), (7, 2, 'same'), (9, 2, 'valid')])
+def test_depthwise_matches_reference(size, stride, padding):
+    rng = np.random.default_rng(size * 7 + stride)
+    config = layer('Sequential', name='dw_only', layers=[
+        layer('InputLayer', name='input', batch_input_shape=[None, size, size, 16]),
+        layer('DepthwiseConv2D', name='dw', strides=[stride, stride], padding=padding, activation='linear'),
+    ])
+    weights = {
+        ('dw', 'depthwise_kernel'): rng.normal(size=(3, 3, 16, 1)).astype(np.float32),
+        ('dw', 'bias'): rng.normal(size=16).astype(np.float32),
+    }
+    x = rng.normal(size=(2, size, size, 16)).astype(np.float32)
+    expected = reference_depthwise(x, weights[('dw', 'depthwise_kernel')], weights[('dw', 'bias')],
+                                   (stride, stride), padding)
+    result = NumpyKerasModel.from_config(config, weights).predict(x)
+    np.testing.assert_allclose(result, expected, rtol=1e-4, atol=1e-4)
+
+
+def test_fused_network_matches_reference():
+    """BatchNorm、ReLU 與補零併入卷積後，結果仍與逐層計算相同"""
+    rng = np.random.default_rng(0)
+    config, weights = build_sequential(rng)
+    model = NumpyKerasModel.from_config(config, weights)
+    # Conv+BN+ReLU、補零+Depthwise+BN+ReLU6、Conv、GAP、Dense
+    assert [type(op).__name__ for op in model.ops] == ['_Conv', '_DepthwiseConv', '_Conv', '_GlobalAvgPool', '_Dense']
+    assert model.input_shape == (None, 9, 9, 3)
+    assert model.num_classes == 3
+
+    x = rng.normal(size=(3, 9, 9, 3)).astype(np.float32)
+    result = model.predict(x)
+    np.testing.assert_allclose(result, reference_sequential(x, weights), rtol=1e-4, atol=1e-7)
+    np.testing.assert_allclose(result.sum(axis=1), 1.0, rtol=1e-5)
+    # 單張圖片（沒有批次維度）
+    np.testing.assert_allclose(model.predict(x[0]), result[:1], rtol=1e-5, atol=1e-6)
+
+
+def test_functional_add_and_unfused_batchnorm():
+    """Functional 圖：殘差相加，以及輸出有兩個使用者而不能併入卷積的 BatchNorm"""
+    rng = np.random.default_rng(1)
+    config = {'class_name': 'Functional', 'config': {
+        'name': 'residual',
+        'layers': [
+            {'class_name': 'InputLayer', 'name': 'in', 'inbound_nodes': [],
+             'config': {'name': 'in', 'batch_input_shape': [None, 6, 6, 3]}},
+            {'class_name': 'Conv2D', 'name': 'conv', 'inbound_nodes': [[['in', 0, 0, {}]]],
+             'config': {'name': 'conv', 'filters': 3, 'strides': [1, 1], 'padding': 'same', 'activation': 'linear'}},
+            {'class_name': 'BatchNormalization', 'name': 'bn', 'inbound_nodes': [[['in', 0, 0, {}]]],
+             'config': {'name': 'bn', 'epsilon': 1e-3}},
+            {'class_name': 'Add', 'name': 'add', 'inbound_nodes': [[['conv', 0, 0, {}], ['bn', 0, 0, {}], ['in', 0, 0, {}]]],
+             'config': {'name': 'add'}},
+        ],
+        'input_layers': [['in', 0, 0]],
+        'output_layers': [['add', 0, 0]],
+    }}
+    weights = {
+        ('conv', 'kernel'): rng.normal(size=(3, 3, 3, 3)).astype(np.float32),
+        ('conv', 'bias'): rng.normal(size=3).astype(np.float32),
+    }
+    weights.update(batchnorm_weights(rng, 'bn', 3))
+    model = NumpyKerasModel.from_config(config, weights)
+    assert '_Affine' in [type(op).__name__ for op in model.ops]
+
+    x = rng.normal(size=(2, 6, 6, 3)).astype(np.float32)
+    bn = [weights[('bn', key)] for key in ('gamma', 'beta', 'moving_mean', 'moving_variance')]
+    expected = (reference_conv(x, weights[('conv', 'kernel')], weights[('conv', 'bias')], (1, 1), 'same')
+                + reference_batchnorm(x, *bn) + x)
+    np.testing.assert_allclose(model.predict(x), expected, rtol=1e-4, atol=1e-4)
+
+
+def test_flat_file_round_trip(tmp_path):
+    rng = np.random.default_rng(2)
+    config, weights = build_sequential(rng)
+    model = NumpyKerasModel.from_config(config, weights)
+    path = tmp_path / 'tiny.npkm'
+    model.save_flat(path, {'source_digest': 'abc123'})
+
+    loaded = NumpyKerasModel.from_flat(path)
+    assert loaded.metadata == {'source_digest': 'abc123'}
+    assert loaded.input_shape == model.input_shape
+    # 權重直接指向 mmap，不複製
+    assert not loaded.ops[0].kernel.flags.owndata
+    x = rng.normal(size=(2, 9, 9, 3)).astype(np.float32)
+    np.testing.assert_array_equal(loaded.predict(x), model.predict(x))
+    assert not list(tmp_path.glob('*.tmp'))
+
+
+def test_flat_file_rejects_other_files(tmp_path):
+    path = tmp_path / 'model.npkm'
+    path.write_bytes(b'not a flat weight file')
+    with pytest.raises(ValueError):
+        NumpyKerasModel.from_flat(path)
+
+
+# ---- 串口封包協定 ----
+
+def test_frame_round_trip_across_chunks():
+    frames = encode_frame(1, FRAME_CONF, bytes((85,))) + encode_frame(2, FRAME_ACK, bytes((7,))) + encode_frame(3, FRAME_STYLE)
+    decoder = FrameDecoder()
+    decoded = []
+    # 一次一個位元組送入，封包可以跨越任意的讀取邊界
+    for i in range(len(frames)):
+        decoded.extend(decoder.feed(frames[i:i + 1]))
+    assert decoded == [(1, FRAME_CONF, bytes((85,))), (2, FRAME_ACK, bytes((7,))), (3, FRAME_STYLE, b'')]
+    assert decoder.corrupt_frames == 0
+
+
+def test_frame_decoder_resyncs_after_corruption():
+    good = encode_frame(9, FRAME_STYLE, bytes((2,)))
+    corrupted = bytearray(encode_frame(8, FRAME_STYLE, bytes((1,))))
+    corrupted[-1] ^= 0xFF
+    decoder = FrameDecoder()
+    assert decoder.feed(b'\x00noise' + bytes(corrupted) + good) == [(9, FRAME_STYLE, bytes((2,)))]
+    assert decoder.corrupt_frames >= 1
+    assert not decoder.buffer
+
+
+def test_crc8_detects_single_bit_errors():
+    body = bytes((5, (FRAME_CONF << 4) | 1, 42))
+    checksum = crc8(body)
+    for bit in range(len(body) * 8):
+        flipped = bytearray(body)
+        flipped[bit // 8] ^= 1 << (bit % 8)
+        assert crc8(bytes(flipped)) != checksum
+
+
+# ---- 預測快取 ----
+
+def test_prediction_cache_lru():
+    cache = PredictionCache(max_entries=2)
+    cache.put('a', 'hat', 0.9)
+    cache.put('b', 'bag', 0.8)
+    assert cache.get('a') == ('hat', 0.9)  # a 變成最近使用
+    cache.put('c', 'shoe', 0.7)
+    assert 'b' not in cache
+    assert cache.get('a') == ('hat', 0.9)
+    assert cache.get('c') == ('shoe', 0.7)
+    assert cache.get('b') is None
+    assert (cache.hits, cache.misses) == (3, 1)
+
+
+def test_prediction_cache_persists_per_model_version(tmp_path):
+    path = str(tmp_path / 'cache' / 'predictions.json')
+    cache = PredictionCache(persist_path=path, namespace='v1')
+    cache.put('a', 'hat', 0.9)
+    cache.save()
+    assert not [name for name in os.listdir(tmp_path / 'cache') if name.endswith('.tmp')]
+
+    assert PredictionCache(persist_path=path, namespace='v1').get('a') == ('hat', 0.9)
+    # 模型更換後捨棄舊的快取
+    assert len(PredictionCache(persist_path=path, namespace='v2')) == 0
+    # 只保留最新的 max_entries 筆
+    for i in range(5):
+        cache.put(str(i), 'bag', 0.5)
+    cache.save()
+    reloaded = PredictionCache(max_entries=3, persist_path=path, namespace='v1')
+    assert len(reloaded) == 3 and '4' in reloaded and 'a' not in reloaded
+
+
+def test_prediction_cache_ignores_corrupt_file(tmp_path):
+    path = tmp_path / 'predictions.json'
+    path.write_text('{not json', encoding='utf-8')
+    assert len(PredictionCache(persist_path=str(path))) == 0
+
+
+def test_prediction_cache_saves_after_interval(tmp_path):
+    path = tmp_path / 'predictions.json'
+    cache = PredictionCache(persist_path=str(path), namespace='v1', persist_interval=0)
+    cache.put('a', 'hat', 0.9)
+    assert json.loads(path.read_text(encoding='utf-8'))['entries'] == [['a', 'hat', 0.9]]
+
+
+# ---- 上傳目錄清理 ----
+
+def age(path, seconds):
+    stamp = time.time() - seconds
+    os.utime(path, (stamp, stamp))
+
+
+def test_upload_storage_layout_and_dedup(tmp_path):
+    storage = UploadStorage(str(tmp_path))
+    digest = 'abcdef' + '0' * 58
+    relative = storage.store(b'x' * 100, digest, 'JPEG')
+    assert relative == f'ab/cd/{digest}.jpg'
+    assert storage.store(b'x' * 100, digest, 'JPEG') == relative
+    assert storage.usage()['files'] == 1 and storage.usage()['bytes'] == 100
+
+
+def test_upload_storage_sweeps_expired_and_partial_files(tmp_path):
+    evicted = []
+    storage = UploadStorage(str(tmp_path), max_age=3600, on_evict=evicted.append)
+    old = storage.store(b'o' * 10, 'aa' + '1' * 62, 'JPEG')
+    new = storage.store(b'n' * 10, 'bb' + '2' * 62, 'PNG')
+    age(tmp_path / old, 7200)
+    partial = tmp_path / 'bb' / '22' / 'upload.part'
+    partial.write_bytes(b'p')
+    age(partial, PARTIAL_FILE_MAX_AGE + 1)
+
+    assert storage.sweep() == 2
+    assert not (tmp_path / old).exists() and not partial.exists()
+    assert (tmp_path / new).exists()
+    # 暫存檔被清除時不呼叫回調；空的分層目錄一併移除
+    assert evicted == [old]
+    assert not (tmp_path / 'aa').exists()
+    assert storage.usage()['files'] == 1 and storage.usage()['evicted_files'] == 2
+
+
+def test_upload_storage_trims_oldest_over_quota(tmp_path):
+    storage = UploadStorage(str(tmp_path), max_bytes=1000)
+    paths = [storage.store(bytes(300), f'{i:02d}' + '3' * 62, 'JPEG') for i in range(4)]
+    for i, path in enumerate(paths):
+        age(tmp_path / path, 100 - i)
+
+    # 1200 bytes 超過上限，從最舊的刪到不超過 900 bytes
+    assert storage.sweep() == 1
+    assert [(tmp_path / path).exists() for path in paths] == [False, True, True, True]
+    assert storage.usage()['bytes'] == 900
+
+
+def test_upload_storage_counts_and_evicts_derived_files(tmp_path):
+    root, derived_root = tmp_path / 'uploads', tmp_path / 'variants' / 'uploads'
+    storage = UploadStorage(str(root), max_bytes=1000, derived_root=str(derived_root))
+    digests = [f'{i:02d}' + '4' * 62 for i in range(2)]
+    derived = []
+    for i, digest in enumerate(digests):
+        relative = storage.store(bytes(200), digest, 'JPEG')
+        variant = derived_root / os.path.dirname(relative) / f'{digest}.240w.webp'
+        variant.parent.mkdir(parents=True, exist_ok=True)
+        variant.write_bytes(bytes(250))
+        storage.add_derived([str(variant)])
+        age(root / relative, 100 - i)
+        derived.append(variant)
+    orphan = derived_root / 'ff' / 'ff' / ('ff' * 32 + '.240w.jpg')
+    orphan.parent.mkdir(parents=True)
+    orphan.write_bytes(bytes(10))
+    age(orphan, PARTIAL_FILE_MAX_AGE + 1)
+
+    assert storage.usage()['bytes'] == 900
+    assert storage.sweep() == 0
+    assert storage.usage()['derived_bytes'] == 500
+    # 原圖與衍生檔合計超過上限時一起清除
+    storage.max_bytes = 800
+    assert storage.sweep() == 1
+    assert [variant.exists() for variant in derived] == [False, True]
+    assert not orphan.exists() and not (derived_root / 'ff').exists()
+    assert storage.usage()['bytes'] == 450 and storage.usage()['derived_bytes'] == 250
+
+
+# ---- 准入控制與速率限制 ----
+
+def test_admission_sheds_when_queue_full():
+    admission = AdmissionController(max_active=1, max_waiting=0, max_wait=1.0, retry_after=3)
+    assert admission.enter() == 0.0
+    with pytest.raises(Overloaded) as excinfo:
+        admission.enter()
+    assert excinfo.value.reason == 'queue_full' and excinfo.value.retry_after == 3
+    admission.leave()
+    assert admission.try_enter()
+    assert admission.stats()['shed'] == {'queue_full': 1, 'timeout': 0}
+
+
+def test_admission_times_out_and_hands_over_slots():
+    admission = AdmissionController(max_active=1, max_waiting=2, max_wait=0.05)
+    admission.enter()
+    start = time.monotonic()
+    with pytest.raises(Overloaded) as excinfo:
+        admission.enter()
+    assert excinfo.value.reason == 'timeout' and time.monotonic() - start >= 0.05
+
+    # 空位釋放時喚醒排隊中的線程
+    admission.max_wait = 5.0
+    waited = []
+    waiter = threading.Thread(target=lambda: waited.append(admission.enter()))
+    waiter.start()
+    while admission.waiting == 0:
+        time.sleep(0.001)
+    admission.leave()
+    waiter.join(1.0)
+    assert waited and waited[0] > 0
+    assert admission.active == 1 and admission.waiting == 0
+
+
+def test_admission_async_waiters_share_slots_with_threads():
+    admission = AdmissionController(max_active=1, max_waiting=1, max_wait=0.05)
+
+    async def scenario():
+        admission.enter()
+        with pytest.raises(Overloaded):
+            await admission.enter_async()
+        admission.max_wait = 5.0
+        task = asyncio.ensure_future(admission.enter_async())
+        await asyncio.sleep(0.01)
+        # 另一個線程釋放空位
+        threading.Thread(target=admission.leave).start()
+        waited = await asyncio.wait_for(task, 1.0)
+        # 取消排隊中的協程不會留下空位或排隊數
+        cancelled = asyncio.ensure_future(admission.enter_async())
+        await asyncio.sleep(0.01)
+        cancelled.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await cancelled
+        return waited
+
+    assert asyncio.run(scenario()) > 0
+    assert admission.active == 1 and admission.waiting == 0
+    assert admission.stats()['shed']['timeout'] == 1
+
+
+def test_rate_limiter_token_bucket():
+    limiter = RateLimiter(rate=10, burst=2, max_clients=2)
+    limiter.acquire('a')
+    limiter.acquire('a')
+    with pytest.raises(Overloaded) as excinfo:
+        limiter.acquire('a')
+    assert excinfo.value.reason == 'rate_limited' and 0 < excinfo.value.retry_after <= 0.1
+    # 其他用戶端不受影響；超過追蹤上限時淘汰最久沒有請求的用戶端
+    assert limiter.check('b') == 0
+    assert limiter.check('c') == 0
+    assert len(limiter) == 2 and limiter.limited == 1
+    time.sleep(0.1)
+    assert limiter.check('c') == 0
@@ -0,0 +1,281 @@
+import logging
+import os
+import threading
+import time
+from typing import Callable, Iterable, Optional
+
+from image_io import EXTENSIONS, persist_upload
+
+logger = logging.getLogger(__name__)
+
+PARTIAL_FILE_MAX_AGE = 3600  # 寫到一半的暫存檔超過此秒數就清除
+
+
+class UploadStorage:
+    def __init__(self, root: str, max_age: float = 7 * 24 * 3600, max_bytes: int = 512 * 1024 * 1024,
+                 sweep_interval: float = 600.0, on_evict: Optional[Callable[[str], None]] = None,
+                 derived_root: Optional[str] = None):
+        """
+        上傳圖片的儲存管理：依摘要分層存放，並在背景依保存期限與容量上限清除舊檔
+
+        檔案存放在 root/ab/cd/abcd....jpg（取摘要前兩組字元作為子目錄），
+        單一目錄內的檔案數量維持在可控範圍。衍生檔（縮圖等）放在 derived_root 下相同的
+        分層目錄，檔名以摘要開頭（ab/cd/abcd....240w.webp），與原圖合計容量並一起清除。
+
+        Args:
+            root: 上傳目錄
+            max_age: 檔案保存期限（秒），以最後一次上傳的時間計算
+            max_bytes: 上傳目錄的容量上限，超過時從最舊的檔案開始刪除
+            sweep_interval: 背景清理的間隔（秒）
+            on_evict: 檔案被刪除後的回調函數，參數為相對於 root 的路徑
+            derived_root: 衍生檔目錄；指定時衍生檔的大小計入容量上限
+        """
+        self.root = root
+        self.max_age = max_age
+        self.max_bytes = max_bytes
+        self.sweep_interval = sweep_interval
+        self.on_evict = on_evict
+        self.derived_root = derived_root
+        self.running = False
+        self.sweep_thread: Optional[threading.Thread] = None
+        self._stop_event = threading.Event()
+        self._sweep_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+
+        # 統計資料
+        self.file_count = 0
+        self.total_bytes = 0
+        self.derived_bytes = 0
+        self.evicted_files = 0
+        self.evicted_bytes = 0
+        self.last_sweep: Optional[float] = None
+        self.last_sweep_duration = 0.0
+
+        os.makedirs(root, exist_ok=True)
+
+    @staticmethod
+    def relative_path(digest: str, extension: str) -> str:
+        """摘要對應的相對路徑，例如 ab/cd/abcd....jpg"""
+        return f"{digest[:2]}/{digest[2:4]}/{digest}.{extension}"
+
+    def store(self, data: bytes, digest: str, fmt: str) -> str:
+        """
+        保存上傳圖片；相同內容已存在時只更新修改時間，延長保存期限
+
+        Returns:
+            str: 相對於 root 的路徑
+        """
+        relative = self.relative_path(digest, EXTENSIONS[fmt])
+        filepath = os.path.join(self.root, relative)
+        if os.path.exists(filepath):
+            try:
+                os.utime(filepath)
+                return relative
+            except FileNotFoundError:
+                # 剛好被背景清理刪除，重新寫入
+                pass
+
+        folder = os.path.dirname(filepath)
+        for attempt in range(2):
+            os.makedirs(folder, exist_ok=True)
+            try:
+                persist_upload(data, digest, fmt, folder)
+                break
+            except FileNotFoundError:
+                # 空的分層目錄可能剛好被清理線程移除
+                if attempt:
+                    raise
+        with self._stats_lock:
+            self.file_count += 1
+            self.total_bytes += len(data)
+        return relative
+
+    def add_derived(self, paths: Iterable[str]) -> None:
+        """將新產生的衍生檔計入使用量（下一次清理時會重新統計）"""
+        size = 0
+        for path in paths:
+            try:
+                size += os.path.getsize(path)
+            except OSError:
+                continue
+        with self._stats_lock:
+            self.total_bytes += size
+            self.derived_bytes += size
+
+    def start(self) -> None:
+        """啟動背景清理線程；啟動時會先執行一次清理"""
+        if self.running:
+            return
+        self.running = True
+        self._stop_event.clear()
+        self.sweep_thread = threading.Thread(target=self._run, name='upload-sweeper')
+        self.sweep_thread.daemon = True
+        self.sweep_thread.start()
+
+    def stop(self) -> None:
+        self.running = False
+        self._stop_event.set()
+        if self.sweep_thread:
+            self.sweep_thread.join(timeout=5.0)
+
+    def _run(self) -> None:
+        while self.running:
+            try:
+                self.sweep()
+            except Exception as e:
+                logger.error(f"清理上傳目錄時發生錯誤：{str(e)}")
+            # 以 Event 等待，停止時可以立即醒來
+            self._stop_event.wait(self.sweep_interval)
+
+    def _scan(self, root: str):
+        """遞迴列出目錄下的所有檔案：(修改時間, 大小, 完整路徑)"""
+        entries = []
+        stack = [root]
+        while stack:
+            directory = stack.pop()
+            try:
+                with os.scandir(directory) as it:
+                    for entry in it:
+                        if entry.is_dir(follow_symlinks=False):
+                            stack.append(entry.path)
+                        elif entry.is_file(follow_symlinks=False):
+                            stat = entry.stat(follow_symlinks=False)
+                            entries.append((stat.st_mtime, stat.st_size, entry.path))
+            except FileNotFoundError:
+                continue
+        return entries
+
+    @staticmethod
+    def _key(path: str, root: str) -> str:
+        """原圖與衍生檔共用的識別：分層目錄加上第一個句點前的檔名（即摘要）"""
+        relative = os.path.relpath(path, root)
+        directory, name = os.path.split(relative)
+        return os.path.join(directory, name.split('.', 1)[0])
+
+    @staticmethod
+    def _unlink(path: str) -> bool:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            return False
+        except OSError as e:
+            logger.error(f"刪除上傳檔案時發生錯誤：{str(e)}")
+            return False
+        return True
+
+    def _remove(self, path: str, size: int, derived=()) -> bool:
+        """刪除原圖與它的衍生檔；size 為兩者合計的大小"""
+        if not self._unlink(path):
+            return False
+        for _, derived_path in derived:
+            self._unlink(derived_path)
+        with self._stats_lock:
+            self.evicted_files += 1
+            self.evicted_bytes += size
+        if self.on_evict and not path.endswith('.part'):
+            relative = os.path.relpath(path, self.root).replace(os.sep, '/')
+            try:
+                self.on_evict(relative)
+            except Exception as e:
+                logger.error(f"執行清除回調時發生錯誤：{str(e)}")
+        return True
+
+    def sweep(self) -> int:
+        """
+        清除過期檔案，並在超過容量上限時從最舊的檔案開始刪除，直到低於上限的 90%
+
+        Returns:
+            int: 刪除的檔案數
+        """
+        with self._sweep_lock:
+            start = time.monotonic()
+            now = time.time()
+            derived = {}
+            derived_removed = []
+            if self.derived_root:
+                for mtime, size, path in self._scan(self.derived_root):
+                    if path.endswith('.part'):
+                        if now - mtime > PARTIAL_FILE_MAX_AGE and self._unlink(path):
+                            derived_removed.append(path)
+                        continue
+                    derived.setdefault(self._key(path, self.derived_root), []).append((mtime, size, path))
+
+            kept = []
+            removed = []
+            for mtime, size, path in self._scan(self.root):
+                files = [] if path.endswith('.part') else [
+                    (derived_size, derived_path)
+                    for _, derived_size, derived_path in derived.pop(self._key(path, self.root), [])
+                ]
+                total_size = size + sum(derived_size for derived_size, _ in files)
+                limit = PARTIAL_FILE_MAX_AGE if path.endswith('.part') else self.max_age
+                if now - mtime > limit:
+                    if self._remove(path, total_size, files):
+                        removed.append(path)
+                        derived_removed.extend(derived_path for _, derived_path in files)
+                else:
+                    kept.append((mtime, total_size, path, files))
+
+            # 原圖已不存在的衍生檔；剛上傳的圖片可能在兩次掃描之間才寫入，所以只清除較舊的
+            for files in derived.values():
+                for mtime, size, path in files:
+                    if now - mtime > PARTIAL_FILE_MAX_AGE and self._unlink(path):
+                        derived_removed.append(path)
+
+            total = sum(size for _, size, _, _ in kept)
+            derived_total = sum(size for *_, files in kept for size, _ in files)
+            remaining = len(kept)
+            if total > self.max_bytes:
+                target = self.max_bytes * 0.9
+                kept.sort(key=lambda entry: entry[0])
+                for mtime, size, path, files in kept:
+                    if total <= target:
+                        break
+                    if self._remove(path, size, files):
+                        removed.append(path)
+                        derived_removed.extend(derived_path for _, derived_path in files)
+                        total -= size
+                        derived_total -= sum(derived_size for derived_size, _ in files)
+                        remaining -= 1
+
+            self._prune_empty_dirs(removed, self.root)
+            if self.derived_root:
+                self._prune_empty_dirs(derived_removed, self.derived_root)
+            with self._stats_lock:
+                self.file_count = remaining
+                self.total_bytes = total
+                self.derived_bytes = derived_total
+                self.last_sweep = now
+                self.last_sweep_duration = time.monotonic() - start
+        if removed:
+            logger.info(f"已清除 {len(removed)} 個上傳檔案，目前使用 {total / (1024 * 1024):.1f} MB")
+        return len(removed)
+
+    @staticmethod
+    def _prune_empty_dirs(removed, root: str) -> None:
+        """移除清理後變成空的分層目錄"""
+        directories = {os.path.dirname(path) for path in removed}
+        # 由深到淺處理，子目錄刪除後上層目錄也可能變成空的
+        for directory in sorted(directories | {os.path.dirname(d) for d in directories}, key=len, reverse=True):
+            if os.path.abspath(directory) == os.path.abspath(root):
+                continue
+            try:
+                os.rmdir(directory)
+            except OSError:
+                # 目錄不是空的或已被刪除
+                pass
+
+    def usage(self) -> dict:
+        """目前的使用量統計（檔案數與大小為最近一次清理後加上新寫入的數值，大小包含衍生檔）"""
+        with self._stats_lock:
+            return {
+                'files': self.file_count,
+                'bytes': self.total_bytes,
+                'derived_bytes': self.derived_bytes,
+                'max_bytes': self.max_bytes,
+                'max_age_seconds': self.max_age,
+                'evicted_files': self.evicted_files,
+                'evicted_bytes': self.evicted_bytes,
+                'last_sweep': self.last_sweep,
+                'last_sweep_duration_ms': self.last_sweep_duration * 1000,
+            }